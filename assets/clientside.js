@@ -0,0 +1,134 @@
+// Clientside callbacks for pure UI state (visibility toggles and date labels) and the bulk profile
+// file upload. Registered from nespreso_viz.py with ClientsideFunction('nespreso', <name>); they run
+// in the browser, so only callbacks that touch data reach the server.
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    nespreso: {
+        toggle_about: function (n_clicks, is_open) {
+            if (!n_clicks) {
+                return window.dash_clientside.no_update;
+            }
+            return !is_open;
+        },
+
+        toggle_satellite_visibility: function (show_all_value, selected_field) {
+            var showAll = Array.isArray(show_all_value) && show_all_value.indexOf('all') !== -1;
+            var hidden = {'display': 'none'};
+            // Single mode: always show first-slot graph only
+            return showAll ? [{}, {}, {}] : [{}, hidden, hidden];
+        },
+
+        toggle_field_selector_visibility: function (show_all_value) {
+            var showAll = Array.isArray(show_all_value) && show_all_value.indexOf('all') !== -1;
+            return showAll ? {'display': 'none'} : {};
+        },
+
+        // Inputs are selection stores (points, lines, regions); shown as soon as any is non-empty
+        has_selection: function (selections) {
+            return selections.some(function (selection) {
+                return Boolean(selection) && !(Array.isArray(selection) && selection.length === 0)
+                    && !(typeof selection === 'object' && Object.keys(selection).length === 0);
+            });
+        },
+
+        toggle_instructions: function () {
+            var hasSelection = window.dash_clientside.nespreso.has_selection(Array.prototype.slice.call(arguments));
+            var instructions = {'padding': '6px', 'fontStyle': 'italic'};
+            if (hasSelection) {
+                instructions['display'] = 'none';
+            }
+            return [instructions, hasSelection ? {} : {'display': 'none'}];
+        },
+
+        toggle_row: function () {
+            var hasSelection = window.dash_clientside.nespreso.has_selection(Array.prototype.slice.call(arguments));
+            return hasSelection ? {} : {'display': 'none'};
+        },
+
+        toggle_custom_mode: function (mode) {
+            var isProfile = (mode !== 'grid');
+            var hidden = {'display': 'none'};
+            return [isProfile ? {} : hidden, isProfile ? hidden : {}];
+        },
+
+        // Formats 'YYYY-MM-DD' like Python's strftime('%b %d, %Y'); null if not a date string
+        format_date: function (date_str) {
+            var months = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+            var m = /^(\d{4})-(\d{2})-(\d{2})$/.exec(date_str || '');
+            if (!m || Number(m[2]) < 1 || Number(m[2]) > 12) {
+                return null;
+            }
+            return months[Number(m[2]) - 1] + ' ' + m[3] + ', ' + m[1];
+        },
+
+        update_title: function (cur_date_str) {
+            var label = window.dash_clientside.nespreso.format_date(cur_date_str);
+            return 'Satellite fields for ' + (label === null ? cur_date_str : label);
+        },
+
+        update_custom_request_title: function (cur_date_str) {
+            var label = window.dash_clientside.nespreso.format_date(cur_date_str);
+            return 'Custom request - Current date: ' + (label === null ? cur_date_str : label);
+        },
+
+        update_download_button_text: function (cur_date_str) {
+            var label = window.dash_clientside.nespreso.format_date(cur_date_str);
+            return label === null ? 'Download NeSPReSO data' : 'Download NeSPReSO data for ' + label;
+        },
+
+        // Hidden file input for bulk profile uploads, kept outside the Dash layout
+        bulk_file_input: function () {
+            var input = document.getElementById('bulk_file_input');
+            if (!input) {
+                input = document.createElement('input');
+                input.type = 'file';
+                input.id = 'bulk_file_input';
+                input.accept = '.csv,.txt,.parquet,.pq';
+                input.style.display = 'none';
+                document.body.appendChild(input);
+            }
+            input.value = '';
+            return input;
+        },
+
+        // Posts the chosen point file to the bulk route as multipart form data, so the file never
+        // passes through Dash state. Returns [job, status text, poll disabled, download link style];
+        // the server-side poll_bulk_profiles callback then follows the job.
+        upload_bulk_file: function (n_clicks, cur_date_str) {
+            var noUpdate = window.dash_clientside.no_update;
+            var hidden = {'display': 'none'};
+            if (!n_clicks) {
+                return [noUpdate, noUpdate, noUpdate, noUpdate];
+            }
+            var input = window.dash_clientside.nespreso.bulk_file_input();
+            return new Promise(function (resolve) {
+                input.onchange = function () { resolve(input.files[0] || null); };
+                input.oncancel = function () { resolve(null); };
+                input.click();
+            }).then(function (file) {
+                if (!file) {
+                    return [noUpdate, noUpdate, noUpdate, noUpdate];
+                }
+                window.dash_clientside.set_props('bulk_status', {children: 'Uploading ' + file.name + '...'});
+                window.dash_clientside.set_props('bulk_link', {style: hidden});
+                var form = new FormData();
+                form.append('file', file);
+                if (cur_date_str) {
+                    form.append('date', cur_date_str);
+                }
+                var config = JSON.parse(document.getElementById('_dash-config').textContent);
+                return fetch(config.requests_pathname_prefix + 'custom/profiles/bulk',
+                             {method: 'POST', body: form, credentials: 'same-origin'})
+                    .then(function (response) { return response.json(); })
+                    .then(function (body) {
+                        if (!body.key) {
+                            var error = body.error || 'Upload failed';
+                            return [null, body.summary ? body.summary + ' - ' + error : error, true, hidden];
+                        }
+                        return [{key: body.key, summary: body.summary}, body.summary + ' - fetching profiles...', false, hidden];
+                    });
+            }).catch(function (err) {
+                return [null, 'Upload failed: ' + err, true, hidden];
+            });
+        }
+    }
+});
@@ -24,19 +24,29 @@ else
     echo ""
 fi
 
-echo "3. Testing local HTTP response..."
-response=$(curl -s -o /dev/null -w "%{http_code}" --connect-timeout 5 http://146.201.220.16:8050/ 2>/dev/null)
-if [ "$response" = "200" ]; then
-    echo "✓ Application responds with HTTP 200"
+echo "3. Checking health and readiness..."
+VIZ_URL=${NESPRESO_VIZ_URL:-http://127.0.0.1:8050/nespreso_viz}
+health=$(curl -s -o /dev/null -w "%{http_code}" --max-time 5 "$VIZ_URL/healthz" 2>/dev/null)
+if [ "$health" = "200" ]; then
+    echo "✓ $VIZ_URL/healthz responds with HTTP 200"
 else
-    echo "✗ Application not responding properly (HTTP $response)"
+    echo "✗ Application not responding properly (healthz HTTP $health)"
 fi
+ready_body=$(curl -s --max-time 5 -w "\n%{http_code}" "$VIZ_URL/readyz?strict=1" 2>/dev/null)
+ready=$(echo "$ready_body" | tail -1)
+if [ "$ready" = "200" ]; then
+    echo "✓ Ready: data current, default date warm, upstream APIs reachable"
+else
+    echo "✗ Not ready or degraded (readyz HTTP $ready):"
+fi
+echo "$ready_body" | sed '$d' | python3 -m json.tool 2>/dev/null || echo "$ready_body" | sed '$d'
 echo ""
 
 echo "4. Checking recent logs..."
-if [ -f "nespreso_viz.log" ]; then
+LOG_FILE=${NESPRESO_VIZ_LOG:-wsgi.log}
+if [ -f "$LOG_FILE" ]; then
     echo "Recent log entries:"
-    tail -10 nespreso_viz.log
+    tail -10 "$LOG_FILE"
 else
     echo "No log file found"
 fi
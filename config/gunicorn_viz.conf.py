@@ -2,6 +2,7 @@
 """
 Gunicorn configuration file for NeSPReSO Visualization
 """
+import os
 
 # Server socket
 bind = "0.0.0.0:8050"
@@ -11,8 +12,6 @@ backlog = 2048
 workers = 1  # Dash apps work better with fewer workers
 worker_class = "sync"
 worker_connections = 1000
-max_requests = 1000
-max_requests_jitter = 50
 preload_app = True  # Important for Dash apps
 
 # Timeouts
@@ -38,6 +37,17 @@ user = None
 group = None
 tmp_upload_dir = None
 
-# Memory management
-max_requests = 500  # Restart workers more frequently for memory management
+# Memory management: workers keep their caches within NESPRESO_MEMORY_BUDGET_MB (viz_utils/memory.py,
+# half of the host or container memory by default) instead of being recycled. Without a budget
+# (NESPRESO_MEMORY_BUDGET_MB=0) workers are recycled every 1000 requests; NESPRESO_MAX_REQUESTS overrides
+from viz_utils.memory import memory_budget_bytes
+
+max_requests = int(os.environ.get('NESPRESO_MAX_REQUESTS', '0' if memory_budget_bytes() > 0 else '1000'))
 max_requests_jitter = 50
+
+
+# Server hooks
+def post_fork(server, worker):
+    # With preload_app the app is already imported; warm this worker's caches in the background
+    from nespreso_viz import warmup
+    warmup.start()
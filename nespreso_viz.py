@@ -2,9 +2,8 @@
 #!/bin/env python3
 # /etc/httpd/conf/ozavala_custom_wsgi.conf
 import dash
-from dash import Input, Output, State, html, dcc
-import plotly.graph_objs as go
-import cmocean.cm as cm
+from dash import Input, Output, State, ClientsideFunction, html, dcc
+import plotly.io as pio
 import dash_bootstrap_components as dbc
 import numpy as np
 import xarray as xr
@@ -12,71 +11,73 @@ import numpy as np
 from viz_utils.update_prof import Profiles
 from viz_utils.styles import NespresoStyles
 from viz_utils.update_trans import Transects
-from viz_utils.update_main import MainFigures
-from datetime import datetime
+from viz_utils.update_main import (MainFigures, MAP_FIELDS, SATELLITE_FIELDS, read_map_slice, viewport_from_relayout,
+                                   viewport_needs_render, compute_derived_maps, DERIVED_MAX_DEPTH)
+from viz_utils.tiles import FieldPyramid, pyramid_cache, tile_cache, tile_etag
+from viz_utils.coalesce import BuildCache, timed_callback
+from viz_utils.regions import region_from_selection, region_label
+from viz_utils.catalog import DATA_DIR, scan_available_dates, derived_sidecar_path, read_derived_sidecar, source_version
+from viz_utils.figure_cache import FigureCache, default_cache_dir
+from viz_utils.transport import configure_json_engine, install_compression
+from viz_utils.metrics import metrics, install_metrics
+from viz_utils.profiling import profiler, install_profiling
+from viz_utils.memory import memory, install_memory
+from viz_utils.health import install_health
+from viz_utils.warmup import warmup, initial_callback_args
+from viz_utils.raster import image_cache
+from viz_utils.export import exporter, install_export, parse_export_args
+from viz_utils.points import BulkProfiles, install_bulk_profiles, parse_points_text, default_bulk_dir
+from viz_utils.animation import (animation_jobs, frames_figure, depth_scan_figure, depth_levels, read_depth_stack,
+                                 quantize_stack, decimation_factor, decimate_coords)
+from datetime import datetime, timezone
 import calendar
+import logging
 import os
 import re
-from functools import lru_cache
+import time
 import base64
 import io
 import requests
 from flask import request as flask_request, Response
 
+logger = logging.getLogger('nespreso_viz')
+if __name__ == '__main__':
+    # Under gunicorn, wsgi.py routes the logs to its rotating file
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s [%(levelname)s] %(name)s: %(message)s')
+
 # %% Make a basic dash interface to explore a NetCDF file
 
 ### Load available NetCDF files and default to the latest date
-file_path = "/Net/work/ozavala/DATA/SubSurfaceFields/NeSPReSO"
+file_path = DATA_DIR
 API_UPSTREAM_URL = os.environ.get('NESPRESO_UPSTREAM_URL', 'https://ozavala.coaps.fsu.edu/nespreso_profile')
 API_GRID_UPSTREAM_URL = os.environ.get('NESPRESO_GRID_UPSTREAM_URL', 'https://ozavala.coaps.fsu.edu/nespreso_grid')
 
-date_regex = re.compile(r"nespreso_grid_(\d{4}-\d{2}-\d{2})\.nc$")
-
-def _scan_available_dates(directory: str):
-    try:
-        candidates = [f for f in os.listdir(directory) if f.endswith('.nc')]
-    except Exception as exc:
-        print(f"Failed listing directory {directory}: {exc}")
-        candidates = []
-    date_to_file = {}
-    for fname in candidates:
-        m = date_regex.search(fname)
-        if not m:
-            continue
-        date_str = m.group(1)
-        full_path = os.path.join(directory, fname)
-        # Keep the last occurrence if duplicates; they should point to same day
-        date_to_file[date_str] = full_path
-    sorted_dates = sorted(date_to_file.keys())
-    # Convert to numpy datetime64[D]
-    days = np.array([np.datetime64(d, 'D') for d in sorted_dates]) if sorted_dates else np.array([np.datetime64('2020-01-01')])
-    return date_to_file, days
-
-DATE_TO_FILE, dates = _scan_available_dates(file_path)
+DATE_TO_FILE, dates = scan_available_dates(file_path)
 if dates.size == 0:
     # Fallback: try a known file
     default_file_name = '/Net/work/ozavala/DATA/SubSurfaceFields/NeSPReSO/nespreso_grid_2020-01-01.nc'
     ds = xr.open_dataset(default_file_name)
     dates = np.atleast_1d(ds['time'].values)
-    print(f"Fallback time entries detected: {len(dates)}")
+    logger.info("Fallback time entries detected: %d", len(dates))
 else:
     default_date_np = dates.max()
     default_date_str = str(default_date_np.astype('datetime64[D]'))
     default_file_name = DATE_TO_FILE.get(default_date_str)
     ds = xr.open_dataset(default_file_name)
-    print(f"Loaded default dataset for {default_date_str}: {default_file_name}")
+    logger.info("Loaded default dataset for %s: %s", default_date_str, default_file_name)
 
 has_time_dim = len(dates) > 1
 start_date = str(dates.max().astype('datetime64[D]')) if dates.size > 0 else '2024-04-01'
 styles_obj = NespresoStyles(dates, start_date)
-# Instantiate default objects for initial render
-prof_obj = Profiles(ds, styles_obj)
-trans_obj = Transects(ds, styles_obj)
-mainfigs_obj = MainFigures(ds, styles_obj)
 
-# Lightweight cache for datasets by date
-@lru_cache(maxsize=16)
+# Lightweight cache for datasets by date. Variables read through a cached dataset stay in memory with it,
+# so it is an LRU the memory budget (viz_utils/memory.py) can inspect and evict
+dataset_cache = BuildCache(maxsize=16)
+
 def get_ds_for_date(date_str: str):
+    return dataset_cache.get_or_build(date_str, lambda: open_ds_for_date(date_str))
+
+def open_ds_for_date(date_str: str):
     path = DATE_TO_FILE.get(date_str)
     if path is None:
         # Choose nearest available date
@@ -86,17 +87,84 @@ def get_ds_for_date(date_str: str):
         nearest_idx = int(np.argmin(np.abs(dates - target)))
         use_date = str(dates[nearest_idx].astype('datetime64[D]'))
         path = DATE_TO_FILE.get(use_date)
-        print(f"Requested date {date_str} not found, using nearest {use_date}")
+        logger.info("Requested date %s not found, using nearest %s", date_str, use_date)
     try:
+        start = time.perf_counter()
         cur_ds = xr.open_dataset(path)
+        metrics.observe('nespreso_dataset_load_seconds', time.perf_counter() - start, {'stage': 'open'})
         return cur_ds
     except Exception as exc:
-        print(f"Failed to open dataset {path}: {exc}")
+        logger.error("Failed to open dataset %s: %s", path, exc)
         return ds
 
-def get_objs_for_date(date_str: str):
+# Derived products (MLD, D26, D20, TCHP) per date. Read from the sidecar written by
+# tools/precompute_derived.py when it is current, otherwise computed once and reused by every view
+derived_cache = BuildCache(maxsize=16)
+
+def get_derived_for_date(date_str: str):
+    return derived_cache.get_or_build(date_str, lambda: load_derived_for_date(date_str))
+
+def load_derived_for_date(date_str: str):
+    grid_path = DATE_TO_FILE.get(date_str)
+    if grid_path is not None:
+        derived_maps = read_derived_sidecar(derived_sidecar_path(grid_path, date_str), grid_path, DERIVED_MAX_DEPTH)
+        if derived_maps is not None:
+            return derived_maps
     cur_ds = get_ds_for_date(date_str)
-    return MainFigures(cur_ds, styles_obj), Profiles(cur_ds, styles_obj), Transects(cur_ds, styles_obj)
+    return compute_derived_maps(cur_ds, max_depth=DERIVED_MAX_DEPTH)
+
+# Figure objects per date, shared by all the callbacks a date change fires. The first callback
+# builds them (one read of the day's file); concurrent callbacks for the same day wait for that build
+day_views = BuildCache(maxsize=int(os.environ.get('NESPRESO_DAY_CACHE', '4')))
+
+def get_objs_for_date(date_str: str):
+    def build():
+        start = time.perf_counter()
+        # Load the day once; MainFigures, Profiles and Transects then share the in-memory arrays
+        cur_ds = get_ds_for_date(date_str).compute()
+        objs = (MainFigures(cur_ds, styles_obj), Profiles(cur_ds, styles_obj), Transects(cur_ds, styles_obj))
+        elapsed = time.perf_counter() - start
+        metrics.observe('nespreso_dataset_load_seconds', elapsed, {'stage': 'prepare'})
+        logger.info("prepared figure objects date=%s ms=%.1f", date_str, elapsed*1000)
+        return objs
+    return day_views.get_or_build(date_str, build)
+
+def resolve_date(cur_date_str, date_idx=None):
+    """Date key, figure objects and time index (clamped to the day's file) for the callback inputs."""
+    date_key = cur_date_str if isinstance(cur_date_str, str) and len(cur_date_str) == 10 else start_date
+    objs = get_objs_for_date(date_key)
+    try:
+        n_times = objs[0].temp.shape[0]
+        local_idx = min(max(int(date_idx) if date_idx is not None else 0, 0), n_times - 1)
+    except Exception:
+        local_idx = 0
+    return date_key, objs, local_idx
+
+# Prepare the default day at startup so the first page load does not pay for it
+get_objs_for_date(start_date)
+
+# Serialised figures shared across users and workers. Keys include the day's file version, so a
+# reprocessed file is picked up without clearing the cache. NESPRESO_FIGURE_CACHE_MB=0 disables it
+FIGURE_CACHE_MB = float(os.environ.get('NESPRESO_FIGURE_CACHE_MB', '256'))
+figure_cache = FigureCache(
+    max_bytes=int(FIGURE_CACHE_MB*2**20),
+    directory=os.environ.get('NESPRESO_FIGURE_CACHE_DIR', default_cache_dir()) or None,
+    disk_max_bytes=int(float(os.environ.get('NESPRESO_FIGURE_CACHE_DISK_MB', '1024'))*2**20),
+)
+
+def date_version(cur_date_str):
+    date_key = cur_date_str if isinstance(cur_date_str, str) and len(cur_date_str) == 10 else start_date
+    return date_key, source_version(DATE_TO_FILE.get(date_key, default_file_name))
+
+def cached_figure(func):
+    # Shared figure cache only, for figure builders that are not Dash callbacks (warm-up can not replay them)
+    if FIGURE_CACHE_MB > 0:
+        func = figure_cache.cached(date_version)(func)
+    return func
+
+def cached_figures(func):
+    # Recorded outside the cache so warm-up replays fill it (viz_utils/warmup.py)
+    return warmup.recorded(cached_figure(func))
 
 currently_drawn_line_id = None
 
@@ -112,6 +180,69 @@ app = dash.Dash(__name__,
                 routes_pathname_prefix='/nespreso_viz/')
 server = app.server
 app.title = "NeSPReSO Dashboard"
+# Request metrics at /nespreso_viz/metrics, registered first so they see the compressed sizes
+install_metrics(server, metrics)
+for cache_name, cache in [('datasets', dataset_cache), ('derived', derived_cache), ('day_views', day_views),
+                          ('figures', figure_cache), ('map_images', image_cache), ('tiles', tile_cache),
+                          ('tile_pyramids', pyramid_cache)]:
+    metrics.register_cache(cache_name, cache)
+# Opt-in cProfile/tracemalloc of selected requests (NESPRESO_PROFILE*, NESPRESO_ADMIN_TOKEN)
+install_profiling(server, profiler, callback_map=app.callback_map)
+# Memory accounting at /nespreso_viz/admin/memory and the NESPRESO_MEMORY_BUDGET_MB budget, which evicts
+# caches in this order (cheapest to rebuild first) instead of recycling workers. The most recently used
+# day and the default date stay loaded
+for cache_name, cache, keep in [('map_images', image_cache, 0), ('tiles', tile_cache, 0), ('figures', figure_cache, 0),
+                                ('tile_pyramids', pyramid_cache, 0)]:
+    memory.register(cache_name, cache, keep=keep)
+for cache_name, cache in [('derived', derived_cache), ('day_views', day_views), ('datasets', dataset_cache)]:
+    memory.register(cache_name, cache, keep=1, pinned=lambda: (start_date,))
+install_memory(server, memory, check_token=profiler.check_token)
+# Load-balancer checks at /nespreso_viz/healthz and /nespreso_viz/readyz; slow probes are cached in the background.
+# The warm checks gate readiness once they have passed; later evictions of the default day are only reported
+install_health(
+    server,
+    newest_served=lambda: max(DATE_TO_FILE) if DATE_TO_FILE else None,
+    newest_on_disk=lambda: max(scan_available_dates(file_path)[0], default=None),
+    warm_checks={'default_dataset': lambda: start_date in dataset_cache, 'default_views': lambda: start_date in day_views,
+                 'warmup': lambda: warmup.complete},
+    upstreams={'profile_api': API_UPSTREAM_URL, 'grid_api': API_GRID_UPSTREAM_URL},
+    memory=memory,
+    details={'warmup': warmup.status},
+    max_age_days=int(os.environ.get('NESPRESO_MAX_DATA_AGE_DAYS', '2')),
+    probe_ttl=float(os.environ.get('NESPRESO_UPSTREAM_PROBE_S', '60')),
+)
+# Warm-up of the default date, the default figure set and the most requested recent figures, run in the
+# background of each worker (gunicorn post_fork, or its first request); /readyz waits for it
+def prepare_date(date_str):
+    get_ds_for_date(date_str)
+    get_derived_for_date(date_str)
+    get_objs_for_date(date_str)
+
+warmup.setup(
+    prepare=prepare_date,
+    default_calls=lambda: [(name, args) for name, args in ((name, initial_callback_args(app, name)) for name in warmup.callbacks)
+                           if args is not None],
+    default_date=lambda: start_date,
+    valid_date=lambda date_str: date_str in DATE_TO_FILE,
+)
+server.before_request(warmup.start)
+
+# Batch PNG/GIF export of maps, transects and profiles as a zip built in a background job (viz_utils/export.py)
+install_export(server, exporter, lambda: DATE_TO_FILE)
+# Bulk profile requests from uploaded CSV/Parquet point lists (viz_utils/points.py)
+BULK_MAX_ROWS = int(os.environ.get('NESPRESO_BULK_MAX_ROWS', '200000'))
+BULK_CHUNK = int(os.environ.get('NESPRESO_BULK_CHUNK', '50000'))
+bulk_profiles = BulkProfiles(
+    directory=os.environ.get('NESPRESO_BULK_DIR', default_bulk_dir()),
+    api_url=API_UPSTREAM_URL,
+    concurrency=int(os.environ.get('NESPRESO_BULK_CONCURRENCY', '4')),
+    max_points=int(os.environ.get('NESPRESO_BULK_MAX_POINTS', '5000')),
+    keep=int(os.environ.get('NESPRESO_BULK_KEEP', '20')),
+)
+install_bulk_profiles(server, bulk_profiles, lambda: start_date, BULK_MAX_ROWS, BULK_CHUNK)
+# orjson for callback outputs and gzip/brotli responses (NESPRESO_JSON_ENGINE, NESPRESO_COMPRESS_*)
+logger.info("Callback JSON engine: %s", configure_json_engine())
+install_compression(server, app.config.assets_folder, assets_prefixes=('/nespreso_viz/assets/', '/assets/'))
 app.config.suppress_callback_exceptions = True
 
 # Same-origin proxy routes that forward to external NeSPReSO APIs
@@ -151,6 +282,53 @@ def proxy_grid():
     except Exception as exc:
         return Response(str(exc), status=502)
 
+# Map tiles (PNG) for the map figures, rendered from a lazily built mean-coarsened pyramid
+@server.route('/tiles/<field>/<date_str>/<int:depth>/<int:z>/<int:x>/<int:y>.png')
+@server.route('/nespreso_viz/tiles/<field>/<date_str>/<int:depth>/<int:z>/<int:x>/<int:y>.png')
+def serve_tile(field, date_str, depth, z, x, y):
+    if field not in MAP_FIELDS or date_str not in DATE_TO_FILE:
+        return Response("Unknown field or date", status=404)
+    try:
+        version = int(os.stat(DATE_TO_FILE[date_str]).st_mtime)
+    except OSError:
+        return Response("Data file not available", status=404)
+    if not MAP_FIELDS[field]['has_depth']:
+        depth = 0
+    else:
+        # Clamped before keying, so out-of-range depths share the deepest level's tiles and pyramid
+        try:
+            depth = min(depth, get_ds_for_date(date_str).sizes.get('depth', 1) - 1)
+        except Exception as exc:
+            logger.error("Failed opening %s for tiles: %s", date_str, exc)
+            return Response("Data file not available", status=404)
+    etag = tile_etag(field, date_str, depth, z, x, y, version)
+    # Past days never change once written; the current day may still be reprocessed
+    if date_str < datetime.now(timezone.utc).strftime('%Y-%m-%d'):
+        cache_control = 'public, max-age=31536000, immutable'
+    else:
+        cache_control = 'public, max-age=300'
+    headers = {'ETag': f'"{etag}"', 'Cache-Control': cache_control}
+    if etag in flask_request.if_none_match:
+        return Response(status=304, headers=headers)
+
+    png = tile_cache.get(etag)
+    if png is None:
+        def build_pyramid():
+            cur_ds = get_ds_for_date(date_str)
+            return FieldPyramid(read_map_slice(cur_ds, field, depth), cur_ds['lon'].values, cur_ds['lat'].values)
+        try:
+            pyramid = pyramid_cache.get_or_build((field, date_str, depth, version), build_pyramid)
+        except Exception as exc:
+            logger.error("Failed building tile pyramid for %s %s %s: %s", field, date_str, depth, exc)
+            return Response("Failed to render tile", status=500)
+        if z > pyramid.grid.max_zoom + 8:
+            return Response("Zoom level out of range", status=404)
+        png = pyramid.render_tile(z, x, y, MAP_FIELDS[field]['cmap'])
+        if png is None:
+            return Response("Tile out of range", status=404)
+        tile_cache.put(etag, png)
+    return Response(png, mimetype='image/png', headers=headers)
+
 @app.callback(
     Output('custom_status', 'children'),
     Input('btn-custom-download', 'n_clicks'),
@@ -164,16 +342,13 @@ def set_processing_status(n_clicks):
 # Create layout with three rows and specified figures
 app.layout = styles_obj.default_layout()
 # ------------------- About toggle -------------------
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_about'),
     Output('about_collapse', 'is_open'),
     Input('about_toggle', 'n_clicks'),
     State('about_collapse', 'is_open'),
     prevent_initial_call=True,
 )
-def toggle_about(n_clicks, is_open):
-    if not n_clicks:
-        raise dash.exceptions.PreventUpdate
-    return not is_open
 
 # =================== Date picker ===================
 # Updates the date and the index of the date
@@ -186,7 +361,7 @@ def toggle_about(n_clicks, is_open):
     prevent_initial_call=False,
 )
 def update_calendar_store(selected_value, selected_date_legacy):
-    print(f"update_calendar_store called with selected_value={selected_value}, date={selected_date_legacy}")
+    logger.debug("update_calendar_store selected_value=%s date=%s", selected_value, selected_date_legacy)
     # Support both Mantine (value) and DCC (date)
     selected_date = selected_value if selected_value else selected_date_legacy
     if not selected_date:
@@ -202,7 +377,7 @@ def update_calendar_store(selected_value, selected_date_legacy):
         date_idx = 0
     else:
         date_idx = int(np.argmin(np.abs(dates - np.datetime64(selected_date))))
-    print(f"Selected date index within available pool: {date_idx}")
+    logger.debug("Selected date index within available pool: %d", date_idx)
 
     return [html.Div(f"NeSPReSO synthetics for {selected_date_str}", style={'paddingLeft': '20px'}), date_idx, selected_date]
 
@@ -313,11 +488,37 @@ def update_profiles_loc(n_clicks_clear, n_clicks_undo, clickData_aviso, clickDat
     if click_data is not None and enable_add_points and ('on' in enable_add_points):
         lat = click_data['points'][0]['y']
         lon = click_data['points'][0]['x']
-        print(f"Adding profile at {lat}, {lon}")
+        logger.debug("Adding profile at %s, %s", lat, lon)
         prof_loc.append([lat, lon])
 
     return prof_loc
 
+## ================================ Region selection ====================================
+# Box/lasso selections on any map define the region averaged in the profile panels
+@app.callback(
+    Output('region', 'data'),
+    Input('fig_aviso', 'selectedData'),
+    Input('fig_SST', 'selectedData'),
+    Input('fig_SSS', 'selectedData'),
+    Input('fig_temp', 'selectedData'),
+    Input('fig_sal', 'selectedData'),
+    Input('clear_region', 'n_clicks'),
+    prevent_initial_call=True,
+)
+def update_region(*args):
+    ctx = dash.callback_context
+    if not ctx.triggered:
+        raise dash.exceptions.PreventUpdate
+    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    if trigger_id == 'clear_region':
+        return None
+    region = region_from_selection(ctx.triggered[0]['value'])
+    if region is None:
+        # Deselecting (double click) keeps the current region; it is removed with "Clear region"
+        raise dash.exceptions.PreventUpdate
+    logger.info("Selected region: %s", region_label(region))
+    return region
+
 ## ================================ Transects Locations ====================================
 @app.callback(
     Output('trans_lines', 'data'),
@@ -366,6 +567,40 @@ def update_transect_locations(relayout_data_aviso, relayout_data_temp, relayout_
     else:
         raise dash.exceptions.PreventUpdate
 
+## ================================ Map viewports ====================================
+# Each map figure ships its viewport plus a margin (see MainFigures._view_subset). The viewport stores are
+# inputs of the figure callbacks and only change when a pan or zoom leaves the shipped window, zooms in
+# far enough to need finer data (or tiles) or resets the view; smaller moves stay in the browser
+MAP_VIEWPORT_STORES = {'fig_aviso': 'sat_viewports', 'fig_SST': 'sat_viewports', 'fig_SSS': 'sat_viewports',
+                       'fig_temp': 'nespreso_viewports', 'fig_sal': 'nespreso_viewports',
+                       'fig_derived': 'derived_viewports'}
+MAP_GRAPH_IDS = list(MAP_VIEWPORT_STORES)
+VIEWPORT_STORE_IDS = ['sat_viewports', 'nespreso_viewports', 'derived_viewports']
+
+@app.callback(
+    [Output(store_id, 'data') for store_id in VIEWPORT_STORE_IDS],
+    [Input(graph_id, 'relayoutData') for graph_id in MAP_GRAPH_IDS],
+    [State(store_id, 'data') for store_id in VIEWPORT_STORE_IDS],
+    prevent_initial_call=True,
+)
+def update_map_viewports(*args):
+    ctx = dash.callback_context
+    if not ctx.triggered:
+        raise dash.exceptions.PreventUpdate
+    trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
+    relayout_data = args[MAP_GRAPH_IDS.index(trigger_id)]
+    store_id = MAP_VIEWPORT_STORES[trigger_id]
+    viewports = dict(args[len(MAP_GRAPH_IDS) + VIEWPORT_STORE_IDS.index(store_id)] or {})
+    shipped = viewports.get(trigger_id)
+    viewport = viewport_from_relayout(relayout_data, shipped)
+    if viewport == shipped or not viewport_needs_render(viewport, shipped):
+        raise dash.exceptions.PreventUpdate
+    if viewport is None:
+        viewports.pop(trigger_id, None)
+    else:
+        viewports[trigger_id] = viewport
+    return [viewports if sid == store_id else dash.no_update for sid in VIEWPORT_STORE_IDS]
+
 # =================== Satellite figures ===================
 # Update figure based on selections or a default example
 @app.callback(
@@ -378,43 +613,32 @@ def update_transect_locations(relayout_data_aviso, relayout_data_temp, relayout_
     Input('trans_lines', 'data'),
     Input('show_all_sat', 'value'),
     Input('sat_field_selector', 'value'),
+    Input('sat_viewports', 'data'),
 )
 
-def update_satellite_figures(prof_loc, date_idx, cur_date_str, trans_lines, show_all_value, selected_field):
-    print(f"update_satellite_figures -> date_idx={date_idx}, prof_loc_len={0 if not prof_loc else len(prof_loc)}, cur_date_str={cur_date_str}")
-    # Guard
-    if date_idx is None:
-        date_idx = 0
+@timed_callback
+@cached_figures
+def update_satellite_figures(prof_loc, date_idx, cur_date_str, trans_lines, show_all_value, selected_field, map_viewports=None):
+    logger.debug("update_satellite_figures date_idx=%s prof_loc_len=%d cur_date_str=%s", date_idx, len(prof_loc or []), cur_date_str)
     # If trans_lines is
     if trans_lines is None:
         trans_lines = []
-    # Build figures for the chosen date
-    date_key = cur_date_str if isinstance(cur_date_str, str) and len(cur_date_str) == 10 else start_date
-    cur_mainfigs, _, _ = get_objs_for_date(date_key)
-    # Coerce date_idx to be valid for the selected dataset (many daily files have a single time index)
-    try:
-        max_t = max(cur_mainfigs.SST.shape[0], cur_mainfigs.SSS.shape[0], cur_mainfigs.aviso.shape[0])
-        local_idx = int(date_idx) if date_idx is not None else 0
-        if local_idx < 0:
-            local_idx = 0
-        if local_idx >= max_t:
-            local_idx = max_t - 1
-    except Exception:
-        local_idx = 0
-    fig_aviso, fig_SST, fig_SSS = cur_mainfigs.update_satellite_figures(prof_loc, local_idx, trans_lines, cur_date_str)
-
+    # Build figures for the chosen date (many daily files have a single time index)
+    date_key, (cur_mainfigs, _, _), local_idx = resolve_date(cur_date_str, date_idx)
     show_all = isinstance(show_all_value, list) and ('all' in show_all_value)
+    map_viewports = map_viewports or {}
     if show_all:
-        return [fig_aviso, fig_SST, fig_SSS]
+        viewports = {'AVISO': map_viewports.get('fig_aviso'), 'SST': map_viewports.get('fig_SST'), 'SSS': map_viewports.get('fig_SSS')}
+        return cur_mainfigs.update_satellite_figures(prof_loc, local_idx, trans_lines, cur_date_str, viewports)
 
-    # Single mode: put the selected field in first slot
-    if selected_field == 'AVISO':
-        return [fig_aviso, cur_mainfigs.make_figure(np.nan*np.zeros_like(cur_mainfigs.SST[0]), go.Scatter(), cm.curl, '', '', '', None, None), cur_mainfigs.make_figure(np.nan*np.zeros_like(cur_mainfigs.SSS[0]), go.Scatter(), cm.curl, '', '', '', None, None)]
-    if selected_field == 'SST':
-        return [fig_SST, cur_mainfigs.make_figure(np.nan*np.zeros_like(cur_mainfigs.SST[0]), go.Scatter(), cm.curl, '', '', '', None, None), cur_mainfigs.make_figure(np.nan*np.zeros_like(cur_mainfigs.SSS[0]), go.Scatter(), cm.curl, '', '', '', None, None)]
-    if selected_field == 'SSS':
-        return [fig_SSS, cur_mainfigs.make_figure(np.nan*np.zeros_like(cur_mainfigs.SST[0]), go.Scatter(), cm.curl, '', '', '', None, None), cur_mainfigs.make_figure(np.nan*np.zeros_like(cur_mainfigs.SSS[0]), go.Scatter(), cm.curl, '', '', '', None, None)]
-    return [fig_aviso, fig_SST, fig_SSS]
+    # Single mode: only the selected field is built and drawn in the first (fig_aviso) slot.
+    # The other slots are hidden, so they keep whatever they hold; switching back to
+    # "show all" re-renders all three since show_all_sat is an input of this callback
+    if selected_field not in SATELLITE_FIELDS:
+        selected_field = 'AVISO'
+    figs = cur_mainfigs.update_satellite_figures(prof_loc, local_idx, trans_lines, cur_date_str,
+                                                 {selected_field: map_viewports.get('fig_aviso')}, fields=(selected_field,))
+    return [figs[SATELLITE_FIELDS.index(selected_field)], dash.no_update, dash.no_update]
 
 
 # =================== Nespreso maps figures ===================
@@ -427,85 +651,178 @@ def update_satellite_figures(prof_loc, date_idx, cur_date_str, trans_lines, show
     Input('cur_date_str', 'data'),
     Input('trans_lines', 'data'),
     Input('depth_idx', 'value'),
+    Input('nespreso_viewports', 'data'),
 )
-def update_nespreso_figures(prof_loc, date_idx, cur_date_str, trans_lines, depth_idx):
-    print(f"update_nespreso_figures -> date_idx={date_idx}, depth_idx={depth_idx}, prof_loc_len={0 if not prof_loc else len(prof_loc)}")
+@timed_callback
+@cached_figures
+def update_nespreso_figures(prof_loc, date_idx, cur_date_str, trans_lines, depth_idx, map_viewports=None):
+    logger.debug("update_nespreso_figures date_idx=%s depth_idx=%s prof_loc_len=%d", date_idx, depth_idx, len(prof_loc or []))
     # Guards
-    if date_idx is None:
-        date_idx = 0
     if depth_idx is None:
         depth_idx = 0
     # If trans_lines is
     if trans_lines is None:
         trans_lines = []
-    date_key = cur_date_str if isinstance(cur_date_str, str) and len(cur_date_str) == 10 else start_date
-    cur_mainfigs, _, _ = get_objs_for_date(date_key)
-    try:
-        max_t = max(cur_mainfigs.temp.shape[0], cur_mainfigs.sal.shape[0])
-        local_idx = int(date_idx) if date_idx is not None else 0
-        if local_idx < 0:
-            local_idx = 0
-        if local_idx >= max_t:
-            local_idx = max_t - 1
-    except Exception:
-        local_idx = 0
-    fig_temp, fig_sal = cur_mainfigs.update_nespreso_maps(prof_loc, local_idx, depth_idx, trans_lines, cur_date_str)
+    date_key, (cur_mainfigs, _, _), local_idx = resolve_date(cur_date_str, date_idx)
+    map_viewports = map_viewports or {}
+    viewports = {'Temperature': map_viewports.get('fig_temp'), 'Salinity': map_viewports.get('fig_sal')}
+    fig_temp, fig_sal = cur_mainfigs.update_nespreso_maps(prof_loc, local_idx, depth_idx, trans_lines, cur_date_str, viewports)
     return [fig_temp, fig_sal]
 
-# =================== Satellite layout visibility ===================
+# =================== Depth scan ===================
+# Temperature and salinity over a range of depths in one figure; the browser scrubs depth locally
+@cached_figure
+def build_depth_scan(cur_date_str, date_idx, depth_start, depth_stop, depth_step):
+    date_key, (cur_mainfigs, _, _), local_idx = resolve_date(cur_date_str, date_idx)
+    levels = depth_levels(cur_mainfigs.depths.size, depth_start, depth_stop, depth_step, animation_jobs.max_frames)
+    data = get_ds_for_date(date_key)
+    factor = decimation_factor(cur_mainfigs.lons.size, animation_jobs.max_px)
+    panels = []
+    for field in ('Temperature', 'Salinity'):
+        frames, zmin, zmax = quantize_stack(read_depth_stack(data, field, levels, local_idx, factor))
+        panels.append((field, frames, zmin, zmax))
+    lons, lats = decimate_coords(cur_mainfigs.lons, cur_mainfigs.lats, factor)
+    labels = [f"{int(cur_mainfigs.depths[level])} m" for level in levels]
+    return depth_scan_figure(panels, labels, lons, lats, title=lambda label: f"Synthetic T and S @ {label} - {date_key}",
+                             styles=styles_obj, coastline_traces=cur_mainfigs.coastline_traces, bbox=cur_mainfigs.bbox)
+
 @app.callback(
+    Output('fig_depth_scan', 'figure'),
+    Output('depth_scan_row', 'style'),
+    Input('depth_scan_start', 'n_clicks'),
+    Input('cur_date_str', 'data'),
+    State('cur_date', 'data'),
+    State('depth_scan_range', 'value'),
+    State('depth_scan_step', 'value'),
+    prevent_initial_call=True,
+)
+@timed_callback
+def update_depth_scan(n_clicks, cur_date_str, date_idx, depth_range, depth_step):
+    # Date changes only refresh a scan that is already shown
+    if not n_clicks:
+        return dash.no_update, dash.no_update
+    depth_start, depth_stop = depth_range or (0, 0)
+    return build_depth_scan(cur_date_str, date_idx, depth_start, depth_stop, depth_step or 1), {}
+
+# =================== Derived products figure ===================
+@app.callback(
+    Output('fig_derived', 'figure'),
+    Input('cur_date_str', 'data'),
+    Input('derived_product', 'value'),
+    Input('prof_loc', 'data'),
+    Input('trans_lines', 'data'),
+    Input('derived_viewports', 'data'),
+)
+@timed_callback
+@cached_figures
+def update_derived_figure(cur_date_str, product, prof_loc, trans_lines, map_viewports=None):
+    logger.debug("update_derived_figure product=%s cur_date_str=%s", product, cur_date_str)
+    date_key, (cur_mainfigs, _, _), _ = resolve_date(cur_date_str)
+    derived_maps = get_derived_for_date(date_key)
+    viewport = (map_viewports or {}).get('fig_derived')
+    return cur_mainfigs.update_derived_map(product, derived_maps, prof_loc, trans_lines or [], cur_date_str, viewport)
+
+# =================== Time-lapse animation ===================
+# Frames are prepared by a background job (viz_utils/animation.py); the browser polls for progress
+# and plays the finished figure without further callbacks
+def build_animation_figure(field, depth_idx):
+    mainfigs = get_objs_for_date(start_date)[0]
+    depth_label = f" at {int(mainfigs.depths[min(int(depth_idx), mainfigs.depths.size - 1)])} m" if MAP_FIELDS[field]['has_depth'] else ''
+
+    def build(frames, labels, zmin, zmax, factor):
+        lons, lats = decimate_coords(mainfigs.lons, mainfigs.lats, factor)
+        return frames_figure(frames, labels, lons, lats, zmin, zmax, field,
+                             title=lambda label: f"{MAP_FIELDS[field]['colorbar_title']}{depth_label} - {label}",
+                             styles=styles_obj, coastline_traces=mainfigs.coastline_traces, bbox=mainfigs.bbox)
+    return build
+
+@app.callback(
+    Output('animation_job', 'data'),
+    Output('animation_poll', 'disabled'),
+    Output('animation_status', 'children'),
+    Input('animation_start', 'n_clicks'),
+    State('animation_field', 'value'),
+    State('depth_idx', 'value'),
+    State('animation_range', 'start_date'),
+    State('animation_range', 'end_date'),
+    State('animation_step', 'value'),
+    prevent_initial_call=True,
+)
+def start_animation(n_clicks, field, depth_idx, range_start, range_end, step):
+    if field not in MAP_FIELDS or not range_start or not range_end:
+        return dash.no_update, True, "Choose a field and a date range"
+    step = max(int(step or 1), 1)
+    selected = [d for d in sorted(DATE_TO_FILE) if range_start[:10] <= d <= range_end[:10]][::step]
+    if not selected:
+        return None, True, "No data in the selected range"
+    truncated = len(selected) > animation_jobs.max_frames
+    selected = selected[:animation_jobs.max_frames]
+    depth_idx = int(depth_idx or 0) if MAP_FIELDS[field]['has_depth'] else 0
+    key = animation_jobs.submit(field, depth_idx, [(d, DATE_TO_FILE[d]) for d in selected],
+                                build_animation_figure(field, depth_idx))
+    note = f" (limited to the first {animation_jobs.max_frames} frames)" if truncated else ''
+    return key, False, f"Preparing {len(selected)} frames{note}..."
+
+@app.callback(
+    Output('fig_animation', 'figure'),
+    Output('animation_status', 'children', allow_duplicate=True),
+    Output('animation_poll', 'disabled', allow_duplicate=True),
+    Input('animation_poll', 'n_intervals'),
+    State('animation_job', 'data'),
+    prevent_initial_call=True,
+)
+def poll_animation(n_intervals, key):
+    status = animation_jobs.status(key)
+    if status['state'] == 'done':
+        payload = animation_jobs.result(key)
+        if payload is not None:
+            return pio.json.from_json_plotly(payload), "Ready - press ▶ to play", True
+    if status['state'] == 'running':
+        return dash.no_update, f"Reading frames {status.get('done', 0)}/{status.get('total', '?')}...", False
+    if status['state'] == 'failed':
+        return dash.no_update, f"Animation failed: {status.get('error', 'unknown error')}", True
+    return dash.no_update, "Animation not found; prepare it again", True
+
+# =================== Satellite layout visibility ===================
+# Pure UI toggles run in the browser (assets/clientside.js)
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_satellite_visibility'),
     Output('fig_aviso', 'style'),
     Output('fig_SST', 'style'),
     Output('fig_SSS', 'style'),
     Input('show_all_sat', 'value'),
     Input('sat_field_selector', 'value'),
 )
-def toggle_satellite_visibility(show_all_value, selected_field):
-    show_all = isinstance(show_all_value, list) and ('all' in show_all_value)
-    visible_style = {}
-    hidden_style = {'display': 'none'}
-    if show_all:
-        return visible_style, visible_style, visible_style
-    # Single mode: always show first-slot graph only
-    return visible_style, hidden_style, hidden_style
 
 # =================== Instructions and buttons toggling ===================
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_instructions'),
     Output('instructions_profile', 'style'),
     Output('profile_buttons', 'style'),
     Input('prof_loc', 'data'),
+    Input('region', 'data'),
 )
-def toggle_profile_instructions(prof_loc):
-    has_points = bool(prof_loc)
-    return ({'padding':'6px','fontStyle':'italic','display': 'none'} if has_points else {'padding':'6px','fontStyle':'italic'}), \
-           ({} if has_points else {'display':'none'})
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_instructions'),
     Output('instructions_transect', 'style'),
     Output('transect_buttons', 'style'),
     Input('trans_lines', 'data'),
 )
-def toggle_transect_instructions(trans_lines):
-    has_line = bool(trans_lines)
-    return ({'padding':'6px','fontStyle':'italic','display': 'none'} if has_line else {'padding':'6px','fontStyle':'italic'}), \
-           ({} if has_line else {'display':'none'})
 
 # =================== Hide/show plot rows based on selections ===================
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_row'),
     Output('profiles_row', 'style'),
     Input('prof_loc', 'data'),
+    Input('region', 'data'),
 )
-def toggle_profiles_row(prof_loc):
-    has_points = bool(prof_loc)
-    return ({} if has_points else {'display': 'none'})
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_row'),
     Output('transects_row', 'style'),
     Input('trans_lines', 'data'),
 )
-def toggle_transects_row(trans_lines):
-    has_line = bool(trans_lines)
-    return ({} if has_line else {'display': 'none'})
 
 ## ================================ Profiles figures ====================================
 @app.callback(
@@ -516,29 +833,19 @@ def toggle_transects_row(trans_lines):
     Input('prof_loc', 'data'),
     Input('depth_selection', 'value'),
     Input('depth_idx', 'value'),
+    Input('region', 'data'),
 )
-def update_profiles(date_idx, cur_date_str, prof_loc, depth_type, depth_idx):
-    print(f"update_profiles -> date_idx={date_idx}, depth_type={depth_type}, depth_idx={depth_idx}, prof_loc_len={0 if not prof_loc else len(prof_loc)}")
-    if date_idx is None:
-        date_idx = 0
+@timed_callback
+@cached_figures
+def update_profiles(date_idx, cur_date_str, prof_loc, depth_type, depth_idx, region=None):
+    logger.debug("update_profiles date_idx=%s depth_type=%s depth_idx=%s prof_loc_len=%d", date_idx, depth_type, depth_idx, len(prof_loc or []))
     if depth_idx is None:
         depth_idx = 0
 
-    date_key = cur_date_str if isinstance(cur_date_str, str) and len(cur_date_str) == 10 else start_date
-    _, cur_prof, _ = get_objs_for_date(date_key)
-    # Clamp date index to available range
-    try:
-        max_t = max(cur_prof.temp.shape[0], cur_prof.sal.shape[0])
-        local_idx = int(date_idx) if date_idx is not None else 0
-        if local_idx < 0:
-            local_idx = 0
-        if local_idx >= max_t:
-            local_idx = max_t - 1
-    except Exception:
-        local_idx = 0
+    date_key, (_, cur_prof, _), local_idx = resolve_date(cur_date_str, date_idx)
     fig_temp_prof, fig_sal_prof = cur_prof.update_profiles(prof_loc, local_idx, 
                                                            depth_type, cur_date_str, 
-                                                           depth_idx) 
+                                                           depth_idx, region) 
 
     return fig_temp_prof, fig_sal_prof
 
@@ -552,92 +859,52 @@ def update_profiles(date_idx, cur_date_str, prof_loc, depth_type, depth_idx):
     Input('trans_lines', 'data'),
     Input('depth_selection', 'value'),
 )
+@timed_callback
+@cached_figures
 def update_trans(date_idx, cur_date_str, cur_transect, depth_type):
+    date_key, (_, _, cur_trans), local_idx = resolve_date(cur_date_str, date_idx)
     if cur_transect and isinstance(cur_transect, dict):
         x0, y0 = cur_transect['x0'], cur_transect['y0']
         x1, y1 = cur_transect['x1'], cur_transect['y1']
 
         transect_loc = [[y0, x0], [y1, x1]]
-        date_key = cur_date_str if isinstance(cur_date_str, str) and len(cur_date_str) == 10 else start_date
-        _, _, cur_trans = get_objs_for_date(date_key)
-        # Clamp date index
-        try:
-            max_t = int(cur_trans.temp.sizes.get('time', 1))
-            local_idx = int(date_idx) if date_idx is not None else 0
-            if local_idx < 0:
-                local_idx = 0
-            if local_idx >= max_t:
-                local_idx = max_t - 1
-        except Exception:
-            local_idx = 0
         return cur_trans.update_transects(transect_loc, local_idx, depth_type, cur_date_str)
     else:
         # Return empty/default figures when transect cleared
-        date_key = cur_date_str if isinstance(cur_date_str, str) and len(cur_date_str) == 10 else start_date
-        _, _, cur_trans = get_objs_for_date(date_key)
         return cur_trans.update_transects([], 0, depth_type, cur_date_str)
 
 # =================== UI visibility helpers ===================
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_field_selector_visibility'),
     Output('sat_field_selector_container', 'style'),
     Input('show_all_sat', 'value'),
 )
-def toggle_field_selector_visibility(show_all_value):
-    show_all = isinstance(show_all_value, list) and ('all' in show_all_value)
-    return ({'display': 'none'} if show_all else {})
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='update_title'),
     Output('nespreso-date', 'children'),
     Input('cur_date_str', 'data'),
 )
-def update_title(cur_date_str):
-    try:
-        dt = datetime.strptime(cur_date_str, '%Y-%m-%d')
-        label = dt.strftime("%b %d, %Y")
-    except Exception:
-        label = cur_date_str
-    return f"Satellite fields for {label}"
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='update_custom_request_title'),
     Output('custom-request', 'children'),
     Input('cur_date_str', 'data'),
 )
-def update_custom_request_title(cur_date_str):
-    try:
-        dt = datetime.strptime(cur_date_str, '%Y-%m-%d')
-        label = dt.strftime("%b %d, %Y")
-    except Exception:
-        label = cur_date_str
-    return f"Custom request - Current date: {label}"
 
 # =================== Download functionality ===================
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='update_download_button_text'),
     Output('btn-download', 'children'),
     Input('cur_date_str', 'data'),
 )
-def update_download_button_text(cur_date_str):
-    if not cur_date_str:
-        return "Download NeSPReSO data"
-    try:
-        dt = datetime.strptime(cur_date_str, '%Y-%m-%d')
-        formatted_date = dt.strftime("%b %d, %Y")
-        return f"Download NeSPReSO data for {formatted_date}"
-    except Exception:
-        return "Download NeSPReSO data"
 
-@app.callback(
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='toggle_custom_mode'),
     Output('custom_examples_profile', 'style'),
     Output('custom_examples_grid', 'style'),
     Input('custom_mode', 'value'),
 )
-def toggle_custom_mode(mode):
-    is_profile = (mode != 'grid')
-    style_show = {}
-    style_hide = {'display': 'none'}
-    return (
-        (style_show if is_profile else style_hide),
-        (style_hide if is_profile else style_show),
-    )
 
 @app.callback(
     Output('download-dataframe-csv', 'data'),
@@ -667,6 +934,72 @@ def download_file(n_clicks, cur_date_str):
     )
 
 
+# =================== Image export ===================
+# Most profile locations put in an export request, to keep it reasonably small
+EXPORT_MAX_PROFILES = 200
+
+@app.callback(
+    Output('export_job', 'data'),
+    Output('export_poll', 'disabled'),
+    Output('export_status', 'children'),
+    Output('export_link', 'style'),
+    Input('export_start', 'n_clicks'),
+    State('export_fields', 'value'),
+    State('export_depths', 'value'),
+    State('export_range', 'start_date'),
+    State('export_range', 'end_date'),
+    State('export_step', 'value'),
+    State('export_format', 'value'),
+    State('export_extras', 'value'),
+    State('trans_lines', 'data'),
+    State('prof_loc', 'data'),
+    State('cur_date_str', 'data'),
+    State('depth_selection', 'value'),
+    prevent_initial_call=True,
+)
+def start_export(n_clicks, fields, depths, range_start, range_end, step, fmt, extras, trans_lines, prof_loc, cur_date_str, depth_type):
+    query = {
+        'fields': ','.join(fields or []),
+        'depths': depths or '0',
+        'start': (range_start or '')[:10],
+        'end': (range_end or '')[:10],
+        'step': step or 1,
+        'format': fmt or 'png',
+        'date': cur_date_str or '',
+        'depth_type': depth_type or 'upto500',
+    }
+    extras = extras or []
+    if 'transect' in extras and isinstance(trans_lines, dict):
+        query['transect'] = ','.join(f"{trans_lines[k]:.4f}" for k in ('y0', 'x0', 'y1', 'x1'))
+    if 'profiles' in extras and prof_loc:
+        query['profiles'] = ';'.join(f"{lat:.4f},{lon:.4f}" for lat, lon in prof_loc[:EXPORT_MAX_PROFILES])
+    try:
+        items = exporter.plan(DATE_TO_FILE, **parse_export_args(query))
+    except ValueError as exc:
+        return None, True, str(exc), {'display': 'none'}
+    key = exporter.submit(items)
+    return key, False, f"Rendering {len(items)} image(s)...", {'display': 'none'}
+
+@app.callback(
+    Output('export_status', 'children', allow_duplicate=True),
+    Output('export_poll', 'disabled', allow_duplicate=True),
+    Output('export_link', 'href'),
+    Output('export_link', 'style', allow_duplicate=True),
+    Input('export_poll', 'n_intervals'),
+    State('export_job', 'data'),
+    prevent_initial_call=True,
+)
+def poll_export(n_intervals, key):
+    status = exporter.jobs.status(key)
+    if status['state'] == 'done':
+        return ("Ready", True, f"{app.config.requests_pathname_prefix}export/images/{key}.zip",
+                {'display': 'inline-block'})
+    if status['state'] == 'running':
+        return f"Rendering images {status.get('done', 0)}/{status.get('total', '?')}...", False, dash.no_update, dash.no_update
+    if status['state'] == 'failed':
+        return f"Export failed: {status.get('error', 'unknown error')}", True, dash.no_update, dash.no_update
+    return "Export not found; prepare it again", True, dash.no_update, dash.no_update
+
 # =================== Custom query download (POST to API) ===================
 @app.callback(
     Output('download-custom', 'data'),
@@ -776,10 +1109,10 @@ def download_custom_profiles(n_clicks, mode, coord_text, cur_date_str):
         try:
             resp = requests.post(api_url, json=payload, timeout=1800)
         except Exception as exc:
-            print(f"Custom grid request failed: {exc}")
+            logger.error("Custom grid request failed: %s", exc)
             return dash.no_update, f"Request failed: {exc}"
         if resp.status_code != 200:
-            print(f"Custom grid API error: status={resp.status_code}, text={resp.text[:200]}")
+            logger.error("Custom grid API error: status=%s text=%s", resp.status_code, resp.text[:200])
             msg = resp.text[:200] if resp.text else f"HTTP {resp.status_code}"
             return dash.no_update, f"Request failed: {msg}"
 
@@ -803,74 +1136,17 @@ def download_custom_profiles(n_clicks, mode, coord_text, cur_date_str):
     if not coord_text:
         return dash.no_update, "Please enter coordinates."
 
-    # Optional header date=YYYY-MM-DD (applies to all lines without an explicit date)
-    header_date = None
-    header_match = re.search(r"^\s*date\s*=\s*(\d{4}-\d{2}-\d{2})\s*$", coord_text, flags=re.IGNORECASE | re.MULTILINE)
-    if header_match:
-        header_date = header_match.group(1)
-
-    lat_list = []
-    lon_list = []
-    date_values = []
-
-    for raw_line in coord_text.splitlines():
-        line = raw_line.strip()
-        if not line:
-            continue
-        # Skip pure header lines like "date=YYYY-MM-DD"
-        if re.match(r"^date\s*=\s*\d{4}-\d{2}-\d{2}\s*$", line, flags=re.IGNORECASE):
-            continue
-
-        lat_val = None
-        lon_val = None
-        date_val = None
-
-        # Accept named fields in any order: lat=.. lon=/long=.. [date=..]
-        mlat = re.search(r"\b(lat)\s*=\s*([+-]?\d+(?:\.\d+)?)", line, flags=re.IGNORECASE)
-        mlon = re.search(r"\b(lon|long)\s*=\s*([+-]?\d+(?:\.\d+)?)", line, flags=re.IGNORECASE)
-        mdate = re.search(r"\bdate\s*=\s*(\d{4}-\d{2}-\d{2})", line, flags=re.IGNORECASE)
-        if mlat and mlon:
-            try:
-                lat_val = float(mlat.group(2))
-                lon_val = float(mlon.group(2))
-                if mdate:
-                    date_val = mdate.group(1)
-            except Exception:
-                lat_val = None
-                lon_val = None
-
-        # Fallback: positional format "lat lon [date]", accepting comma or whitespace separators
-        if lat_val is None or lon_val is None:
-            parts = [p for p in re.split(r"[,\s]+", line) if p]
-            if len(parts) >= 2:
-                try:
-                    lat_val = float(parts[0])
-                    lon_val = float(parts[1])
-                    if len(parts) >= 3 and re.fullmatch(r"\d{4}-\d{2}-\d{2}", parts[2]):
-                        date_val = parts[2]
-                except Exception:
-                    lat_val = None
-                    lon_val = None
-
-        # Validate and collect
-        if lat_val is None or lon_val is None:
-            continue
-        if not (-90.0 <= lat_val <= 90.0 and -180.0 <= lon_val <= 180.0):
-            continue
-
-        lat_list.append(lat_val)
-        lon_list.append(lon_val)
-        date_values.append(date_val or header_date or cur_date_str)
-
-    if not lat_list:
+    # One point per line, 'lat, lon [date]' or 'lat=.. lon=.. [date=..]', with an optional
+    # 'date=YYYY-MM-DD' header line for lines without a date; out-of-range points are skipped
+    points, report = parse_points_text(coord_text, cur_date_str)
+    if report['invalid_date']:
+        return dash.no_update, "Invalid date. Use YYYY-MM-DD."
+    if points.empty:
         return dash.no_update, "No valid coordinates found. Use 'lat, lon [date]' or 'lat=.. lon=.. [date=..]'."
 
-    # Validate dates format
-    for dval in date_values:
-        try:
-            datetime.strptime(dval, '%Y-%m-%d')
-        except Exception:
-            return dash.no_update, f"Invalid date '{dval}'. Use YYYY-MM-DD."
+    lat_list = points['lat'].tolist()
+    lon_list = points['lon'].tolist()
+    date_values = points['date'].tolist()
 
     payload = {"lat": lat_list, "lon": lon_list, "date": date_values}
     # Use upstream profile API directly to avoid self-calls that can deadlock single workers
@@ -878,10 +1154,10 @@ def download_custom_profiles(n_clicks, mode, coord_text, cur_date_str):
     try:
         resp = requests.post(api_url, json=payload, timeout=600)
     except Exception as exc:
-        print(f"Custom profile request failed: {exc}")
+        logger.error("Custom profile request failed: %s", exc)
         return dash.no_update, f"Request failed: {exc}"
     if resp.status_code != 200:
-        print(f"Custom profile API error: status={resp.status_code}, text={resp.text[:200]}")
+        logger.error("Custom profile API error: status=%s text=%s", resp.status_code, resp.text[:200])
         msg = resp.text[:200] if resp.text else f"HTTP {resp.status_code}"
         return dash.no_update, f"Request failed: {msg}"
 
@@ -906,8 +1182,47 @@ def download_custom_profiles(n_clicks, mode, coord_text, cur_date_str):
             filename = default_name
     return dcc.send_bytes(resp.content, filename=filename, type='application/octet-stream'), "Done!"
 
+# =================== Bulk profile requests (CSV/Parquet upload) ===================
+# The browser posts the file to /custom/profiles/bulk itself, which starts the job fetching the profiles
+app.clientside_callback(
+    ClientsideFunction(namespace='nespreso', function_name='upload_bulk_file'),
+    Output('bulk_job', 'data'),
+    Output('bulk_status', 'children'),
+    Output('bulk_poll', 'disabled'),
+    Output('bulk_link', 'style'),
+    Input('bulk_upload', 'n_clicks'),
+    State('cur_date_str', 'data'),
+    prevent_initial_call=True,
+)
+
+@app.callback(
+    Output('bulk_status', 'children', allow_duplicate=True),
+    Output('bulk_poll', 'disabled', allow_duplicate=True),
+    Output('bulk_link', 'href'),
+    Output('bulk_link', 'style', allow_duplicate=True),
+    Input('bulk_poll', 'n_intervals'),
+    State('bulk_job', 'data'),
+    prevent_initial_call=True,
+)
+def poll_bulk_profiles(n_intervals, job):
+    if not isinstance(job, dict):
+        raise dash.exceptions.PreventUpdate
+    key, summary = job.get('key'), job.get('summary', '')
+    status = bulk_profiles.jobs.status(key)
+    if status['state'] == 'done':
+        failed = f" ({status['failed']} request(s) failed, see report.json)" if status.get('failed') else ''
+        href = f"{app.config.requests_pathname_prefix}custom/profiles/bulk/{key}.zip"
+        return f"{summary} - ready{failed}", True, href, {'display': 'inline-block', 'marginLeft': '12px'}
+    if status['state'] == 'running':
+        return (f"{summary} - fetching profiles {status.get('done', 0)}/{status.get('total', '?')}...", False,
+                dash.no_update, dash.no_update)
+    if status['state'] == 'failed':
+        return f"{summary} - failed: {status.get('error', 'unknown error')}", True, dash.no_update, dash.no_update
+    return f"{summary} - request not found; upload the file again", True, dash.no_update, dash.no_update
+
 
 if __name__ == '__main__':
+   warmup.start()
     # Debug mode
    app.run(debug=True, host='146.201.220.16', port=8050)
 
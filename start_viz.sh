@@ -30,6 +30,9 @@ sleep 2
 echo "Testing WSGI application..."
 python -c "from wsgi import application; print('WSGI app loaded successfully')" || exit 1
 
+# Pre-compressed static assets
+python tools/precompress_assets.py > /dev/null || true
+
 # Start with gunicorn
 echo "Starting NeSPReSO Visualization with Gunicorn..."
 exec gunicorn -c config/gunicorn_viz.conf.py wsgi:application
@@ -0,0 +1,38 @@
+"""The plain-dict figure path builds the same figures as graph_objs (tools/check_figure_parity.py)."""
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'tools'))
+
+import xarray as xr
+
+import check_figure_parity as parity
+import synthetic_data
+from viz_utils.catalog import scan_available_dates
+from viz_utils.styles import NespresoStyles
+from viz_utils.update_main import MainFigures
+from viz_utils.update_prof import Profiles
+from viz_utils.update_trans import Transects
+
+
+def test_dict_figures_match_graph_objs(tmp_path):
+    synthetic_data.write_days(str(tmp_path), '2024-10-10', 1)
+    date_to_file, days = scan_available_dates(str(tmp_path))
+    date_str = '2024-10-10'
+    data = xr.open_dataset(date_to_file[date_str]).compute()
+    styles = NespresoStyles(days, date_str)
+    objs = (MainFigures(data, styles), Profiles(data, styles), Transects(data, styles))
+
+    figures = {}
+    for plain in (False, True):
+        parity.set_plain(objs, plain)
+        figures[plain] = parity.build_all(objs, date_str)
+
+    for name, go_figs in figures[False].items():
+        dict_figs = figures[True][name]
+        assert len(go_figs) == len(dict_figs), name
+        for i, (go_fig, dict_fig) in enumerate(zip(go_figs, dict_figs)):
+            diffs = parity.differences(parity.as_json(go_fig), parity.as_json(dict_fig))
+            assert not diffs, f"{name}[{i}]: {diffs[:10]}"
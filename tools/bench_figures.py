@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+"""
+Benchmark the figure builders on synthetic NeSPReSO-shaped grids (tools/synthetic_data.py).
+
+For every grid size it times MainFigures.__init__, update_satellite_figures, update_nespreso_maps,
+Profiles.update_profiles with 1-500 points and Transects.update_transects for a short and a
+basin-wide line, reporting wall time (median of --repeat runs after a warm-up), peak traced memory
+(one extra run under tracemalloc) and serialised payload bytes.
+
+Results can be saved as a baseline and later runs compared against it; a case slower than
+--threshold times its baseline is reported as a regression (exit status 1).
+
+Usage:
+  python tools/bench_figures.py [--sizes small,medium] [--repeat 3] [--output results.json]
+  python tools/bench_figures.py --save-baseline tools/bench_baseline.json
+  python tools/bench_figures.py --compare tools/bench_baseline.json [--threshold 1.25]
+
+The render modes follow the usual environment (NESPRESO_MAP_RENDER, NESPRESO_DICT_FIGURES,
+NESPRESO_JSON_ENGINE), which are recorded with the results.
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import numpy as np
+import plotly.io as pio
+
+from synthetic_data import SIZES, BBOX, make_dataset
+from viz_utils.styles import NespresoStyles
+from viz_utils.transport import configure_json_engine
+from viz_utils.update_main import MainFigures
+from viz_utils.update_prof import Profiles
+from viz_utils.update_trans import Transects
+
+DATE = '2024-10-10'
+PROFILE_COUNTS = (1, 10, 50, 100, 500)
+
+
+def profile_locations(n, seed=0):
+    """n ocean-ish [lat, lon] points spread over the central Gulf."""
+    rng = np.random.default_rng(seed)
+    return [[float(lat), float(lon)] for lat, lon in zip(rng.uniform(21.5, 27.5, n), rng.uniform(-95.0, -84.0, n))]
+
+
+def payload_bytes(figures):
+    figures = figures if isinstance(figures, (list, tuple)) else [figures]
+    return sum(len(pio.json.to_json_plotly(f)) for f in figures if f is not None)
+
+
+def measure(func, repeat):
+    """Median wall time (ms) over `repeat` runs after a warm-up run, then peak traced memory (MB) of one more run."""
+    times = []
+    result = func()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        times.append((time.perf_counter() - start)*1000)
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, {'ms': statistics.median(times), 'ms_min': min(times), 'peak_mb': peak/2**20}
+
+
+def bench_size(size, repeat):
+    n_lat, n_lon, n_depth = SIZES[size]
+    data = make_dataset(DATE, n_lat, n_lon, n_depth)
+    styles = NespresoStyles(np.array([np.datetime64(DATE, 'D')]), DATE)
+    prof_loc = profile_locations(3)
+    results = {}
+
+    def record(name, func, payload=True):
+        output, stats = measure(func, repeat)
+        if payload:
+            stats['bytes'] = payload_bytes(output)
+        results[name] = stats
+        extra = f", {stats['bytes']/1e6:7.2f} MB payload" if payload else ''
+        print(f"  {size:>6} {name:<28} {stats['ms']:9.1f} ms  peak {stats['peak_mb']:8.1f} MB{extra}")
+        return output
+
+    main = record('MainFigures.__init__', lambda: MainFigures(data, styles), payload=False)
+    record('update_satellite_figures', lambda: main.update_satellite_figures(prof_loc, 0, [], DATE))
+    record('update_nespreso_maps', lambda: main.update_nespreso_maps(prof_loc, 0, 10, [], DATE))
+
+    profiles = Profiles(data, styles)
+    for n in PROFILE_COUNTS:
+        locations = profile_locations(n, seed=n)
+        record(f'update_profiles[{n}]', lambda: profiles.update_profiles(locations, 0, 'upto500', DATE, 10))
+
+    transects = Transects(data, styles)
+    lines = {
+        'short': [[24.0, -90.0], [24.5, -89.0]],
+        'basin': [[BBOX['lat_min'] + 3.0, BBOX['lon_min'] + 2.0], [BBOX['lat_max'] - 2.0, BBOX['lon_max'] - 3.0]],
+    }
+    for name, line in lines.items():
+        record(f'update_transects[{name}]', lambda: transects.update_transects(line, 0, 'upto500', DATE))
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Print the ratio of every case to its baseline; return the regressed case names."""
+    regressions = []
+    print(f"\nComparison against baseline (threshold {threshold:.2f}x):")
+    for size, cases in results['cases'].items():
+        for name, stats in cases.items():
+            base = baseline['cases'].get(size, {}).get(name)
+            if base is None:
+                print(f"  {size:>6} {name:<28} (not in baseline)")
+                continue
+            ratio = stats['ms']/max(base['ms'], 1e-6)
+            flag = ''
+            if ratio > threshold:
+                flag = '  <-- slower'
+                regressions.append(f'{size}/{name}')
+            if 'bytes' in stats and stats['bytes'] != base.get('bytes'):
+                flag += f"  payload {base.get('bytes')} -> {stats['bytes']}"
+            print(f"  {size:>6} {name:<28} {base['ms']:9.1f} -> {stats['ms']:9.1f} ms ({ratio:5.2f}x){flag}")
+    if baseline.get('environment') != results['environment']:
+        print(f"  note: baseline environment differs: {baseline.get('environment')}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', default='small,medium', help=f"Comma-separated grid sizes ({', '.join(SIZES)})")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', help='Write the results JSON here')
+    parser.add_argument('--save-baseline', metavar='PATH', help='Write the results as the new baseline')
+    parser.add_argument('--compare', metavar='PATH', help='Compare against a saved baseline')
+    parser.add_argument('--threshold', type=float, default=1.25, help='Slowdown ratio reported as a regression')
+    args = parser.parse_args()
+
+    results = {
+        'environment': {
+            'NESPRESO_MAP_RENDER': os.environ.get('NESPRESO_MAP_RENDER', 'heatmap'),
+            'NESPRESO_DICT_FIGURES': os.environ.get('NESPRESO_DICT_FIGURES', ''),
+            'json_engine': configure_json_engine(),
+        },
+        'machine': {'python': platform.python_version(), 'node': platform.node(), 'cpus': os.cpu_count()},
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'repeat': args.repeat,
+        'cases': {},
+    }
+    for size in [s.strip() for s in args.sizes.split(',') if s.strip()]:
+        if size not in SIZES:
+            parser.error(f"Unknown size {size}")
+        n_lat, n_lon, n_depth = SIZES[size]
+        print(f"Grid {size}: {n_lat} lat x {n_lon} lon x {n_depth} depth")
+        results['cases'][size] = bench_size(size, args.repeat)
+
+    for path in (args.output, args.save_baseline):
+        if path:
+            with open(path, 'w') as f:
+                json.dump(results, f, indent=2)
+            print(f"Wrote {path}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,153 @@
+#!/usr/bin/env python3
+"""
+Check that the plain-dict figure path (NESPRESO_DICT_FIGURES, viz_utils/fastfig.py) produces the
+same figures as plotly graph_objs, and time both paths.
+
+Maps, profiles and transects are built for one day with each path and their serialised JSON is
+compared recursively (typed arrays decoded, floats compared with a relative tolerance).
+Exits non-zero on any difference.
+
+Usage:
+  python tools/check_figure_parity.py [--date 2024-10-10] [--repeat 5]
+
+Requires: xarray, plotly
+"""
+import argparse
+import base64
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+import plotly.io as pio
+import xarray as xr
+
+from viz_utils.catalog import DATA_DIR, scan_available_dates
+from viz_utils.fastfig import FigureBuilder
+from viz_utils.styles import NespresoStyles
+from viz_utils.update_main import MainFigures
+from viz_utils.update_prof import Profiles
+from viz_utils.update_trans import Transects
+
+
+def decode(obj):
+    """JSON of a figure with plotly.js typed arrays ({'dtype', 'bdata'}) turned back into lists."""
+    if isinstance(obj, dict):
+        if 'bdata' in obj and 'dtype' in obj:
+            values = np.frombuffer(base64.b64decode(obj['bdata']), dtype=obj['dtype'])
+            if 'shape' in obj:
+                values = values.reshape([int(s) for s in str(obj['shape']).split(',')])
+            return values.tolist()
+        return {k: decode(v) for k, v in obj.items()}
+    if isinstance(obj, list):
+        return [decode(v) for v in obj]
+    return obj
+
+
+def differences(a, b, path='', rtol=1e-6):
+    """Paths at which two decoded figures differ."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        out = []
+        for key in sorted(set(a) | set(b)):
+            if key not in a or key not in b:
+                out.append(f"{path}/{key}: missing on one side")
+            else:
+                out.extend(differences(a[key], b[key], f"{path}/{key}", rtol))
+        return out
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return [f"{path}: length {len(a)} != {len(b)}"]
+        out = []
+        for i, (x, y) in enumerate(zip(a, b)):
+            out.extend(differences(x, y, f"{path}[{i}]", rtol))
+        return out
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) and not isinstance(a, bool):
+        if np.isclose(a, b, rtol=rtol, equal_nan=True):
+            return []
+    elif a == b:
+        return []
+    return [f"{path}: {str(a)[:60]} != {str(b)[:60]}"]
+
+
+def as_json(fig):
+    return decode(json.loads(pio.json.to_json_plotly(fig)))
+
+
+def build_all(objs, date_str):
+    """The figures the dashboard builds for one interaction of each kind."""
+    main, prof, trans = objs
+    prof_loc = [[24.0, -90.0], [25.5, -87.0]]
+    trans_loc = [[22.0, -95.0], [26.0, -85.0]]
+    figures = {}
+    figures['satellite'] = main.update_satellite_figures(prof_loc, 0, [], date_str)
+    figures['nespreso'] = main.update_nespreso_maps(prof_loc, 0, 10, [], date_str)
+    figures['profiles'] = prof.update_profiles(prof_loc, 0, 'upto500', date_str, 10)
+    figures['profiles_default'] = prof.update_profiles([], 0, 'upto500', date_str, 10)
+    # Enough locations for the percentile envelopes, plus a box region
+    many = [[20.0 + 0.1*i, -95.0 + 0.1*i] for i in range(prof.aggregate_threshold + 1)]
+    region = {'type': 'box', 'lon': [-94.0, -88.0], 'lat': [21.0, 26.0]}
+    figures['profiles_aggregate'] = prof.update_profiles(many, 0, 'upto500', date_str, 10, region)
+    figures['transects'] = trans.update_transects(trans_loc, 0, 'upto500', date_str)
+    return figures
+
+
+def set_plain(objs, plain):
+    for obj in objs:
+        obj.fig = FigureBuilder(plain=plain)
+    main = objs[0]
+    # Coastlines are converted once at construction in plain mode
+    main.coastline_traces = [t.to_plotly_json() if plain and hasattr(t, 'to_plotly_json') else t
+                             for t in main.coastline_traces]
+
+
+def time_builds(objs, date_str, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        figures = build_all(objs, date_str)
+    build_ms = (time.perf_counter() - start)*1000/repeat
+    start = time.perf_counter()
+    payload = sum(len(pio.json.to_json_plotly(f)) for figs in figures.values() for f in figs)
+    json_ms = (time.perf_counter() - start)*1000
+    return figures, build_ms, json_ms, payload
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--date', default=None, help='Day to build (default: latest available)')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    date_to_file, days = scan_available_dates(args.data_dir)
+    if not date_to_file:
+        print(f"No NeSPReSO grids found in {args.data_dir}")
+        return 1
+    date_str = args.date or max(date_to_file)
+    data = xr.open_dataset(date_to_file[date_str]).compute()
+    styles = NespresoStyles(days, date_str)
+    objs = (MainFigures(data, styles), Profiles(data, styles), Transects(data, styles))
+
+    results = {}
+    for plain in (False, True):
+        set_plain(objs, plain)
+        results[plain] = time_builds(objs, date_str, args.repeat)
+        _, build_ms, json_ms, payload = results[plain]
+        print(f"{'dict' if plain else 'graph_objs':>10}: build {build_ms:8.1f} ms, serialise {json_ms:7.1f} ms, {payload/1e6:.2f} MB")
+
+    failures = 0
+    for name, go_figs in results[False][0].items():
+        for i, (go_fig, dict_fig) in enumerate(zip(go_figs, results[True][0][name])):
+            diffs = differences(as_json(go_fig), as_json(dict_fig))
+            status = 'ok' if not diffs else f"{len(diffs)} differences"
+            print(f"{name}[{i}]: {status}")
+            for line in diffs[:10]:
+                print(f"    {line}")
+            failures += bool(diffs)
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
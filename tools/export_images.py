@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Export maps, transects and profiles of the NeSPReSO grids to PNG (or animated GIF) without the
+dashboard, with the same renderer and disk cache as the dashboard's "Download images" button.
+
+Usage:
+  python tools/export_images.py --fields Temperature SST --depths 0 100 500 \\
+      --start 2024-10-01 --end 2024-10-31 [--step 1] [--format png|gif] \\
+      [--transect LAT0 LON0 LAT1 LON1] [--profiles LAT,LON LAT,LON ...] [--date YYYY-MM-DD] \\
+      [--data-dir DIR] [--workers N] [--px 800] --out images.zip
+
+--out ending in .zip writes a zip (with manifest.json); anything else is a directory the images
+are written into.
+
+Requires: xarray, netCDF4 (and Pillow for --format gif)
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from viz_utils.catalog import DATA_DIR, scan_available_dates
+from viz_utils.export import ImageExporter, default_export_dir
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Directory with nespreso_grid_YYYY-MM-DD.nc files')
+    parser.add_argument('--fields', nargs='*', default=[], help='Map fields: Temperature Salinity AVISO SST SSS')
+    parser.add_argument('--depths', nargs='*', type=float, default=[0.0], help='Depths [m] for Temperature/Salinity')
+    parser.add_argument('--start', default=None, help='First date (YYYY-MM-DD)')
+    parser.add_argument('--end', default=None, help='Last date (YYYY-MM-DD)')
+    parser.add_argument('--step', type=int, default=1, help='Days between images')
+    parser.add_argument('--format', default='png', choices=('png', 'gif'), help='PNG per day or one GIF per field and depth')
+    parser.add_argument('--transect', nargs=4, type=float, default=None, metavar=('LAT0', 'LON0', 'LAT1', 'LON1'))
+    parser.add_argument('--profiles', nargs='*', default=None, metavar='LAT,LON', help='Profile locations')
+    parser.add_argument('--date', default=None, help='Date of the transect and profiles (default: last date exported)')
+    parser.add_argument('--depth-type', default='upto500', help='Depth range of transects/profiles (upto100..upto500, every01/05/10)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2)//2), help='Render processes')
+    parser.add_argument('--px', type=int, default=800, help='Approximate image width [px]')
+    parser.add_argument('--max-items', type=int, default=5000, help='Largest number of images')
+    parser.add_argument('--cache-dir', default=os.environ.get('NESPRESO_EXPORT_DIR', default_export_dir()), help='Disk cache of rendered images')
+    parser.add_argument('--out', required=True, help='Output .zip file or directory')
+    args = parser.parse_args()
+
+    date_to_file, _ = scan_available_dates(args.data_dir)
+    # The command line can ask for more than the dashboard, so the cache is not pruned below this export
+    exporter = ImageExporter(args.cache_dir, workers=args.workers, px=args.px, max_items=args.max_items,
+                             max_bytes=2**40, min_pool_items=2*args.workers)
+    try:
+        items = exporter.plan(
+            date_to_file, fields=args.fields, depths=args.depths, start=args.start, end=args.end, step=args.step,
+            fmt=args.format, date=args.date, depth_type=args.depth_type,
+            transect=[args.transect[:2], args.transect[2:]] if args.transect else None,
+            prof_loc=[[float(v) for v in p.split(',')] for p in args.profiles] if args.profiles else None,
+        )
+    except ValueError as exc:
+        parser.error(str(exc))
+
+    start = time.time()
+    print(f"Exporting {len(items)} images with {args.workers} workers")
+    if args.out.endswith('.zip'):
+        exporter.write_zip(items, args.out)
+    else:
+        manifest = []
+        for item, path, meta in exporter.rendered(items):
+            target = os.path.join(args.out, item['name'])
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            with open(path, 'rb') as src, open(target, 'wb') as dst:
+                dst.write(src.read())
+            manifest.append(dict(meta, file=item['name']))
+        with open(os.path.join(args.out, 'manifest.json'), 'w') as f:
+            json.dump(sorted(manifest, key=lambda m: m['file']), f, indent=1)
+    print(f"Wrote {args.out} in {time.time() - start:.1f} s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+"""
+Load test a running dashboard (e.g. gunicorn -c config/gunicorn_viz.conf.py wsgi:application) by
+replaying the Dash callback sequences a browser sends.
+
+Each virtual user loads the page (index, layout, dependencies and the initial callbacks), then runs
+a mix of actions with think time between them: date change, depth slider drag, profile clicks,
+transect draw and custom downloads. Callbacks are chained the way the Dash renderer chains them:
+outputs of one request that are inputs of other server callbacks trigger those next, and callbacks
+fired together are sent concurrently. Clientside callbacks never reach the server and are skipped.
+
+Custom downloads call the upstream APIs; point the dashboard at tools/upstream_stub.py
+(NESPRESO_UPSTREAM_URL / NESPRESO_GRID_UPSTREAM_URL) before testing them.
+
+For every concurrency level it reports, per callback, the request count, errors, p50/p95/p99 latency
+and response bytes on the wire, plus the overall throughput.
+
+Usage:
+  python tools/loadtest.py --url http://127.0.0.1:8050/nespreso_viz/ --concurrency 1,4,16 --duration 60
+  python tools/loadtest.py --mix date_change=1,profile_click=3 --think 1 --output loadtest.json
+"""
+import argparse
+import json
+import random
+import sys
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+ACTIONS = ('date_change', 'slider_drag', 'profile_click', 'transect_draw', 'custom_download')
+DEFAULT_MIX = 'date_change=2,slider_drag=2,profile_click=3,transect_draw=2,custom_download=1'
+# Browsers open at most this many connections per host
+BROWSER_CONNECTIONS = 6
+
+
+def parse_outputs(output):
+    """Dash output spec ('a.b' or '..a.b...c.d..') to a list of 'id.property' (allow_duplicate hash kept)."""
+    if output.startswith('..') and output.endswith('..'):
+        return output[2:-2].split('...')
+    return [output]
+
+
+def strip_hash(prop_id):
+    return prop_id.split('@')[0]
+
+
+def wire_bytes(resp):
+    """Response size as transferred (compressed), falling back to the decoded body."""
+    try:
+        return int(resp.headers['Content-Length'])
+    except (KeyError, ValueError):
+        return len(resp.content)
+
+
+def layout_props(node, props=None):
+    """'id.property' -> initial value for every component with an id in a /_dash-layout tree."""
+    props = {} if props is None else props
+    if isinstance(node, list):
+        for child in node:
+            layout_props(child, props)
+    elif isinstance(node, dict):
+        if 'props' in node and 'type' in node:
+            component_props = node['props'] or {}
+            component_id = component_props.get('id')
+            for key, value in component_props.items():
+                if isinstance(component_id, str) and key != 'children':
+                    props[f'{component_id}.{key}'] = value
+                layout_props(value, props)
+        else:
+            for value in node.values():
+                layout_props(value, props)
+    return props
+
+
+class Callback:
+    def __init__(self, spec):
+        self.spec = spec
+        self.outputs = parse_outputs(spec['output'])
+        self.inputs = [f"{x['id']}.{x['property']}" for x in spec['inputs']]
+        self.state = [f"{x['id']}.{x['property']}" for x in spec.get('state', [])]
+        self.output_props = {strip_hash(o) for o in self.outputs}
+        ids = []
+        for o in self.outputs:
+            component_id = o.rsplit('.', 1)[0]
+            if component_id not in ids:
+                ids.append(component_id)
+        self.name = '+'.join(ids)
+
+    def body(self, props, changed):
+        def item(prop_id):
+            component_id, prop = prop_id.rsplit('.', 1)
+            return {'id': component_id, 'property': prop, 'value': props.get(prop_id)}
+        outputs = [dict(zip(('id', 'property'), o.rsplit('.', 1))) for o in self.outputs]
+        return {
+            'output': self.spec['output'],
+            'outputs': outputs if len(outputs) > 1 or self.spec['output'].startswith('..') else outputs[0],
+            'inputs': [item(p) for p in self.inputs],
+            'state': [item(p) for p in self.state],
+            'changedPropIds': sorted(changed),
+        }
+
+
+class Stats:
+    """Latencies, statuses and bytes per request name, shared by all virtual users."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.samples = defaultdict(list)
+
+    def add(self, name, seconds, status, nbytes):
+        with self._lock:
+            self.samples[name].append((seconds, status, nbytes))
+
+    def summary(self, elapsed):
+        rows = {}
+        total = 0
+        for name, samples in sorted(self.samples.items()):
+            latencies = np.array([s[0] for s in samples])*1000
+            errors = sum(1 for s in samples if not (200 <= s[1] < 400))
+            total += len(samples)
+            rows[name] = {
+                'count': len(samples),
+                'errors': errors,
+                'p50_ms': float(np.percentile(latencies, 50)),
+                'p95_ms': float(np.percentile(latencies, 95)),
+                'p99_ms': float(np.percentile(latencies, 99)),
+                'max_ms': float(latencies.max()),
+                'mean_bytes': float(np.mean([s[2] for s in samples])),
+                'per_s': len(samples)/elapsed,
+            }
+        return {'elapsed_s': elapsed, 'requests': total, 'requests_per_s': total/elapsed, 'callbacks': rows}
+
+
+class DashUser:
+    """One browser session: component properties plus the callback chain logic of the Dash renderer."""
+
+    def __init__(self, base_url, callbacks, initial_props, stats, rng):
+        self.base_url = base_url
+        self.callbacks = callbacks
+        self.props = dict(initial_props)
+        self.stats = stats
+        self.rng = rng
+        self.session = requests.Session()
+        self.pool = ThreadPoolExecutor(max_workers=BROWSER_CONNECTIONS)
+
+    def close(self):
+        self.pool.shutdown(wait=True)
+        self.session.close()
+
+    def get(self, path, name):
+        start = time.perf_counter()
+        try:
+            resp = self.session.get(self.base_url + path, timeout=600)
+            self.stats.add(name, time.perf_counter() - start, resp.status_code, wire_bytes(resp))
+            return resp
+        except requests.RequestException:
+            self.stats.add(name, time.perf_counter() - start, 599, 0)
+            return None
+
+    def call(self, callback, changed):
+        """POST one callback; returns the 'id.property' values it changed."""
+        start = time.perf_counter()
+        try:
+            resp = self.session.post(self.base_url + '_dash-update-component',
+                                     json=callback.body(self.props, changed), timeout=1800)
+        except requests.RequestException:
+            self.stats.add(callback.name, time.perf_counter() - start, 599, 0)
+            return {}
+        self.stats.add(callback.name, time.perf_counter() - start, resp.status_code, wire_bytes(resp))
+        if resp.status_code != 200:
+            return {}
+        updates = {}
+        for component_id, values in resp.json().get('response', {}).items():
+            for prop, value in values.items():
+                updates[f'{component_id}.{prop}'] = value
+        return updates
+
+    def fire(self, pending):
+        """Run callbacks ({index: changed inputs}) and everything their outputs trigger."""
+        pending = {i: set(changed) for i, changed in pending.items()}
+        while pending:
+            blocked_outputs = set()
+            for i in pending:
+                blocked_outputs |= self.callbacks[i].output_props
+            # Like the renderer, wait for callbacks whose outputs feed another pending callback
+            ready = [i for i in pending
+                     if not (set(self.callbacks[i].inputs) & (blocked_outputs - self.callbacks[i].output_props))]
+            ready = ready or list(pending)
+            futures = [(i, self.pool.submit(self.call, self.callbacks[i], pending.pop(i))) for i in ready]
+            changed = {}
+            for _, future in futures:
+                changed.update(future.result())
+            self.props.update(changed)
+            for i, callback in enumerate(self.callbacks):
+                triggered = set(callback.inputs) & set(changed)
+                if triggered:
+                    pending.setdefault(i, set()).update(triggered)
+
+    def set(self, changes):
+        """A user interaction: set component properties ({'id.property': value}) and run what they trigger."""
+        self.props.update(changes)
+        self.fire({i: set(cb.inputs) & set(changes) for i, cb in enumerate(self.callbacks)
+                   if set(cb.inputs) & set(changes)})
+
+    # ------------------------------------------------------------------ actions
+    def load_page(self):
+        self.get('', 'GET index')
+        self.get('_dash-layout', 'GET _dash-layout')
+        self.get('_dash-dependencies', 'GET _dash-dependencies')
+        self.fire({i: set() for i, cb in enumerate(self.callbacks) if not cb.spec.get('prevent_initial_call')})
+
+    def random_point(self):
+        return round(self.rng.uniform(21.5, 27.5), 3), round(self.rng.uniform(-95.0, -84.0), 3)
+
+    def date_change(self):
+        lo = self.props.get('date-picker-single.minDate') or self.props.get('date-picker-single.min_date_allowed')
+        hi = self.props.get('date-picker-single.maxDate') or self.props.get('date-picker-single.max_date_allowed')
+        if lo and hi:
+            days = (np.datetime64(hi[:10]) - np.datetime64(lo[:10])).astype(int)
+            date = str(np.datetime64(lo[:10]) + self.rng.randint(0, max(days, 0)))
+        else:
+            date = self.props.get('cur_date_str.data')
+        self.set({'date-picker-single.value': date})
+
+    def slider_drag(self):
+        value = self.props.get('depth_idx.value') or 0
+        for _ in range(self.rng.randint(3, 8)):
+            value = int(min(1800, max(0, value + self.rng.choice([-1, 1])*self.rng.choice([10, 20, 50]))))
+            self.set({'depth_idx.value': value})
+
+    def profile_click(self):
+        for _ in range(self.rng.randint(1, 3)):
+            lat, lon = self.random_point()
+            figure = self.rng.choice(['fig_aviso', 'fig_temp', 'fig_sal'])
+            self.set({f'{figure}.clickData': {'points': [{'curveNumber': 0, 'x': lon, 'y': lat}]}})
+
+    def transect_draw(self):
+        (lat0, lon0), (lat1, lon1) = self.random_point(), self.random_point()
+        shape = {'type': 'line', 'xref': 'x', 'yref': 'y', 'x0': lon0, 'y0': lat0, 'x1': lon1, 'y1': lat1,
+                 'line': {'color': '#444', 'width': 4}}
+        self.set({'fig_temp.relayoutData': {'shapes': [shape]}})
+
+    def custom_download(self):
+        date = self.props.get('cur_date_str.data')
+        if self.rng.random() < 0.8:
+            points = [self.random_point() for _ in range(self.rng.randint(1, 10))]
+            self.props['custom_mode.value'] = 'profile'
+            self.props['custom_coords.value'] = '\n'.join(f'{lat}, {lon}, {date}' for lat, lon in points)
+        else:
+            self.props['custom_mode.value'] = 'grid'
+            self.props['custom_coords.value'] = f'{date} [-92, 22, -86, 27] 0.1'
+        clicks = (self.props.get('btn-custom-download.n_clicks') or 0) + 1
+        self.set({'btn-custom-download.n_clicks': clicks})
+
+
+def run_user(base_url, callbacks, initial_props, stats, mix, think, actions_per_session, deadline, seed):
+    rng = random.Random(seed)
+    names, weights = zip(*mix.items())
+    while time.time() < deadline:
+        user = DashUser(base_url, callbacks, initial_props, stats, rng)
+        try:
+            user.load_page()
+            for _ in range(actions_per_session):
+                if time.time() >= deadline:
+                    break
+                time.sleep(rng.uniform(0, 2*think))
+                getattr(user, rng.choices(names, weights)[0])()
+        finally:
+            user.close()
+
+
+def print_summary(level, summary):
+    print(f"\nConcurrency {level}: {summary['requests']} requests in {summary['elapsed_s']:.0f} s "
+          f"({summary['requests_per_s']:.1f} req/s)")
+    print(f"  {'callback':<52} {'n':>6} {'err':>4} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'KB':>8}")
+    for name, row in summary['callbacks'].items():
+        print(f"  {name[:52]:<52} {row['count']:>6} {row['errors']:>4} {row['p50_ms']:>9.0f} "
+              f"{row['p95_ms']:>9.0f} {row['p99_ms']:>9.0f} {row['mean_bytes']/1024:>8.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--url', default='http://127.0.0.1:8050/nespreso_viz/', help='Dashboard base URL')
+    parser.add_argument('--concurrency', default='1,2,4,8', help='Comma-separated numbers of virtual users')
+    parser.add_argument('--duration', type=float, default=60.0, help='Seconds per concurrency level')
+    parser.add_argument('--think', type=float, default=2.0, help='Mean think time between actions (s)')
+    parser.add_argument('--actions', type=int, default=10, help='Actions per session before reloading the page')
+    parser.add_argument('--mix', default=DEFAULT_MIX, help=f"Action weights ({', '.join(ACTIONS)})")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='Write the per-level summaries as JSON')
+    args = parser.parse_args()
+
+    base_url = args.url if args.url.endswith('/') else args.url + '/'
+    mix = {}
+    for item in args.mix.split(','):
+        name, _, weight = item.partition('=')
+        if name.strip() not in ACTIONS:
+            parser.error(f"Unknown action {name}")
+        mix[name.strip()] = float(weight or 1)
+
+    deps = requests.get(base_url + '_dash-dependencies', timeout=60).json()
+    layout = requests.get(base_url + '_dash-layout', timeout=60).json()
+    callbacks = [Callback(spec) for spec in deps if not spec.get('clientside_function')]
+    initial_props = layout_props(layout)
+    print(f"{len(callbacks)} server callbacks, {len(initial_props)} component properties")
+
+    results = {}
+    for level in [int(c) for c in args.concurrency.split(',') if c.strip()]:
+        stats = Stats()
+        start = time.time()
+        deadline = start + args.duration
+        threads = [threading.Thread(target=run_user, daemon=True,
+                                    args=(base_url, callbacks, initial_props, stats, mix, args.think,
+                                          args.actions, deadline, args.seed*1000 + level*100 + i))
+                   for i in range(level)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        results[level] = stats.summary(time.time() - start)
+        print_summary(level, results[level])
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'url': base_url, 'mix': mix, 'think_s': args.think, 'levels': results}, f, indent=2)
+        print(f"\nWrote {args.output}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Write pre-compressed variants (.gz, and .br when brotli is installed) of the static files in
+assets/ (bootstrap CSS, coastline JSON, clientside JS...). The dashboard serves them directly to
+clients that accept the encoding instead of compressing on every request (viz_utils/transport.py).
+
+Variants older than their source are rewritten; a stale variant is never served.
+
+Usage:
+  python tools/precompress_assets.py [--assets-dir assets] [--force]
+"""
+import argparse
+import gzip
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from viz_utils.transport import brotli
+
+EXTENSIONS = ('.css', '.js', '.json', '.svg', '.html', '.txt', '.map')
+
+
+def write_variant(path, suffix, compress, force=False):
+    """Write `path + suffix`, returning its size, or None when it is already current."""
+    target = path + suffix
+    if not force and os.path.exists(target) and os.stat(target).st_mtime >= os.stat(path).st_mtime:
+        return None
+    with open(path, 'rb') as f:
+        data = f.read()
+    tmp = target + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(compress(data))
+    os.replace(tmp, target)
+    return os.path.getsize(target)
+
+
+def main():
+    default_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'assets')
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--assets-dir', default=default_dir)
+    parser.add_argument('--force', action='store_true', help='Rewrite variants that are already current')
+    args = parser.parse_args()
+
+    variants = {'.gz': lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = lambda data: brotli.compress(data, quality=11)
+    else:
+        print("brotli is not installed; writing .gz variants only")
+
+    for root, _, files in os.walk(args.assets_dir):
+        for name in sorted(files):
+            if not name.endswith(EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            size = os.path.getsize(path)
+            for suffix, compress in variants.items():
+                written = write_variant(path, suffix, compress, args.force)
+                rel = os.path.relpath(path, args.assets_dir)
+                if written is None:
+                    print(f"{rel}{suffix}: up to date")
+                else:
+                    print(f"{rel}{suffix}: {size} -> {written} bytes ({100*written/max(size, 1):.0f}%)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
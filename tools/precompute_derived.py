@@ -0,0 +1,80 @@
+#!/usr/bin/env python3
+"""
+Precompute derived products (MLD, D26, D20, TCHP) for every daily NeSPReSO grid and write them to
+sidecar files (nespreso_derived_YYYY-MM-DD.nc) next to the grids.
+
+Incremental: days whose sidecar was computed from the current grid file (same mtime) are skipped,
+so the job can run nightly as new days land. The dashboard reads current sidecars instead of
+computing the products on request.
+
+Usage:
+  python tools/precompute_derived.py [--data-dir DIR] [--out-dir DIR] [--workers N] [--force]
+                                     [--dates 2024-10-01 2024-10-02 ...]
+
+Requires: xarray, gsw, netCDF4
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import xarray as xr
+
+from viz_utils.catalog import DATA_DIR, scan_available_dates, derived_sidecar_path, sidecar_is_current, write_derived_sidecar
+from viz_utils.update_main import compute_derived_maps, DERIVED_MAX_DEPTH
+
+
+def process_day(date_str, grid_path, sidecar_path, max_depth):
+    """Compute and write one day's sidecar. Runs in a worker process."""
+    start = time.time()
+    with xr.open_dataset(grid_path) as data:
+        derived_maps = compute_derived_maps(data, max_depth=max_depth)
+        write_derived_sidecar(sidecar_path, derived_maps, data['lat'].values, data['lon'].values, grid_path, max_depth)
+    return date_str, time.time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--data-dir', default=DATA_DIR, help='Directory with nespreso_grid_YYYY-MM-DD.nc files')
+    parser.add_argument('--out-dir', default=None, help='Sidecar directory (default: NESPRESO_DERIVED_DIR or the grid directory)')
+    parser.add_argument('--workers', type=int, default=max(1, (os.cpu_count() or 2)//2), help='Worker processes')
+    parser.add_argument('--max-depth', type=float, default=DERIVED_MAX_DEPTH,
+                        help='Deepest level used for the derived products [m]; the dashboard only reads sidecars '
+                             'computed to its own depth')
+    parser.add_argument('--dates', nargs='*', default=None, help='Only process these dates (YYYY-MM-DD)')
+    parser.add_argument('--force', action='store_true', help='Recompute even if the sidecar is current')
+    args = parser.parse_args()
+
+    date_to_file, _ = scan_available_dates(args.data_dir)
+    wanted = sorted(date_to_file) if not args.dates else [d for d in args.dates if d in date_to_file]
+
+    todo = []
+    for date_str in wanted:
+        grid_path = date_to_file[date_str]
+        sidecar_path = derived_sidecar_path(grid_path, date_str, args.out_dir)
+        if not args.force and sidecar_is_current(sidecar_path, grid_path, args.max_depth):
+            continue
+        todo.append((date_str, grid_path, sidecar_path))
+    print(f"{len(wanted)} days in catalog, {len(wanted) - len(todo)} up to date, {len(todo)} to compute")
+    if not todo:
+        return
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_day, d, g, s, args.max_depth): d for d, g, s in todo}
+        for future in as_completed(futures):
+            try:
+                date_str, elapsed = future.result()
+                print(f"Wrote derived products for {date_str} ({elapsed:.1f} s)")
+            except Exception as exc:
+                failures += 1
+                print(f"Failed computing derived products for {futures[future]}: {exc}")
+    if failures:
+        raise SystemExit(f"{failures} day(s) failed")
+
+
+if __name__ == '__main__':
+    main()
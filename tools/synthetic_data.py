@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Synthetic NeSPReSO-shaped datasets for benchmarks and load tests.
+
+The datasets follow the schema of the daily grids the dashboard reads: Temperature and Salinity as
+(time, depth, lat, lon), SST (Kelvin), SSS and AVISO ADT as (time, lat, lon), float32, with a Gulf of
+Mexico-like land mask set to NaN in every field. Values are smooth stratified profiles plus a few
+mesoscale eddies, so contours, profiles and derived products (MLD, D26, TCHP) look realistic.
+
+Usage:
+  python tools/synthetic_data.py --out-dir /tmp/nespreso_synth --days 3 [--size medium]
+"""
+import argparse
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+import xarray as xr
+
+# Grid sizes (n_lat, n_lon, n_depth) over the dashboard bbox; 'full' is the operational 1/25 degree grid
+SIZES = {
+    'small': (49, 65, 1801),
+    'medium': (151, 201, 1801),
+    'full': (301, 426, 1801),
+}
+BBOX = dict(lat_min=18.0, lat_max=30.0, lon_min=-98.0, lon_max=-81.0)
+
+
+def land_mask(lats, lons):
+    """Boolean (lat, lon) mask: US Gulf coast, Florida peninsula, Yucatan and the Mexican coast."""
+    lat = lats[:, np.newaxis]
+    lon = lons[np.newaxis, :]
+    coast = 29.5 + 0.3*np.sin(np.deg2rad(lon)*20)
+    land = lat > coast
+    land |= (lon > -82.8) & (lat > 25.0)
+    land |= (lon > -90.5) & (lon < -86.8) & (lat < 21.3)
+    land |= lon < -97.5 + 0.15*(lat - 18.0)
+    return land
+
+
+def eddies(lats, lons, rng, n=6):
+    """Sum of Gaussian warm/cold core eddies (unitless amplitude in [-1, 1]) on the (lat, lon) grid."""
+    lat = lats[:, np.newaxis]
+    lon = lons[np.newaxis, :]
+    field = np.zeros((lats.size, lons.size), dtype=np.float32)
+    for _ in range(n):
+        lat0 = rng.uniform(BBOX['lat_min'] + 2, BBOX['lat_max'] - 3)
+        lon0 = rng.uniform(BBOX['lon_min'] + 2, BBOX['lon_max'] - 3)
+        radius = rng.uniform(0.8, 2.0)
+        field += rng.choice([-1.0, 1.0])*np.exp(-((lat - lat0)**2 + (lon - lon0)**2)/radius**2).astype(np.float32)
+    return field
+
+
+def make_dataset(date='2024-10-10', n_lat=49, n_lon=65, n_depth=1801, n_time=1, seed=0):
+    """
+    Build an in-memory synthetic grid.
+
+    Parameters:
+    date (str): First day (YYYY-MM-DD); further time steps are consecutive days.
+    n_lat, n_lon, n_depth, n_time (int): Grid dimensions. Depths are spread evenly over 0-1800 m.
+    seed (int): Random seed for the eddy field and noise.
+
+    Returns:
+    xr.Dataset: Temperature, Salinity (time, depth, lat, lon), SST, SSS, AVISO (time, lat, lon).
+    """
+    rng = np.random.default_rng(seed)
+    lats = np.linspace(BBOX['lat_min'], BBOX['lat_max'], n_lat).astype(np.float32)
+    lons = np.linspace(BBOX['lon_min'], BBOX['lon_max'], n_lon).astype(np.float32)
+    depths = np.linspace(0.0, 1800.0, n_depth).astype(np.float32)
+    times = pd.date_range(date, periods=n_time, freq='D')
+    land = land_mask(lats, lons)
+
+    temp = np.empty((n_time, n_depth, n_lat, n_lon), dtype=np.float32)
+    sal = np.empty_like(temp)
+    sst = np.empty((n_time, n_lat, n_lon), dtype=np.float32)
+    sss = np.empty_like(sst)
+    adt = np.empty_like(sst)
+    # Vertical structure: mixed layer over an exponential thermocline/halocline
+    mixed = np.clip((depths - 40.0)/150.0, 0.0, None)
+    t_profile = (4.5 + 24.5*np.exp(-mixed))[:, np.newaxis, np.newaxis]
+    s_profile = (34.95 + 1.3*np.exp(-mixed) - 0.3*np.exp(-depths/15.0))[:, np.newaxis, np.newaxis]
+    decay = np.exp(-depths/400.0)[:, np.newaxis, np.newaxis]
+    north = ((lats - BBOX['lat_min'])/(BBOX['lat_max'] - BBOX['lat_min']))[:, np.newaxis]
+    for t in range(n_time):
+        eddy = eddies(lats, lons, rng)
+        surface_t = 30.0 - 2.5*north + 0.8*eddy
+        for d0 in range(0, n_depth, 200):
+            # Level blocks keep the float64 temporaries small on the full grid
+            d1 = min(d0 + 200, n_depth)
+            temp[t, d0:d1] = t_profile[d0:d1] + (surface_t - 29.0)*decay[d0:d1] + 2.0*eddy*decay[d0:d1]*(1 - decay[d0:d1])
+            sal[t, d0:d1] = s_profile[d0:d1] + (0.25*eddy - 0.6*north)*decay[d0:d1]
+        temp[t, :, land] = np.nan
+        sal[t, :, land] = np.nan
+        sst[t] = temp[t, 0] + 273.15 + rng.normal(0, 0.05, land.shape)
+        sss[t] = sal[t, 0]
+        adt[t] = np.where(land, np.nan, 0.25 + 0.35*eddy - 0.1*north)
+
+    dims = ('time', 'depth', 'lat', 'lon')
+    return xr.Dataset(
+        {
+            'Temperature': (dims, temp),
+            'Salinity': (dims, sal),
+            'SST': (('time', 'lat', 'lon'), sst),
+            'SSS': (('time', 'lat', 'lon'), sss),
+            'AVISO': (('time', 'lat', 'lon'), adt),
+        },
+        coords={'time': times, 'depth': depths, 'lat': lats, 'lon': lons},
+        attrs={'coordinate_system': 'geographic', 'source': 'synthetic (tools/synthetic_data.py)'},
+    )
+
+
+def write_days(out_dir, start_date, days, size='small', seed=0):
+    """Write one nespreso_grid_YYYY-MM-DD.nc per day and return their paths."""
+    os.makedirs(out_dir, exist_ok=True)
+    n_lat, n_lon, n_depth = SIZES[size]
+    paths = []
+    for i, day in enumerate(pd.date_range(start_date, periods=days, freq='D')):
+        date_str = day.strftime('%Y-%m-%d')
+        path = os.path.join(out_dir, f'nespreso_grid_{date_str}.nc')
+        make_dataset(date_str, n_lat, n_lon, n_depth, seed=seed + i).to_netcdf(path)
+        paths.append(path)
+    return paths
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--out-dir', required=True)
+    parser.add_argument('--start', default='2024-10-08', help='First day (YYYY-MM-DD)')
+    parser.add_argument('--days', type=int, default=3)
+    parser.add_argument('--size', choices=sorted(SIZES), default='small')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    for path in write_days(args.out_dir, args.start, args.days, args.size, args.seed):
+        print(f"Wrote {path} ({os.path.getsize(path)/1e6:.1f} MB)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the external NeSPReSO APIs (NESPRESO_UPSTREAM_URL, NESPRESO_GRID_UPSTREAM_URL)
+for load tests, so custom downloads exercise the dashboard without touching the production service.
+
+POST /nespreso_profile answers after --profile-latency seconds with a NetCDF-sized body of
+--profile-bytes per requested location; POST /nespreso_grid answers after --grid-latency seconds with
+--grid-bytes. Latencies get +/- --jitter (fraction) of uniform noise and --error-rate of the requests
+fail with HTTP 500. GET on either path answers 405 like the real POST-only APIs, which is what the
+dashboard's /readyz upstream probe sends.
+
+Usage:
+  python tools/upstream_stub.py --port 8060 --profile-latency 2 --grid-latency 20 --grid-bytes 50000000
+  export NESPRESO_UPSTREAM_URL=http://127.0.0.1:8060/nespreso_profile
+  export NESPRESO_GRID_UPSTREAM_URL=http://127.0.0.1:8060/nespreso_grid
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# NetCDF4 (HDF5) files start with this signature; the rest of the stub payload is filler
+NETCDF_MAGIC = b'\x89HDF\r\n\x1a\n'
+CHUNK = 1 << 20
+# Incompressible, like real NetCDF4 (zlib-compressed) variables
+FILLER = random.Random(0).randbytes(CHUNK)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = None
+
+    def log_message(self, fmt, *args):
+        if not self.config.quiet:
+            super().log_message(fmt, *args)
+
+    def do_GET(self):
+        path = self.path.split('?')[0].rstrip('/')
+        if path.endswith(('/grid', 'nespreso_grid', 'nespreso_profile', 'v1_profile')):
+            self.send_response(405)
+            self.send_header('Allow', 'POST')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        cfg = self.config
+        length = int(self.headers.get('Content-Length') or 0)
+        try:
+            payload = json.loads(self.rfile.read(length) or b'{}')
+        except ValueError:
+            payload = {}
+        path = self.path.rstrip('/')
+        if path.endswith('/grid') or path.endswith('nespreso_grid'):
+            latency, size, name = cfg.grid_latency, cfg.grid_bytes, 'NeSPReSO_grid_stub.nc'
+        elif path.endswith('nespreso_profile') or path.endswith('v1_profile'):
+            n_points = max(1, len(payload.get('lat') or []))
+            latency, size, name = cfg.profile_latency, cfg.profile_bytes*n_points, 'NeSPReSO_profiles_stub.nc'
+        else:
+            self.send_error(404)
+            return
+        time.sleep(max(0.0, latency*(1 + random.uniform(-cfg.jitter, cfg.jitter))))
+        if random.random() < cfg.error_rate:
+            body = b'stub upstream error'
+            self.send_response(500)
+            self.send_header('Content-Type', 'text/plain')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-netcdf')
+        self.send_header('Content-Disposition', f'attachment; filename="{name}"')
+        self.send_header('Content-Length', str(size))
+        self.end_headers()
+        # Streamed in chunks so large grids do not need to fit in memory
+        self.wfile.write(NETCDF_MAGIC[:size])
+        remaining = size - min(size, len(NETCDF_MAGIC))
+        filler = FILLER
+        while remaining > 0:
+            n = min(remaining, CHUNK)
+            self.wfile.write(filler[:n])
+            remaining -= n
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8060)
+    parser.add_argument('--profile-latency', type=float, default=1.0, help='Seconds per profile request')
+    parser.add_argument('--profile-bytes', type=int, default=40_000, help='Response bytes per requested location')
+    parser.add_argument('--grid-latency', type=float, default=10.0, help='Seconds per grid request')
+    parser.add_argument('--grid-bytes', type=int, default=20_000_000, help='Response bytes per grid request')
+    parser.add_argument('--jitter', type=float, default=0.2, help='Relative latency noise')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of requests answered with HTTP 500')
+    parser.add_argument('--quiet', action='store_true', help='Do not log every request')
+    args = parser.parse_args()
+
+    StubHandler.config = args
+    httpd = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    base = f'http://{args.host}:{args.port}'
+    print(f"Upstream stub on {base} (pid {os.getpid()})")
+    print(f"  export NESPRESO_UPSTREAM_URL={base}/nespreso_profile")
+    print(f"  export NESPRESO_GRID_UPSTREAM_URL={base}/nespreso_grid")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
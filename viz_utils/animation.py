@@ -0,0 +1,431 @@
+"""
+Time-lapse animations of the map fields, played in the browser from plotly frames.
+
+A job reads the one (lat, lon) slice it needs from each day's file, in parallel over a process pool
+(NESPRESO_ANIMATION_WORKERS), decimates it to about NESPRESO_ANIMATION_PX columns, and quantises all
+frames against one shared colour range. Frames are uint8 palette indices, sent as 1-byte typed
+arrays, with index 255 for land and missing values. Only the heatmap z changes between frames; the
+colour scale, coastlines and axes are sent once. Play/pause and the date slider then run client-side
+without callbacks.
+
+Jobs run in a background thread of the worker that received the request. Progress and the
+finished figure are written to a directory shared by the workers (NESPRESO_ANIMATION_DIR), so
+whichever worker answers the browser's polls can report them. The newest NESPRESO_ANIMATION_KEEP
+results are kept and reused for identical requests.
+
+Depth scans (depth_scan_figure) use the same encoding for the temperature and salinity of one day
+over a range of depth levels, read with a single slab read per field.
+"""
+import concurrent.futures
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import numpy as np
+import plotly.io as pio
+import xarray as xr
+
+from viz_utils.fastfig import FigureBuilder, convert_to_base64
+from viz_utils.raster import NAN_INDEX, PALETTE_SIZE, data_range, quantize
+from viz_utils.styles import COLORSCALE_ENTRIES, get_colorscale
+from viz_utils.tiles import block_mean
+from viz_utils.update_main import MAP_FIELDS, read_map_slice, to_display_units
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the frame encoding changes, so stored results are rebuilt
+FORMAT_VERSION = 1
+# A running job whose status has not been updated for this long lost its worker
+STALE_S = 60
+
+
+def decimation_factor(n_cols, max_px):
+    return max(1, int(np.ceil(n_cols/max(max_px, 1))))
+
+
+def decimate(z, factor):
+    return block_mean(z, factor) if factor > 1 else np.asarray(z, dtype=np.float32)
+
+
+def decimate_coords(lons, lats, factor):
+    if factor <= 1:
+        return np.asarray(lons), np.asarray(lats)
+    return (block_mean(np.asarray(lons)[np.newaxis, :], factor)[0],
+            block_mean(np.asarray(lats)[:, np.newaxis], factor)[:, 0])
+
+
+def read_frame(path, field, depth_idx, factor):
+    """
+    One decimated (lat, lon) slice of `field` from a daily file, in display units.
+    Module-level so process pool workers can run it.
+    """
+    with xr.open_dataset(path) as data:
+        return decimate(read_map_slice(data, field, depth_idx, 0), factor)
+
+
+def quantize_stack(frames, zmin=None, zmax=None):
+    """
+    Quantise a list of 2D frames against one shared colour range (min/max of all frames by default).
+
+    Returns:
+    tuple: (list of uint8 arrays, zmin, zmax)
+    """
+    if zmin is None or zmax is None:
+        lows, highs = zip(*(data_range(f) for f in frames))
+        finite_lows = [v for v in lows if v is not None]
+        finite_highs = [v for v in highs if v is not None]
+        zmin = min(finite_lows) if zmin is None and finite_lows else zmin
+        zmax = max(finite_highs) if zmax is None and finite_highs else zmax
+    return [quantize(f, zmin, zmax) for f in frames], zmin, zmax
+
+
+def depth_levels(n_depths, start, stop, step, max_frames):
+    """Depth indices from `start` to `stop` (inclusive) every `step`, clamped to the file, at most `max_frames`."""
+    start = min(max(int(start), 0), n_depths - 1)
+    stop = min(max(int(stop), start), n_depths - 1)
+    return list(range(start, stop + 1, max(int(step), 1)))[:max_frames]
+
+
+def read_depth_stack(data, field, levels, time_idx=0, factor=1):
+    """
+    Decimated (lat, lon) slices of a depth field at the depth indices `levels`, in display units.
+
+    The levels are read in one request: the contiguous slab spanning them, subsampled in memory,
+    unless they are so sparse that the slab would be more than four times larger than the levels,
+    in which case one strided read is used.
+    """
+    var = data[MAP_FIELDS[field]['var']]
+    sel = {}
+    if 'time' in var.dims:
+        sel['time'] = min(int(time_idx), var.sizes['time'] - 1)
+    stride = levels[1] - levels[0] if len(levels) > 1 else 1
+    if stride <= 4:
+        sel['depth'] = slice(levels[0], levels[-1] + 1)
+        slab = np.asarray(var.isel(sel).values, dtype=np.float32)[::stride]
+    else:
+        sel['depth'] = slice(levels[0], levels[-1] + 1, stride)
+        slab = np.asarray(var.isel(sel).values, dtype=np.float32)
+    return [decimate(to_display_units(level, field), factor) for level in slab]
+
+
+def index_coloraxis(cmap, colorbar_title, zmin, zmax, n_ticks=6):
+    """
+    Coloraxis for palette-index frames: the colormap over indices 0..PALETTE_SIZE-1, transparent at
+    NAN_INDEX, with colorbar ticks labelled in data units.
+    """
+    scale = (PALETTE_SIZE - 1)/NAN_INDEX
+    colorscale = [[pos*scale, color] for pos, color in get_colorscale(cmap, COLORSCALE_ENTRIES)]
+    colorscale += [[(PALETTE_SIZE - 0.5)/NAN_INDEX, 'rgba(0,0,0,0)'], [1.0, 'rgba(0,0,0,0)']]
+    tickvals = np.linspace(0, PALETTE_SIZE - 1, n_ticks)
+    values = np.linspace(zmin, zmax, n_ticks) if zmin is not None and zmax is not None else tickvals
+    decimals = max(0, 2 - int(np.floor(np.log10(max(abs(zmax - zmin), 1e-9))))) if zmin is not None else 0
+    return dict(
+        colorscale=colorscale,
+        cmin=0,
+        cmax=NAN_INDEX,
+        showscale=True,
+        colorbar=dict(title={'text': colorbar_title, 'side': 'right'}, thickness=12, lenmode='fraction', len=0.88,
+                      y=0.5, x=1.0, xpad=0, tickvals=[float(v) for v in tickvals],
+                      ticktext=[f'{v:.{decimals}f}' for v in values]),
+    )
+
+
+ANIMATE_ARGS = {'mode': 'immediate', 'frame': {'duration': 0, 'redraw': True}, 'transition': {'duration': 0}}
+
+
+def playback_controls(labels, styles, frame_ms=400, slider_prefix=''):
+    """Layout updatemenus (play/pause) and sliders (one step per frame) of an animated figure."""
+    return dict(
+        updatemenus=[dict(
+            type='buttons', direction='left', showactive=False, x=0.0, y=-0.06, xanchor='left', yanchor='top',
+            pad=dict(t=10, r=10),
+            buttons=[
+                dict(label='▶', method='animate',
+                     args=[None, dict(ANIMATE_ARGS, frame={'duration': frame_ms, 'redraw': True}, fromcurrent=True)]),
+                dict(label='❚❚', method='animate', args=[[None], dict(ANIMATE_ARGS, frame={'duration': 0, 'redraw': False})]),
+            ],
+        )],
+        sliders=[dict(
+            active=0, x=0.12, len=0.88, y=-0.04, yanchor='top', pad=dict(t=10),
+            currentvalue=dict(prefix=slider_prefix, font=dict(size=styles.font_sizes['base'])),
+            steps=[dict(label=label, method='animate', args=[[label], ANIMATE_ARGS]) for label in labels],
+        )],
+    )
+
+
+def frames_figure(frames, labels, lons, lats, zmin, zmax, field, title, styles, coastline_traces=(),
+                  bbox=None, frame_ms=400, slider_prefix=''):
+    """
+    Plain-dict plotly figure that animates quantised frames (uint8, see quantize_stack) client-side.
+
+    Parameters:
+    frames (list): 2D uint8 arrays on the lons/lats grid, one per label.
+    labels (list): Frame names shown on the slider (dates, depths).
+    title (callable): Figure title for a label.
+    styles (NespresoStyles): Fonts, colours and sizes of the dashboard.
+    coastline_traces (list): Traces drawn on top of every frame.
+    """
+    spec = MAP_FIELDS[field]
+    builder = FigureBuilder(plain=True)
+    x_range = [bbox['lon_min'], bbox['lon_max']] if bbox else [float(np.min(lons)), float(np.max(lons))]
+    y_range = [bbox['lat_min'], bbox['lat_max']] if bbox else [float(np.min(lats)), float(np.max(lats))]
+    heatmap = builder.trace('heatmap', z=frames[0], x=lons, y=lats, coloraxis='coloraxis',
+                            hovertemplate='Lat: %{y:.2f}<br>Lon: %{x:.2f}<extra></extra>')
+    axis_style = dict(title=dict(text=""), tickfont=dict(size=styles.font_sizes['tick']), constrain='domain',
+                      automargin=True, gridcolor='rgba(0,0,0,0.05)', zeroline=False, linecolor='rgba(0,0,0,0.15)')
+    fig = builder.figure(
+        data=[heatmap] + list(coastline_traces),
+        layout=dict(
+            title=dict(text=title(labels[0]), font=dict(family=styles.font_family, size=styles.font_sizes['title']), y=0.98),
+            xaxis=dict(axis_style, range=x_range),
+            yaxis=dict(axis_style, range=y_range, scaleanchor='x', scaleratio=1),
+            coloraxis=index_coloraxis(spec['cmap'], spec['colorbar_title'], zmin, zmax),
+            dragmode='pan',
+            height=styles.fig_height + 80,
+            margin=dict(styles.margins, b=90),
+            paper_bgcolor=styles.paper_bgcolor,
+            plot_bgcolor=styles.plot_bgcolor,
+            font=dict(family=styles.font_family, size=styles.font_sizes['base']),
+            showlegend=False,
+            **playback_controls(labels, styles, frame_ms, slider_prefix),
+        ),
+    )
+    fig['frames'] = [{'name': label, 'traces': [0], 'data': [{'z': frame}], 'layout': {'title': {'text': title(label)}}}
+                     for label, frame in zip(labels, frames)]
+    if convert_to_base64 is not None:
+        convert_to_base64(fig)
+    return fig
+
+
+def depth_scan_figure(panels, labels, lons, lats, title, styles, coastline_traces=(), bbox=None, frame_ms=600):
+    """
+    Plain-dict plotly figure with one map per field side by side, animated over depth client-side.
+
+    Parameters:
+    panels (list): (field, frames, zmin, zmax) per map; frames are uint8 (see quantize_stack), one per label.
+    labels (list): Frame names shown on the slider (depths).
+    title (callable): Figure title for a label.
+    coastline_traces (list): Traces drawn on top of every map.
+    """
+    builder = FigureBuilder(plain=True)
+    x_range = [bbox['lon_min'], bbox['lon_max']] if bbox else [float(np.min(lons)), float(np.max(lons))]
+    y_range = [bbox['lat_min'], bbox['lat_max']] if bbox else [float(np.min(lats)), float(np.max(lats))]
+    axis_style = dict(title=dict(text=""), tickfont=dict(size=styles.font_sizes['tick']), constrain='domain',
+                      automargin=True, gridcolor='rgba(0,0,0,0.05)', zeroline=False, linecolor='rgba(0,0,0,0.15)')
+    coastlines = [t.to_plotly_json() if hasattr(t, 'to_plotly_json') else t for t in coastline_traces]
+    width = 1.0/len(panels)
+    heatmaps, overlays, layout = [], [], {}
+    for i, (field, frames, zmin, zmax) in enumerate(panels):
+        suffix = '' if i == 0 else str(i + 1)
+        spec = MAP_FIELDS[field]
+        heatmaps.append(builder.trace('heatmap', z=frames[0], x=lons, y=lats, coloraxis=f'coloraxis{suffix}',
+                                      xaxis=f'x{suffix}', yaxis=f'y{suffix}',
+                                      hovertemplate='Lat: %{y:.2f}<br>Lon: %{x:.2f}<extra></extra>'))
+        overlays += [dict(t, xaxis=f'x{suffix}', yaxis=f'y{suffix}') for t in coastlines]
+        coloraxis = index_coloraxis(spec['cmap'], spec['colorbar_title'], zmin, zmax)
+        coloraxis['colorbar'].update(x=width*(i + 1) - 0.01, xanchor='left')
+        layout[f'coloraxis{suffix}'] = coloraxis
+        layout[f'xaxis{suffix}'] = dict(axis_style, range=x_range, domain=[width*i, width*(i + 1) - 0.08])
+        layout[f'yaxis{suffix}'] = dict(axis_style, range=y_range, scaleanchor=f'x{suffix}', scaleratio=1)
+    fig = builder.figure(
+        data=heatmaps + overlays,
+        layout=dict(
+            layout,
+            title=dict(text=title(labels[0]), font=dict(family=styles.font_family, size=styles.font_sizes['title']), y=0.98),
+            dragmode='pan',
+            height=styles.fig_height + 80,
+            margin=dict(styles.margins, b=90),
+            paper_bgcolor=styles.paper_bgcolor,
+            plot_bgcolor=styles.plot_bgcolor,
+            font=dict(family=styles.font_family, size=styles.font_sizes['base']),
+            showlegend=False,
+            **playback_controls(labels, styles, frame_ms, 'Depth: '),
+        ),
+    )
+    traces = list(range(len(panels)))
+    fig['frames'] = [{'name': label, 'traces': traces, 'data': [{'z': panel[1][j]} for panel in panels],
+                      'layout': {'title': {'text': title(label)}}}
+                     for j, label in enumerate(labels)]
+    if convert_to_base64 is not None:
+        convert_to_base64(fig)
+    return fig
+
+
+class AnimationJobs:
+    """
+    Builds time-lapse figures in background threads and shares their progress and results through
+    `directory`.
+
+    Parameters:
+    directory (str): Shared directory for job status and finished figures.
+    workers (int): Processes reading daily files in parallel (1 reads in the job thread).
+    max_frames (int): Largest number of frames per animation.
+    max_px (int): Frames are block-mean decimated to about this many columns.
+    keep (int): Finished animations kept in the directory.
+    """
+
+    def __init__(self, directory, workers=4, max_frames=120, max_px=400, keep=20):
+        self.directory = directory
+        self.workers = workers
+        self.max_frames = max_frames
+        self.max_px = max_px
+        self.keep = keep
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def job_key(self, field, depth_idx, paths):
+        versions = []
+        for path in paths:
+            try:
+                versions.append(int(os.stat(path).st_mtime))
+            except OSError:
+                versions.append(None)
+        raw = json.dumps([FORMAT_VERSION, field, int(depth_idx), self.max_px, list(paths), versions])
+        return hashlib.sha1(raw.encode()).hexdigest()[:20]
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f'{key}{suffix}')
+
+    def _write_status(self, key, **status):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(status, pid=os.getpid(), updated=time.time()), f)
+        os.replace(tmp, self._path(key, '.status.json'))
+
+    def status(self, key):
+        """{'state': 'running'|'done'|'failed'|'unknown', 'done': frames read, 'total': frames, ...}"""
+        if key and os.path.exists(self._path(key, '.json')):
+            return {'state': 'done'}
+        try:
+            with open(self._path(key, '.status.json')) as f:
+                status = json.load(f)
+        except (OSError, ValueError, TypeError):
+            return {'state': 'unknown'}
+        if status.get('state') == 'running' and self._stale(key, status):
+            # The worker building it died (or was recycled) without finishing
+            return dict(status, state='failed', error='the worker building it stopped; start it again')
+        return status
+
+    def _stale(self, key, status):
+        """A running job that no thread of this process owns and that has not progressed for STALE_S."""
+        with self._lock:
+            if key in self._running:
+                return False
+        return time.time() - status.get('updated', 0) >= STALE_S
+
+    def result(self, key):
+        """The finished figure as JSON bytes, or None."""
+        try:
+            with open(self._path(key, '.json'), 'rb') as f:
+                return f.read()
+        except (OSError, TypeError):
+            return None
+
+    def submit(self, field, depth_idx, dated_paths, build_figure):
+        """
+        Start (or join) the job animating `field` at `depth_idx` over `dated_paths`.
+
+        Parameters:
+        dated_paths (list): [(label, daily file path)] in playback order, at most max_frames.
+        build_figure (callable): (frames, labels, zmin=, zmax=, factor=) -> figure dict; lons/lats must be
+            decimated by `factor` (see decimate_coords).
+
+        Returns:
+        str: Job key to poll with status() and fetch with result().
+        """
+        dated_paths = list(dated_paths)[:self.max_frames]
+        labels = [label for label, _ in dated_paths]
+        paths = [path for _, path in dated_paths]
+        key = self.job_key(field, depth_idx, paths)
+        status = self.status(key)
+        if status['state'] == 'done':
+            return key
+        with self._lock:
+            if key in self._running:
+                return key
+            if status['state'] == 'running':
+                # Another worker is building it and still making progress (stale jobs report 'failed')
+                return key
+            self._running.add(key)
+        self._write_status(key, state='running', done=0, total=len(paths))
+        threading.Thread(target=self._run, args=(key, field, depth_idx, labels, paths, build_figure),
+                         name=f'nespreso-animation-{key}', daemon=True).start()
+        return key
+
+    def _run(self, key, field, depth_idx, labels, paths, build_figure):
+        start = time.perf_counter()
+        try:
+            with xr.open_dataset(paths[0]) as first:
+                factor = decimation_factor(first['lon'].size, self.max_px)
+            frames = self._read_frames(key, paths, field, depth_idx, factor)
+            quantized, zmin, zmax = quantize_stack(frames)
+            fig = build_figure(quantized, labels, zmin=zmin, zmax=zmax, factor=factor)
+            payload = pio.json.to_json_plotly(fig).encode()
+            tmp = self._path(key, f'.json.tmp{os.getpid()}')
+            with open(tmp, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp, self._path(key, '.json'))
+            self._write_status(key, state='done', done=len(paths), total=len(paths))
+            logger.info("animation=%s field=%s depth=%s frames=%d bytes=%d seconds=%.1f",
+                        key, field, depth_idx, len(paths), len(payload), time.perf_counter() - start)
+            self._prune()
+        except Exception as exc:
+            logger.exception("Animation %s failed", key)
+            self._write_status(key, state='failed', error=str(exc))
+        finally:
+            with self._lock:
+                self._running.discard(key)
+
+    def _read_frames(self, key, paths, field, depth_idx, factor):
+        frames = [None]*len(paths)
+        # Starting the pool costs a second or two; short animations are read faster in this thread
+        if self.workers <= 1 or len(paths) < 8:
+            for i, path in enumerate(paths):
+                frames[i] = read_frame(path, field, depth_idx, factor)
+                self._write_status(key, state='running', done=i + 1, total=len(paths))
+            return frames
+        # Spawned processes: the worker has threads, so it must not fork
+        context = multiprocessing.get_context('spawn')
+        with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.workers, len(paths)), mp_context=context) as pool:
+            futures = {pool.submit(read_frame, path, field, depth_idx, factor): i for i, path in enumerate(paths)}
+            written = time.monotonic()
+            for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                frames[futures[future]] = future.result()
+                # Also a heartbeat: other workers report jobs without progress for STALE_S as failed
+                if done % 5 == 0 or done == len(paths) or time.monotonic() - written > STALE_S/4:
+                    self._write_status(key, state='running', done=done, total=len(paths))
+                    written = time.monotonic()
+        return frames
+
+    def _prune(self):
+        try:
+            results = sorted((e for e in os.scandir(self.directory) if e.name.endswith('.json')
+                              and not e.name.endswith('.status.json')), key=lambda e: e.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+        for entry in results[self.keep:]:
+            for path in (entry.path, entry.path[:-5] + '.status.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+
+def default_animation_dir():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'nespreso_animations')
+
+
+animation_jobs = AnimationJobs(
+    directory=os.environ.get('NESPRESO_ANIMATION_DIR', default_animation_dir()),
+    workers=int(os.environ.get('NESPRESO_ANIMATION_WORKERS', '4')),
+    max_frames=int(os.environ.get('NESPRESO_ANIMATION_MAX_FRAMES', '120')),
+    max_px=int(os.environ.get('NESPRESO_ANIMATION_PX', '400')),
+    keep=int(os.environ.get('NESPRESO_ANIMATION_KEEP', '20')),
+)
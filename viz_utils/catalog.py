@@ -0,0 +1,105 @@
+"""
+Catalog of the daily NeSPReSO grid files and of the derived-product sidecar files written next to them.
+"""
+import logging
+import os
+import re
+
+import numpy as np
+import xarray as xr
+
+from viz_utils.ocean_utils import DERIVED_PRODUCTS
+
+logger = logging.getLogger(__name__)
+
+DATA_DIR = os.environ.get('NESPRESO_DATA_DIR', "/Net/work/ozavala/DATA/SubSurfaceFields/NeSPReSO")
+# Sidecars default to the grid directory; override when that is read-only
+DERIVED_DIR = os.environ.get('NESPRESO_DERIVED_DIR')
+
+date_regex = re.compile(r"nespreso_grid_(\d{4}-\d{2}-\d{2})\.nc$")
+
+
+def scan_available_dates(directory: str):
+    try:
+        candidates = [f for f in os.listdir(directory) if f.endswith('.nc')]
+    except Exception as exc:
+        logger.error("Failed listing directory %s: %s", directory, exc)
+        candidates = []
+    date_to_file = {}
+    for fname in candidates:
+        m = date_regex.search(fname)
+        if not m:
+            continue
+        date_str = m.group(1)
+        full_path = os.path.join(directory, fname)
+        # Keep the last occurrence if duplicates; they should point to same day
+        date_to_file[date_str] = full_path
+    sorted_dates = sorted(date_to_file.keys())
+    # Convert to numpy datetime64[D]
+    days = np.array([np.datetime64(d, 'D') for d in sorted_dates]) if sorted_dates else np.array([np.datetime64('2020-01-01')])
+    return date_to_file, days
+
+
+def source_version(path):
+    """Integer mtime of a grid file, used to detect reprocessed days. None if missing."""
+    try:
+        return int(os.stat(path).st_mtime)
+    except OSError:
+        return None
+
+
+def derived_sidecar_path(grid_path, date_str, out_dir=None):
+    directory = out_dir or DERIVED_DIR or os.path.dirname(grid_path)
+    return os.path.join(directory, f"nespreso_derived_{date_str}.nc")
+
+
+def sidecar_is_current(sidecar_path, grid_path, max_depth=None):
+    """True when the sidecar exists and was computed from the current version of the grid file."""
+    version = source_version(grid_path)
+    if version is None or not os.path.exists(sidecar_path):
+        return False
+    try:
+        with xr.open_dataset(sidecar_path) as sidecar:
+            if int(sidecar.attrs.get('source_mtime', -1)) != version:
+                return False
+            if max_depth is not None and float(sidecar.attrs.get('max_depth', -1)) != float(max_depth):
+                return False
+    except Exception:
+        return False
+    return True
+
+
+def write_derived_sidecar(sidecar_path, derived_maps, lats, lons, source_path, max_depth):
+    """Write derived 2D products to a compact NetCDF sidecar (atomic replace)."""
+    data_vars = {name: (('lat', 'lon'), np.asarray(derived_maps[name], dtype=np.float32)) for name in DERIVED_PRODUCTS}
+    sidecar = xr.Dataset(
+        data_vars,
+        coords={'lat': np.asarray(lats), 'lon': np.asarray(lons)},
+        attrs={
+            'source_file': os.path.basename(source_path),
+            'source_mtime': source_version(source_path) or -1,
+            'max_depth': float(max_depth),
+        },
+    )
+    encoding = {name: {'zlib': True, 'complevel': 4} for name in data_vars}
+    os.makedirs(os.path.dirname(sidecar_path), exist_ok=True)
+    tmp_path = f"{sidecar_path}.tmp{os.getpid()}"
+    sidecar.to_netcdf(tmp_path, encoding=encoding)
+    os.replace(tmp_path, sidecar_path)
+
+
+def read_derived_sidecar(sidecar_path, grid_path, max_depth=None):
+    """
+    Derived 2D products from a current sidecar as a dict of arrays, or None if missing, stale or computed
+    down to another `max_depth` than the caller's.
+    """
+    if not sidecar_is_current(sidecar_path, grid_path, max_depth):
+        return None
+    try:
+        with xr.open_dataset(sidecar_path) as sidecar:
+            if any(name not in sidecar for name in DERIVED_PRODUCTS):
+                return None
+            return {name: sidecar[name].values for name in DERIVED_PRODUCTS}
+    except Exception as exc:
+        logger.warning("Failed reading derived sidecar %s: %s", sidecar_path, exc)
+        return None
@@ -0,0 +1,115 @@
+"""
+Request coalescing for the dashboard callbacks.
+
+A single date change fires several callbacks at once (satellite maps, NeSPReSO maps, derived
+products, profiles, transects). BuildCache makes them share one prepared object per key: the first
+request builds it, concurrent requests for the same key wait for that build instead of repeating it.
+"""
+import functools
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from viz_utils.metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+class BuildCache:
+    """Thread-safe LRU whose misses are built once per key (single-flight)."""
+
+    def __init__(self, maxsize=16):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._building = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get_or_build(self, key, builder):
+        with self._lock:
+            value = self._items.get(key)
+            if value is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return value
+            self.misses += 1
+            event = self._building.get(key)
+            owner = event is None
+            if owner:
+                event = self._building[key] = threading.Event()
+        if not owner:
+            # Another request is building this key; wait for it instead of duplicating the work
+            event.wait()
+            with self._lock:
+                value = self._items.get(key)
+            if value is not None:
+                return value
+            return builder()
+        try:
+            value = builder()
+            with self._lock:
+                self._items[key] = value
+                while len(self._items) > self.maxsize:
+                    self._items.popitem(last=False)
+                    self.evictions += 1
+            return value
+        finally:
+            with self._lock:
+                self._building.pop(key, None)
+            event.set()
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def items(self):
+        """(key, value) pairs, least recently used first."""
+        with self._lock:
+            return list(self._items.items())
+
+    def evict_oldest(self):
+        """Drop the least recently used entry. Returns its key, or None if the cache is empty."""
+        with self._lock:
+            if not self._items:
+                return None
+            key, _ = self._items.popitem(last=False)
+            self.evictions += 1
+            return key
+
+    def evict(self, key):
+        """Drop the entry of `key`. Returns the key, or None if it is not cached."""
+        with self._lock:
+            if self._items.pop(key, None) is None:
+                return None
+            self.evictions += 1
+            return key
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+
+def timed_callback(func):
+    """Log and record (nespreso_callback_compute_seconds) the wall time of a Dash callback and the input that triggered it."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # Imported lazily so this module does not depend on a Dash request context
+        from dash import callback_context
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            try:
+                trigger = ','.join(t['prop_id'] for t in callback_context.triggered) or 'initial'
+            except Exception:
+                trigger = 'n/a'
+            elapsed = time.perf_counter() - start
+            metrics.observe('nespreso_callback_compute_seconds', elapsed, {'callback': func.__name__})
+            logger.info("callback=%s trigger=%s ms=%.1f", func.__name__, trigger, elapsed*1000)
+    return wrapper
@@ -0,0 +1,569 @@
+"""
+Batch export of maps, transects and profiles to PNG (and animated GIF), for reports.
+
+Images are rendered on the server without a browser: values are colour-mapped with the same
+cmocean palettes as the dashboard (viz_utils/raster.py), upscaled to about NESPRESO_EXPORT_PX
+pixels across, and the coastline from assets/coastline_gom_50m.json is burned in with a vectorized
+line rasteriser. Each image has a colour bar strip; its range, units, date and depth are stored in
+the PNG metadata and in the manifest.json of the zip.
+
+Images are rendered in a process pool (NESPRESO_EXPORT_WORKERS) and cached on disk
+(NESPRESO_EXPORT_DIR) under a key that covers the request and the source file versions, so
+repeated and overlapping exports only render what is new. An export runs as a background job
+(viz_utils/jobs.py) that writes the zip to disk while the browser polls its progress; only the
+finished zip is downloaded, so a long export never holds a server worker.
+
+GIF export needs Pillow; PNG export only needs numpy and zlib.
+"""
+import atexit
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import zipfile
+
+import numpy as np
+import xarray as xr
+
+from viz_utils.jobs import FileJobs
+from viz_utils.raster import PALETTE_SIZE, colorize, data_range, encode_png, image_extent
+from viz_utils.styles import NespresoStyles, color_cycle, get_palette
+from viz_utils.update_main import MAP_FIELDS, read_map_slice, to_display_units
+from viz_utils.update_trans import depth_selection, transect_points
+
+try:
+    from PIL import Image
+except Exception:
+    Image = None
+
+logger = logging.getLogger(__name__)
+
+# Bumped when the rendering changes, so cached images are rebuilt
+FORMAT_VERSION = 1
+
+DEFAULT_COASTLINE_FILE = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'assets', 'coastline_gom_50m.json')
+LAND_RGB = (225, 225, 225)
+COAST_RGB = (30, 30, 30)
+FRAME_RGB = (160, 160, 160)
+BACKGROUND_RGB = (255, 255, 255)
+
+_coastlines = {}
+
+
+def load_coastlines(path=None):
+    """Coastline LineStrings of a GeoJSON FeatureCollection as a list of (n, 2) lon/lat arrays, read once per file."""
+    path = path or os.environ.get('COASTLINE_FILE', DEFAULT_COASTLINE_FILE)
+    if path not in _coastlines:
+        lines = []
+        try:
+            with open(path) as f:
+                features = json.load(f).get('features', [])
+        except (OSError, ValueError, AttributeError):
+            features = []
+        for feature in features:
+            geom = feature.get('geometry') or {}
+            parts = [geom.get('coordinates', [])] if geom.get('type') == 'LineString' else \
+                geom.get('coordinates', []) if geom.get('type') == 'MultiLineString' else []
+            lines += [np.asarray(part, dtype=float)[:, :2] for part in parts if len(part) > 1]
+        _coastlines[path] = lines
+    return _coastlines[path]
+
+
+def draw_segments(img, x0, y0, x1, y1, color):
+    """
+    Draw line segments given in pixel coordinates (arrays) into img, in place. Every segment is
+    sampled at one point per pixel of its longer side; points outside the image are dropped.
+    """
+    x0, y0, x1, y1 = (np.asarray(a, dtype=float) for a in (x0, y0, x1, y1))
+    h, w = img.shape[:2]
+    # Segments entirely off one side of the image are skipped
+    keep = ~(((x0 < 0) & (x1 < 0)) | ((x0 >= w) & (x1 >= w)) | ((y0 < 0) & (y1 < 0)) | ((y0 >= h) & (y1 >= h)))
+    keep &= np.isfinite(x0) & np.isfinite(x1) & np.isfinite(y0) & np.isfinite(y1)
+    x0, y0, x1, y1 = x0[keep], y0[keep], x1[keep], y1[keep]
+    if x0.size == 0:
+        return img
+    n = np.minimum(np.ceil(np.maximum(np.abs(x1 - x0), np.abs(y1 - y0))).astype(int), w + h) + 1
+    seg = np.repeat(np.arange(n.size), n)
+    t = (np.arange(n.sum()) - np.repeat(np.cumsum(n) - n, n))/np.repeat(np.maximum(n - 1, 1), n)
+    cols = np.floor(x0[seg] + (x1[seg] - x0[seg])*t).astype(int)
+    rows = np.floor(y0[seg] + (y1[seg] - y0[seg])*t).astype(int)
+    inside = (cols >= 0) & (cols < w) & (rows >= 0) & (rows < h)
+    img[rows[inside], cols[inside]] = color
+    return img
+
+
+def burn_coastlines(img, lines, extent, color=COAST_RGB):
+    """Burn lon/lat lines into an image covering extent (lon_min, lon_max, lat_min, lat_max), north up."""
+    if not lines:
+        return img
+    lon_min, lon_max, lat_min, lat_max = extent
+    h, w = img.shape[:2]
+    segments = np.concatenate([np.stack([line[:-1], line[1:]], axis=1) for line in lines])
+    x = (segments[..., 0] - lon_min)/(lon_max - lon_min)*w
+    y = (lat_max - segments[..., 1])/(lat_max - lat_min)*h
+    return draw_segments(img, x[:, 0], y[:, 0], x[:, 1], y[:, 1], color)
+
+
+def resample(img, height, width):
+    """Nearest-neighbour resize of an (h, w, ...) image."""
+    rows = (np.arange(height)*img.shape[0]/height).astype(int)
+    cols = (np.arange(width)*img.shape[1]/width).astype(int)
+    return img[rows[:, np.newaxis], cols[np.newaxis, :]]
+
+
+def with_colorbar(rgb, cmap, bar_px=16, gap_px=12):
+    """rgb with a vertical colour bar strip on its right (maximum at the top)."""
+    h, w = rgb.shape[:2]
+    out = np.empty((h, w + gap_px + bar_px + 8, 3), dtype=np.uint8)
+    out[:] = BACKGROUND_RGB
+    out[:, :w] = rgb
+    top, bottom = h//10, h - h//10
+    palette = get_palette(cmap, PALETTE_SIZE)
+    levels = np.linspace(PALETTE_SIZE - 1, 0, bottom - top).round().astype(int)
+    out[top:bottom, w + gap_px:w + gap_px + bar_px] = palette[levels][:, np.newaxis, :]
+    out[[top, bottom - 1], w + gap_px:w + gap_px + bar_px] = FRAME_RGB
+    out[top:bottom, [w + gap_px, w + gap_px + bar_px - 1]] = FRAME_RGB
+    return out
+
+
+def colorize_rgb(z, cmap, zmin, zmax, nan_rgb=LAND_RGB):
+    """Colour-map z into an RGB image, NaNs (land, missing) drawn in nan_rgb."""
+    rgba = colorize(z, cmap, zmin, zmax)
+    rgb = rgba[..., :3].copy()
+    rgb[rgba[..., 3] == 0] = nan_rgb
+    return rgb
+
+
+def render_map(z, lons, lats, cmap, zmin, zmax, px=800, coastlines=()):
+    """
+    RGB image of a (lat, lon) slice, north up, upscaled by a whole factor to about `px` columns,
+    with the coastlines burned in and a colour bar.
+    """
+    rgb = colorize_rgb(np.asarray(z)[::-1, :], cmap, zmin, zmax)
+    scale = max(1, int(px)//rgb.shape[1])
+    rgb = np.repeat(np.repeat(rgb, scale, axis=0), scale, axis=1)
+    burn_coastlines(rgb, coastlines, image_extent(lons, lats))
+    return with_colorbar(rgb, cmap)
+
+
+def render_section(z, cmap, zmin, zmax, width=800, height=400):
+    """RGB image of a (depth, distance) section, surface at the top, with a colour bar."""
+    return with_colorbar(resample(colorize_rgb(z, cmap, zmin, zmax), height, width), cmap)
+
+
+def render_profiles(profiles, depths, colors, width=533, height=800, pad=12):
+    """
+    RGB line plot of profiles (depth, location) against depth (surface at the top), one colour per
+    location, in a frame spanning the value range.
+    """
+    img = np.empty((height, width, 3), dtype=np.uint8)
+    img[:] = BACKGROUND_RGB
+    lo, hi = data_range(profiles)
+    if lo is None:
+        return img
+    span = (hi - lo) or 1.0
+    lo, hi = lo - 0.05*span, hi + 0.05*span
+    depths = np.asarray(depths, dtype=float)
+    dmax = depths.max() if depths.max() > depths.min() else depths.min() + 1
+    y = pad + (depths - depths.min())/(dmax - depths.min())*(height - 1 - 2*pad)
+    x = pad + (np.asarray(profiles, dtype=float) - lo)/(hi - lo)*(width - 1 - 2*pad)
+    draw_segments(img, [pad, width - 1 - pad, width - 1 - pad, pad], [pad, pad, height - 1 - pad, height - 1 - pad],
+                  [width - 1 - pad, width - 1 - pad, pad, pad], [pad, height - 1 - pad, height - 1 - pad, pad], FRAME_RGB)
+    for i, color in enumerate(colors):
+        rgb = tuple(int(color[k:k + 2], 16) for k in (1, 3, 5))
+        draw_segments(img, x[:-1, i], y[:-1], x[1:, i], y[1:], rgb)
+    return img
+
+
+def encode_gif(frames, frame_ms=500):
+    """Animated GIF bytes from RGB frames (needs Pillow)."""
+    if Image is None:
+        raise RuntimeError("GIF export needs Pillow (pip install pillow)")
+    images = [Image.fromarray(frame).convert('P', palette=Image.ADAPTIVE, colors=256) for frame in frames]
+    buf = io.BytesIO()
+    images[0].save(buf, format='GIF', save_all=True, append_images=images[1:], duration=frame_ms, loop=0)
+    return buf.getvalue()
+
+
+def nearest_depth(data, depth_m):
+    depths = data['depth'].values
+    return int(np.abs(depths - float(depth_m)).argmin()), float(depths[np.abs(depths - float(depth_m)).argmin()])
+
+
+def _field_slice(data, field, depth_m, time_idx=0):
+    depth_idx, depth = nearest_depth(data, depth_m) if MAP_FIELDS[field]['has_depth'] else (0, None)
+    return read_map_slice(data, field, depth_idx, time_idx), depth
+
+
+def render_task(task, px=800, coastline_file=None):
+    """
+    Render one export item. Module-level so process pool workers can run it.
+
+    Returns:
+    tuple: (image bytes, metadata dict)
+    """
+    kind, field = task['kind'], task['field']
+    spec = MAP_FIELDS[field]
+    meta = {'kind': kind, 'field': field, 'units': spec['colorbar_title']}
+    if kind == 'gif':
+        frames, depth = [], None
+        for _, path in task['dated_paths']:
+            with xr.open_dataset(path) as data:
+                z, depth = _field_slice(data, field, task.get('depth_m', 0))
+                lons, lats = data['lon'].values, data['lat'].values
+            frames.append(z)
+        lows, highs = zip(*(data_range(z) for z in frames))
+        zmin = min((v for v in lows if v is not None), default=None)
+        zmax = max((v for v in highs if v is not None), default=None)
+        coastlines = load_coastlines(coastline_file)
+        images = [render_map(z, lons, lats, spec['cmap'], zmin, zmax, px, coastlines) for z in frames]
+        meta.update(dates=[d for d, _ in task['dated_paths']], depth_m=depth, zmin=zmin, zmax=zmax)
+        return encode_gif(images, task.get('frame_ms', 500)), meta
+    with xr.open_dataset(task['path']) as data:
+        if kind == 'map':
+            z, depth = _field_slice(data, field, task.get('depth_m', 0))
+            zmin, zmax = data_range(z)
+            rgb = render_map(z, data['lon'].values, data['lat'].values, spec['cmap'], zmin, zmax, px,
+                             load_coastlines(coastline_file))
+            meta.update(depth_m=depth)
+        elif kind == 'transect':
+            lons, lats, dist, _ = transect_points(task['transect'], task.get('res', 0.04))
+            var = data[spec['var']]
+            if 'time' in var.dims:
+                var = var.isel(time=0)
+            section = var.isel(depth=depth_selection(task['depth_type']))
+            section = section.interp(lat=('points', lats), lon=('points', lons))
+            z = to_display_units(np.asarray(section.values, dtype=np.float32), field)
+            zmin, zmax = data_range(z)
+            rgb = render_section(z, spec['cmap'], zmin, zmax, px, px//2)
+            meta.update(transect=task['transect'], distance_km=int(dist[-1]), depth_range_m=[float(section.depth.min()), float(section.depth.max())])
+        elif kind == 'profiles':
+            locs = np.asarray(task['prof_loc'], dtype=float).reshape(-1, 2)
+            lat_idx = np.abs(data['lat'].values[np.newaxis, :] - locs[:, :1]).argmin(axis=1)
+            lon_idx = np.abs(data['lon'].values[np.newaxis, :] - locs[:, 1:]).argmin(axis=1)
+            var = data[spec['var']]
+            if 'time' in var.dims:
+                var = var.isel(time=0)
+            sel = depth_selection(task['depth_type'])
+            # One pointwise read for all locations
+            z = var.isel(depth=sel, lat=xr.DataArray(lat_idx, dims='points'), lon=xr.DataArray(lon_idx, dims='points'))
+            depths = z.depth.values
+            z = to_display_units(np.asarray(z.values, dtype=np.float32), field)
+            zmin, zmax = data_range(z)
+            rgb = render_profiles(z, depths, color_cycle(NespresoStyles.colors, locs.shape[0]), px*2//3, px)
+            meta.update(locations=locs.tolist(), depth_range_m=[float(depths.min()), float(depths.max())])
+        else:
+            raise ValueError(f"Unknown export item {kind!r}")
+    meta.update(date=task['date'], zmin=zmin, zmax=zmax)
+    text = {'Title': f"NeSPReSO {field} {kind} {task['date']}", 'Source': 'NeSPReSO (Miranda et al. 2025)',
+            'Comment': json.dumps(meta)}
+    return encode_png(rgb, text=text), meta
+
+
+class ImageExporter:
+    """
+    Plans, renders (in a process pool) and caches export images, and writes them as a zip in a
+    background job.
+
+    Parameters:
+    directory (str): Disk cache of rendered images.
+    workers (int): Render processes (1 renders in the request thread).
+    px (int): Approximate width of the images in pixels.
+    max_items (int): Largest number of images per export.
+    max_bytes (int): Size of the disk cache; oldest images are removed beyond it.
+    coastline_file (str): GeoJSON coastline burned into the maps (COASTLINE_FILE or the bundled asset by default).
+    min_pool_items (int): Smaller exports render in the calling thread, which is faster than starting the pool.
+    keep (int): Finished export zips kept for download (in `directory`/jobs).
+    """
+
+    def __init__(self, directory, workers=4, px=800, max_items=500, max_bytes=512*2**20, coastline_file=None,
+                 min_pool_items=32, keep=10):
+        self.directory = directory
+        self.workers = workers
+        self.min_pool_items = min_pool_items
+        self._pool = None
+        self._lock = threading.Lock()
+        self.px = px
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.coastline_file = coastline_file
+        self.jobs = FileJobs(os.path.join(directory, 'jobs'), suffix='.zip', keep=keep, name='export')
+
+    def plan(self, date_to_file, fields=(), depths=(0,), start=None, end=None, step=1, fmt='png',
+             transect=None, prof_loc=None, date=None, depth_type='upto500', frame_ms=500):
+        """
+        Export items for a request.
+
+        Parameters:
+        date_to_file (dict): Catalog of daily files (YYYY-MM-DD -> path).
+        fields (list): Map fields (MAP_FIELDS keys) rendered for every date from start to end, every `step` days.
+        depths (list): Depths in metres for the depth fields (nearest level).
+        fmt (str): 'png' for one image per field, depth and date; 'gif' for one animation per field and depth.
+        transect (list): [[lat0, lon0], [lat1, lon1]] rendered as temperature and salinity sections on `date`.
+        prof_loc (list): [[lat, lon], ...] rendered as temperature and salinity profiles on `date`.
+
+        Returns:
+        list: Item dicts with the zip entry name under 'name'.
+
+        Raises:
+        ValueError: For unknown fields or formats, no data in the range, or too many items.
+        """
+        if fmt not in ('png', 'gif'):
+            raise ValueError("format must be png or gif")
+        if fmt == 'gif' and Image is None:
+            raise ValueError("GIF export needs Pillow on the server")
+        unknown = [f for f in fields if f not in MAP_FIELDS]
+        if unknown:
+            raise ValueError(f"Unknown fields: {', '.join(unknown)}; use {', '.join(MAP_FIELDS)}")
+        dates = sorted(date_to_file)
+        selected = [d for d in dates if (start is None or d >= start) and (end is None or d <= end)][::max(int(step), 1)]
+        items = []
+        for field in fields:
+            field_depths = depths if MAP_FIELDS[field]['has_depth'] else [0]
+            depth_tag = (lambda d: f'_{d:g}m') if MAP_FIELDS[field]['has_depth'] else (lambda d: '')
+            for depth in field_depths:
+                if fmt == 'gif' and selected:
+                    items.append({'kind': 'gif', 'field': field, 'depth_m': depth, 'frame_ms': frame_ms,
+                                  'dated_paths': [(d, date_to_file[d]) for d in selected],
+                                  'name': f'animations/{field}{depth_tag(depth)}_{selected[0]}_{selected[-1]}.gif'})
+                    continue
+                items += [{'kind': 'map', 'field': field, 'depth_m': depth, 'date': d, 'path': date_to_file[d],
+                           'name': f'maps/{field}{depth_tag(depth)}_{d}.png'} for d in selected]
+        date = date if date in date_to_file else (selected[-1] if selected else (dates[-1] if dates else None))
+        for kind, key, locations in (('transect', 'transect', transect), ('profiles', 'prof_loc', prof_loc)):
+            if locations and date is not None:
+                for field in ('Temperature', 'Salinity'):
+                    items.append({'kind': kind, 'field': field, 'date': date, 'path': date_to_file[date],
+                                  'depth_type': depth_type, key: locations, 'name': f'{kind}/{field}_{date}.png'})
+        if not items:
+            raise ValueError("Nothing to export: no data in the date range and no transect or profiles")
+        if len(items) > self.max_items:
+            raise ValueError(f"{len(items)} images requested; the limit is {self.max_items}")
+        return items
+
+    def _executor(self):
+        # Started on first use and kept: spawning the processes and importing the renderer takes
+        # several seconds. Spawned rather than forked because the server worker has threads.
+        with self._lock:
+            if self._pool is None:
+                self._pool = concurrent.futures.ProcessPoolExecutor(
+                    max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+                atexit.register(self._pool.shutdown, cancel_futures=True)
+            return self._pool
+
+    def item_key(self, item):
+        paths = [p for _, p in item['dated_paths']] if item['kind'] == 'gif' else [item['path']]
+        versions = []
+        for path in paths:
+            try:
+                versions.append(int(os.stat(path).st_mtime))
+            except OSError:
+                versions.append(None)
+        raw = json.dumps([FORMAT_VERSION, self.px, self.coastline_file, item, versions], sort_keys=True, default=str)
+        return hashlib.sha1(raw.encode()).hexdigest()
+
+    def _cached(self, key):
+        try:
+            with open(os.path.join(self.directory, f'{key}.meta.json')) as f:
+                meta = json.load(f)
+            path = os.path.join(self.directory, key)
+            os.utime(path)
+            return path, meta
+        except (OSError, ValueError):
+            return None
+
+    def _store(self, key, data, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(self.directory, key)
+        for target, payload in ((path, data), (path + '.meta.json', json.dumps(meta).encode())):
+            fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp, target)
+        return path
+
+    def rendered(self, items):
+        """
+        Yield (item, image path, metadata) for every item: cached images first, then the others as
+        the pool renders them.
+        """
+        missing = []
+        for item in items:
+            key = self.item_key(item)
+            hit = self._cached(key)
+            if hit is not None:
+                yield (item,) + hit
+            else:
+                missing.append((key, item))
+        if not missing:
+            return
+        start = time.perf_counter()
+        if self.workers <= 1 or len(missing) < self.min_pool_items:
+            for key, item in missing:
+                data, meta = render_task(item, self.px, self.coastline_file)
+                yield item, self._store(key, data, meta), meta
+        else:
+            futures = {self._executor().submit(render_task, item, self.px, self.coastline_file): (key, item)
+                       for key, item in missing}
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    key, item = futures[future]
+                    data, meta = future.result()
+                    yield item, self._store(key, data, meta), meta
+            except concurrent.futures.process.BrokenProcessPool:
+                self._pool = None
+                raise
+            finally:
+                # A download cancelled half way does not leave its renders queued
+                for future in futures:
+                    future.cancel()
+        logger.info("export rendered=%d cached=%d seconds=%.1f", len(missing), len(items) - len(missing),
+                    time.perf_counter() - start)
+        self._prune()
+
+    def write_zip(self, items, path, progress=None):
+        """
+        Write a zip with every item and a manifest.json to `path`, calling progress(done, total)
+        as images become ready.
+        """
+        manifest = []
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            for done, (item, image_path, meta) in enumerate(self.rendered(items), start=1):
+                archive.write(image_path, item['name'])
+                manifest.append(dict(meta, file=item['name']))
+                if progress is not None:
+                    progress(done, len(items))
+            archive.writestr(zipfile.ZipInfo('manifest.json', date_time=time.localtime()[:6]),
+                             json.dumps(sorted(manifest, key=lambda m: m['file']), indent=1), compress_type=zipfile.ZIP_DEFLATED)
+
+    def submit(self, items):
+        """
+        Start (or join) the background job writing the zip of `items`.
+
+        Returns:
+        str: Job key for self.jobs.status() and self.jobs.result_path().
+        """
+        raw = json.dumps([[item['name'], self.item_key(item)] for item in items])
+        key = hashlib.sha1(raw.encode()).hexdigest()[:20]
+        dates = sorted({item.get('date') or item['dated_paths'][-1][0] for item in items})
+        return self.jobs.submit(key, lambda path, progress: self.write_zip(items, path, progress), total=len(items),
+                                filename=f"nespreso_images_{dates[0]}_{dates[-1]}.zip")
+
+    def _prune(self):
+        try:
+            entries = [e for e in os.scandir(self.directory)
+                       if e.is_file() and not e.name.endswith(('.meta.json', '.tmp'))]
+            entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+        total = 0
+        for entry in entries:
+            try:
+                total += entry.stat().st_size
+            except OSError:
+                continue
+            if total > self.max_bytes:
+                for path in (entry.path, entry.path + '.meta.json'):
+                    try:
+                        os.remove(path)
+                    except OSError:
+                        pass
+
+
+def parse_export_args(args):
+    """
+    Export options from query parameters: fields, depths (comma separated), start, end, step, format,
+    transect (lat0,lon0,lat1,lon1), profiles (lat,lon;lat,lon;...), date and depth_type.
+
+    Raises:
+    ValueError: For malformed numbers.
+    """
+    def numbers(text):
+        return [float(v) for v in text.replace(';', ',').split(',') if v.strip()]
+
+    options = {
+        'fields': [f for f in args.get('fields', '').split(',') if f],
+        'depths': numbers(args.get('depths', '0')) or [0],
+        'start': args.get('start') or None,
+        'end': args.get('end') or None,
+        'step': int(args.get('step', 1)),
+        'fmt': args.get('format', 'png').lower(),
+        'date': args.get('date') or None,
+        'depth_type': args.get('depth_type', 'upto500'),
+    }
+    if args.get('transect'):
+        values = numbers(args['transect'])
+        if len(values) != 4:
+            raise ValueError("transect needs lat0,lon0,lat1,lon1")
+        options['transect'] = [values[:2], values[2:]]
+    if args.get('profiles'):
+        values = numbers(args['profiles'])
+        if len(values) % 2:
+            raise ValueError("profiles needs lat,lon pairs")
+        options['prof_loc'] = np.asarray(values).reshape(-1, 2).tolist()
+    return options
+
+
+def install_export(server, exporter, date_to_file, prefix='/nespreso_viz'):
+    """
+    Add the image export routes (also under `prefix`) to `server` (a Flask app):
+    GET /export/images with the query parameters of parse_export_args starts (or joins) the export
+    job and answers 202 with its key, status and download URLs;
+    GET /export/images/<key>/status reports its progress;
+    GET /export/images/<key>.zip serves the finished zip.
+
+    Parameters:
+    date_to_file (callable): Current catalog of daily files (YYYY-MM-DD -> path).
+    """
+    from flask import jsonify, request, send_file
+
+    def urls(key):
+        base = f"{request.script_root}{prefix}/export/images/{key}"
+        return {'key': key, 'status_url': f"{base}/status", 'download': f"{base}.zip"}
+
+    def export_images():
+        try:
+            options = parse_export_args(request.args)
+            items = exporter.plan(date_to_file(), **options)
+        except ValueError as exc:
+            return jsonify({'error': str(exc)}), 400
+        key = exporter.submit(items)
+        return jsonify(dict(exporter.jobs.status(key), **urls(key))), 202
+
+    def export_status(key):
+        status = exporter.jobs.status(key)
+        if status['state'] == 'unknown':
+            return jsonify(status), 404
+        return jsonify(dict(status, **urls(key)))
+
+    def export_download(key):
+        path = exporter.jobs.result_path(key)
+        if path is None:
+            return jsonify({'error': "Export not ready or expired", **exporter.jobs.status(key)}), 404
+        filename = exporter.jobs.status(key).get('filename') or f"nespreso_images_{key}.zip"
+        return send_file(path, mimetype='application/zip', as_attachment=True, download_name=filename)
+
+    for base, suffix in (('', ''), (prefix, '_prefixed')):
+        server.add_url_rule(f'{base}/export/images', f'export_images{suffix}', export_images)
+        server.add_url_rule(f'{base}/export/images/<key>/status', f'export_status{suffix}', export_status)
+        server.add_url_rule(f'{base}/export/images/<key>.zip', f'export_download{suffix}', export_download)
+
+
+def default_export_dir():
+    return os.path.join(tempfile.gettempdir(), 'nespreso_exports')
+
+
+exporter = ImageExporter(
+    directory=os.environ.get('NESPRESO_EXPORT_DIR', default_export_dir()),
+    workers=int(os.environ.get('NESPRESO_EXPORT_WORKERS', '4')),
+    px=int(os.environ.get('NESPRESO_EXPORT_PX', '800')),
+    max_items=int(os.environ.get('NESPRESO_EXPORT_MAX_ITEMS', '500')),
+    max_bytes=int(float(os.environ.get('NESPRESO_EXPORT_CACHE_MB', '512'))*2**20),
+    keep=int(os.environ.get('NESPRESO_EXPORT_KEEP', '10')),
+)
@@ -0,0 +1,92 @@
+"""
+Figure construction without plotly's graph_objs validation.
+
+go.Figure/go.Heatmap validate every property and copy the array data on construction. The
+builders here emit the same structure as plain dicts (with numpy arrays encoded as plotly.js typed
+arrays, as go does), which Dash serialises directly. Opt in per figure type with
+NESPRESO_DICT_FIGURES=maps,profiles,transects (or 'all'); tools/check_figure_parity.py compares
+both paths.
+"""
+import functools
+import os
+
+import plotly
+import plotly.graph_objs as go
+import plotly.io as pio
+
+# plotly >= 6 ships numpy arrays to the browser as base64 typed arrays; the dict path has to do the
+# same through plotly's own (private) helper, so a plotly release that moves it fails at import
+# instead of silently sending plain lists. plotly 5 sends lists on both paths.
+if int(plotly.__version__.split('.')[0]) >= 6:
+    from _plotly_utils.utils import convert_to_base64
+else:
+    convert_to_base64 = None
+
+DICT_FIGURE_KINDS = ('maps', 'profiles', 'transects')
+
+# Trace types used by the dashboard and their graph_objs classes
+GO_TRACES = {
+    'heatmap': go.Heatmap,
+    'scatter': go.Scatter,
+    'scattergl': go.Scattergl,
+}
+
+
+@functools.lru_cache(maxsize=4)
+def _template(name):
+    """Layout template go.Figure would apply by default, as a plain dict (built once per template)."""
+    return pio.templates[name].to_plotly_json()
+
+
+def _drop_none(value):
+    """Remove None-valued properties, which graph_objs treats as unset."""
+    if isinstance(value, dict):
+        return {k: _drop_none(v) for k, v in value.items() if v is not None}
+    if isinstance(value, (list, tuple)) and any(isinstance(v, dict) for v in value):
+        return [_drop_none(v) for v in value]
+    return value
+
+
+def dict_figures_enabled(kind):
+    """True when figures of `kind` ('maps', 'profiles', 'transects') should be built as plain dicts."""
+    value = os.environ.get('NESPRESO_DICT_FIGURES', '').lower()
+    kinds = {k.strip() for k in value.split(',') if k.strip()}
+    return 'all' in kinds or kind in kinds
+
+
+class FigureBuilder:
+    """
+    Builds traces and figures either as graph_objs (plain=False) or as plain dicts (plain=True).
+    Both expose fig['layout'][...] item access, which is all the callers rely on after construction.
+    """
+
+    def __init__(self, plain=False):
+        self.plain = plain
+
+    def trace(self, trace_type, **props):
+        if self.plain:
+            return dict(type=trace_type, **props)
+        return GO_TRACES[trace_type](**props)
+
+    def figure(self, data=(), layout=None):
+        layout = dict(layout or {})
+        if not self.plain:
+            return go.Figure(data=list(data), layout=go.Layout(**layout))
+        # Empty layout arrays (shapes=[], images=[]) are omitted by graph_objs too
+        layout = {k: v for k, v in _drop_none(layout).items() if not (isinstance(v, (list, tuple)) and not v)}
+        if 'template' not in layout and pio.templates.default:
+            layout['template'] = _template(pio.templates.default)
+        fig = {
+            'data': [t.to_plotly_json() if hasattr(t, 'to_plotly_json') else _drop_none(t) for t in data],
+            'layout': layout,
+        }
+        if convert_to_base64 is not None:
+            convert_to_base64(fig)
+        return fig
+
+    def shape(self, fig, **shape):
+        """Append a layout shape (plain equivalent of Figure.add_shape)."""
+        if self.plain:
+            fig['layout'].setdefault('shapes', []).append(shape)
+        else:
+            fig.add_shape(**shape)
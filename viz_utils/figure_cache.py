@@ -0,0 +1,234 @@
+"""
+Cache of serialised callback outputs (figures), shared by all users and workers.
+
+Entries are the JSON bytes of a callback's outputs, keyed by a hash of the callback name, its
+inputs (date, field, depth, overlays, viewport...), the version of the day's source file and a
+fingerprint of the figure code. A memory LRU bounded by bytes sits in front of an optional
+directory tier (by default in /dev/shm) that every gunicorn worker reads and writes.
+Reprocessed files change the source version, so stale entries are never served.
+"""
+import functools
+import glob
+import hashlib
+import inspect
+import json
+import logging
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+import plotly.io as pio
+from dash import no_update
+
+logger = logging.getLogger(__name__)
+
+_NO_UPDATE = {'__nespreso_no_update__': True}
+
+# Settings that change what a figure callback returns. They are part of the code fingerprint, so
+# changing any of them on a restart never serves figures built under the old values.
+FIGURE_SETTINGS = (
+    'NESPRESO_MAP_RENDER',
+    'NESPRESO_MAP_PX',
+    'NESPRESO_TILE_URL_PREFIX',
+    'NESPRESO_RASTER_HOVER_CELLS',
+    'NESPRESO_PROFILE_AGGREGATE',
+    'NESPRESO_DICT_FIGURES',
+    'NESPRESO_ANIMATION_PX',
+    'NESPRESO_EXPORT_PX',
+)
+
+
+def code_fingerprint():
+    """
+    Changes whenever the figure code or one of FIGURE_SETTINGS changes, so a deploy never serves
+    old figures.
+    """
+    base = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    paths = sorted(glob.glob(os.path.join(base, 'viz_utils', '*.py')) + [os.path.join(base, 'nespreso_viz.py')])
+    parts = [f"{name}={os.environ.get(name, '')}" for name in FIGURE_SETTINGS]
+    for path in paths:
+        try:
+            st = os.stat(path)
+            parts.append(f"{os.path.basename(path)}:{st.st_size}:{int(st.st_mtime)}")
+        except OSError:
+            continue
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()[:12]
+
+
+def encode_outputs(outputs):
+    """Serialise callback outputs (figures, dicts, dash.no_update) to JSON bytes."""
+    if isinstance(outputs, (list, tuple)):
+        outputs = [_NO_UPDATE if o is no_update else o for o in outputs]
+    return pio.json.to_json_plotly(outputs).encode()
+
+
+def decode_outputs(payload):
+    outputs = json.loads(payload)
+    if isinstance(outputs, list):
+        return [no_update if o == _NO_UPDATE else o for o in outputs]
+    return outputs
+
+
+class FigureCache:
+    """
+    Two-tier cache of JSON bytes: an in-process LRU bounded by `max_bytes` and an optional
+    directory shared between processes, pruned (oldest first) to `disk_max_bytes`.
+    """
+
+    def __init__(self, max_bytes=256*2**20, directory=None, disk_max_bytes=512*2**20):
+        self.max_bytes = max_bytes
+        self.directory = directory
+        self.disk_max_bytes = disk_max_bytes
+        self._items = OrderedDict()
+        self._nbytes = 0
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError as exc:
+                logger.warning("Figure cache directory %s unavailable (%s); using memory only", directory, exc)
+                self.directory = None
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def get(self, key):
+        with self._lock:
+            payload = self._items.get(key)
+            if payload is not None:
+                self._items.move_to_end(key)
+                self.hits += 1
+                return payload
+        if self.directory:
+            try:
+                with open(self._path(key), 'rb') as f:
+                    payload = f.read()
+            except OSError:
+                payload = None
+            if payload is not None:
+                self._remember(key, payload)
+                with self._lock:
+                    self.disk_hits += 1
+                return payload
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, key, payload):
+        self._remember(key, payload)
+        if not self.directory:
+            return
+        tmp_path = f"{self._path(key)}.tmp{os.getpid()}.{threading.get_ident()}"
+        try:
+            with open(tmp_path, 'wb') as f:
+                f.write(payload)
+            os.replace(tmp_path, self._path(key))
+        except OSError as exc:
+            logger.warning("Failed writing figure cache entry: %s", exc)
+            return
+        self._puts_since_prune += 1
+        if self._puts_since_prune >= 50:
+            self._puts_since_prune = 0
+            self.prune_disk()
+
+    def _remember(self, key, payload):
+        if len(payload) > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._items.pop(key, None)
+            if previous is not None:
+                self._nbytes -= len(previous)
+            self._items[key] = payload
+            self._nbytes += len(payload)
+            while self._nbytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._nbytes -= len(evicted)
+                self.evictions += 1
+
+    def prune_disk(self):
+        """Delete the least recently written entries until the directory fits its budget."""
+        try:
+            entries = [e for e in os.scandir(self.directory) if e.name.endswith('.json')]
+            stats = sorted(((e.stat().st_mtime, e.stat().st_size, e.path) for e in entries))
+        except OSError:
+            return
+        total = sum(size for _, size, _ in stats)
+        for _, size, path in stats:
+            if total <= self.disk_max_bytes:
+                break
+            try:
+                os.remove(path)
+                total -= size
+            except OSError:
+                pass
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+            self._nbytes = 0
+        if self.directory:
+            for path in glob.glob(os.path.join(self.directory, '*.json')):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def items(self):
+        with self._lock:
+            return list(self._items.items())
+
+    def evict_oldest(self):
+        """Drop the least recently used in-process entry; the shared directory keeps its copy."""
+        with self._lock:
+            if not self._items:
+                return None
+            key, payload = self._items.popitem(last=False)
+            self._nbytes -= len(payload)
+            self.evictions += 1
+            return key
+
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._items)
+
+    def cached(self, version_for, date_arg='cur_date_str'):
+        """
+        Decorator for figure callbacks. The cache key covers the function name, all its arguments
+        and `version_for(date)` (the source file version of the requested day). A hit skips building
+        the figure but still decodes the stored JSON, which Dash serialises again for the response.
+        """
+        fingerprint = code_fingerprint()
+
+        def decorator(func):
+            signature = inspect.signature(func)
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                bound = signature.bind(*args, **kwargs)
+                bound.apply_defaults()
+                arguments = dict(bound.arguments)
+                raw = json.dumps([func.__name__, fingerprint, version_for(arguments.get(date_arg)), arguments],
+                                 sort_keys=True, default=str)
+                key = hashlib.sha1(raw.encode()).hexdigest()
+                payload = self.get(key)
+                if payload is not None:
+                    logger.debug("figure_cache=hit callback=%s bytes=%d", func.__name__, len(payload))
+                    return decode_outputs(payload)
+                outputs = func(*args, **kwargs)
+                self.put(key, encode_outputs(outputs))
+                return outputs
+            return wrapper
+        return decorator
+
+
+def default_cache_dir():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'nespreso_figures')
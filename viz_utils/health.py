@@ -0,0 +1,162 @@
+"""
+Liveness and readiness routes for load balancers and monitoring.
+
+/healthz answers as long as the worker can serve requests. /readyz reports whether the worker is
+ready for users: the catalog has data and every warm-up check (the default date's dataset and views,
+warm-up itself) has passed at least once. Readiness is latched per check, so later LRU evictions of
+the default date do not take a warm worker out of rotation; the current state is reported as well.
+It also reports data freshness (newest date served and on disk vs today), upstream API reachability
+and worker memory; with ?strict=1 stale data or an unreachable upstream also make it fail.
+
+Both answer from cached values: slow checks (directory listings on network storage, upstream
+probes) run in background threads at most every `ttl` seconds, so polling never waits on them.
+"""
+import datetime
+import logging
+import os
+import threading
+import time
+
+import requests
+
+from viz_utils.memory import rss_bytes
+
+logger = logging.getLogger(__name__)
+
+
+class CachedCheck:
+    """
+    Result of a slow function, refreshed in a background thread when older than `ttl` seconds.
+    Reading never blocks; before the first result it returns None.
+    """
+
+    def __init__(self, func, ttl=60.0):
+        self.func = func
+        self.ttl = ttl
+        self.value = None
+        self.checked_at = None
+        self._lock = threading.Lock()
+        self._running = False
+
+    def get(self):
+        now = time.time()
+        if self.checked_at is None or now - self.checked_at > self.ttl:
+            with self._lock:
+                start, self._running = not self._running, True
+            if start:
+                threading.Thread(target=self._refresh, daemon=True).start()
+        return self.value
+
+    def _refresh(self):
+        try:
+            self.value = self.func()
+        except Exception as exc:
+            self.value = {'error': repr(exc)}
+        finally:
+            self.checked_at = time.time()
+            with self._lock:
+                self._running = False
+
+    def age(self):
+        return None if self.checked_at is None else round(time.time() - self.checked_at, 1)
+
+
+def probe_url(url, timeout=3.0):
+    """Reachability of an HTTP endpoint. Any answer below 500 counts (POST-only APIs answer GET with 405)."""
+    start = time.perf_counter()
+    try:
+        response = requests.get(url, timeout=timeout, stream=True)
+        response.close()
+        return {'reachable': response.status_code < 500, 'status': response.status_code,
+                'ms': round((time.perf_counter() - start)*1000, 1)}
+    except requests.RequestException as exc:
+        return {'reachable': False, 'error': type(exc).__name__, 'ms': round((time.perf_counter() - start)*1000, 1)}
+
+
+def days_behind(date_str, today=None):
+    if not date_str:
+        return None
+    today = today or datetime.date.today()
+    return (today - datetime.date.fromisoformat(date_str)).days
+
+
+def install_health(server, newest_served, newest_on_disk, warm_checks, upstreams, memory=None, details=None,
+                   max_age_days=2, probe_ttl=60.0, scan_ttl=300.0, prefix='/nespreso_viz'):
+    """
+    Add /healthz and /readyz (also under `prefix`) to `server` (a Flask app).
+
+    Parameters:
+    newest_served (callable): Newest date (YYYY-MM-DD) in the catalog the app serves.
+    newest_on_disk (callable): Newest date currently in the data directory (run in the background).
+    warm_checks (dict): name -> callable returning True while that part is warm; each must have passed once
+        for readiness.
+    upstreams (dict): name -> URL of the external APIs to probe.
+    memory (MemoryAccountant): For the worker memory budget, optional.
+    details (dict): name -> callable returning extra JSON-serialisable status reported by /readyz.
+    max_age_days (int): Data older than this many days counts as stale.
+    """
+    from flask import jsonify, request
+
+    started = time.time()
+    warmed = set()
+    disk_check = CachedCheck(newest_on_disk, ttl=scan_ttl)
+    probes = {name: CachedCheck(lambda url=url: probe_url(url), ttl=probe_ttl) for name, url in upstreams.items()}
+
+    def check_warm():
+        warm = {}
+        for name, check in warm_checks.items():
+            try:
+                warm[name] = bool(check())
+            except Exception:
+                warm[name] = False
+            if warm[name]:
+                warmed.add(name)
+        return warm
+
+    # Whatever the app prepared before installing the routes (with preload_app, inherited by every worker)
+    # counts as warmed even if no probe arrives before it is evicted
+    check_warm()
+
+    def healthz():
+        return jsonify({'status': 'ok', 'pid': os.getpid(), 'uptime_s': round(time.time() - started, 1)})
+
+    def readyz():
+        served = newest_served()
+        on_disk = disk_check.get()
+        behind = days_behind(served)
+        warm = check_warm()
+        upstream = {}
+        for name, probe in probes.items():
+            result = probe.get()
+            upstream[name] = dict(result or {'reachable': None}, age_s=probe.age())
+        rss = rss_bytes()
+        budget = memory.budget_bytes if memory is not None else 0
+        stale = behind is None or behind > max_age_days
+        ready = served is not None and warmed.issuperset(warm_checks)
+        if request.args.get('strict'):
+            ready = ready and not stale and all(u.get('reachable') for u in upstream.values())
+        body = {
+            'status': 'ready' if ready else 'not ready',
+            'pid': os.getpid(),
+            'uptime_s': round(time.time() - started, 1),
+            'data': {
+                'newest_served': served,
+                'newest_on_disk': on_disk if not isinstance(on_disk, dict) else None,
+                'days_behind': behind,
+                'stale': stale,
+                'max_age_days': max_age_days,
+            },
+            'warm': warm,
+            'warmed_once': {name: name in warmed for name in warm_checks},
+            'upstream': upstream,
+            'memory': {'rss_bytes': rss, 'budget_bytes': budget, 'over_budget': bool(budget) and rss > budget},
+        }
+        for name, detail in (details or {}).items():
+            body[name] = detail()
+        if isinstance(on_disk, str) and served is not None and on_disk > served:
+            body['data']['note'] = 'newer data on disk than served'
+        return jsonify(body), 200 if ready else 503
+
+    for base, suffix in (('', ''), (prefix, '_prefixed')):
+        server.add_url_rule(f'{base}/healthz', f'healthz{suffix}', healthz)
+        server.add_url_rule(f'{base}/readyz', f'readyz{suffix}', readyz)
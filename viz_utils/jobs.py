@@ -0,0 +1,188 @@
+"""
+Background jobs that each produce one file (an image export zip, a bulk profile zip), with their
+progress shared through a directory.
+
+Long downloads do not run inside a request: gunicorn runs a single sync worker, so a request that
+renders or fetches for minutes blocks every other user and is cut at the worker timeout. A job runs
+in a thread of the worker that starts it, in the same way as the time-lapse jobs of
+viz_utils/animation.py: it writes `<key>.status.json` as it progresses (and as a heartbeat while a
+step takes long), the browser polls the status, and the finished `<key><suffix>` file is served as
+a download. Starting the same job again joins the running one or reuses its result, and a job whose
+worker died is reported as failed once its status has not changed for STALE_S seconds.
+"""
+import json
+import logging
+import os
+import re
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds without a status update after which a running job owned by another process is failed
+STALE_S = 60
+# Job keys are hex digests; anything else coming from a URL is rejected before touching the disk
+KEY_RE = re.compile(r'[0-9a-f]{8,40}')
+
+
+class FileJobs:
+    """
+    Runs jobs writing one file each in background threads.
+
+    Parameters:
+    directory (str): Shared directory for job status and finished files.
+    suffix (str): File name suffix of the finished files (e.g. '.zip').
+    keep (int): Finished files kept in the directory, newest first.
+    name (str): Job kind, used in thread names and logs.
+    """
+
+    def __init__(self, directory, suffix='.zip', keep=20, name='job'):
+        self.directory = directory
+        self.suffix = suffix
+        self.keep = keep
+        self.name = name
+        self._running = set()
+        self._lock = threading.Lock()
+
+    def _path(self, key, suffix):
+        return os.path.join(self.directory, f'{key}{suffix}')
+
+    def _write_status(self, key, **status):
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(dict(status, pid=os.getpid(), updated=time.time()), f)
+        os.replace(tmp, self._path(key, '.status.json'))
+
+    def _read_status(self, key):
+        try:
+            with open(self._path(key, '.status.json')) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def status(self, key):
+        """{'state': 'running'|'done'|'failed'|'unknown', 'done': steps, 'total': steps, ...info}"""
+        if not isinstance(key, str) or not KEY_RE.fullmatch(key):
+            return {'state': 'unknown'}
+        status = self._read_status(key) or {}
+        if os.path.exists(self._path(key, self.suffix)):
+            return dict(status, state='done')
+        if not status:
+            return {'state': 'unknown'}
+        if status.get('state') == 'running' and self._stale(key, status):
+            # The worker running it died (or was recycled) without finishing
+            return dict(status, state='failed', error='the worker preparing it stopped; start it again')
+        return status
+
+    def _stale(self, key, status):
+        """A running job that no thread of this process owns and that has not progressed for STALE_S."""
+        with self._lock:
+            if key in self._running:
+                return False
+        return time.time() - status.get('updated', 0) >= STALE_S
+
+    def result_path(self, key):
+        """Path of the finished file, or None."""
+        if self.status(key)['state'] != 'done':
+            return None
+        return self._path(key, self.suffix)
+
+    def submit(self, key, run, total=None, **info):
+        """
+        Start (or join) job `key`.
+
+        Parameters:
+        run (callable): (path, progress) -> dict or None; writes the result to `path`, calls
+            progress(done, total) as it advances and may return values added to the final status.
+        total (int): Number of steps, for the status until the first progress call.
+        info: Extra JSON values kept in the status (file name, summary...).
+
+        Returns:
+        str: `key`, to poll with status() and fetch with result_path().
+        """
+        status = self.status(key)
+        if status['state'] == 'done':
+            return key
+        with self._lock:
+            if key in self._running:
+                return key
+            if status['state'] == 'running':
+                # Another worker is running it and still making progress (stale jobs report 'failed')
+                return key
+            self._running.add(key)
+        self._write_status(key, state='running', done=0, total=total, **info)
+        threading.Thread(target=self._run, args=(key, run, total, info),
+                         name=f'nespreso-{self.name}-{key}', daemon=True).start()
+        return key
+
+    def _run(self, key, run, total, info):
+        start = time.perf_counter()
+        tmp = self._path(key, f'{self.suffix}.tmp{os.getpid()}')
+        progress = {'done': 0, 'total': total}
+        finished = threading.Event()
+        # Progress, heartbeat and the final status are written one at a time, the final one last
+        write_lock = threading.Lock()
+
+        def report(done, total=None):
+            with write_lock:
+                progress.update(done=done, total=progress['total'] if total is None else total)
+                if not finished.is_set():
+                    self._write_status(key, state='running', **progress, **info)
+
+        def heartbeat():
+            # Steps can take longer than STALE_S (an upstream request, a large render)
+            while not finished.wait(STALE_S/4):
+                with write_lock:
+                    if not finished.is_set():
+                        self._write_status(key, state='running', **progress, **info)
+
+        def finish(**status):
+            with write_lock:
+                finished.set()
+                self._write_status(key, **status, **info)
+
+        threading.Thread(target=heartbeat, name=f'nespreso-{self.name}-{key}-heartbeat', daemon=True).start()
+        try:
+            outcome = run(tmp, report) or {}
+            os.replace(tmp, self._path(key, self.suffix))
+            finish(state='done', done=progress['total'] or progress['done'], total=progress['total'], **outcome)
+            logger.info("%s=%s steps=%s bytes=%d seconds=%.1f", self.name, key, progress['total'],
+                        os.path.getsize(self._path(key, self.suffix)), time.perf_counter() - start)
+            self._prune()
+        except Exception as exc:
+            logger.exception("%s %s failed", self.name.capitalize(), key)
+            finish(state='failed', error=str(exc))
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+        finally:
+            finished.set()
+            with self._lock:
+                self._running.discard(key)
+
+    def discard(self, key):
+        """Remove the finished file and status of `key`, so that submitting it again runs it again."""
+        with self._lock:
+            if key in self._running:
+                return
+        for suffix in (self.suffix, '.status.json'):
+            try:
+                os.remove(self._path(key, suffix))
+            except OSError:
+                pass
+
+    def _prune(self):
+        try:
+            results = sorted((e for e in os.scandir(self.directory) if e.name.endswith(self.suffix)),
+                             key=lambda e: e.stat().st_mtime, reverse=True)
+        except OSError:
+            return
+        for entry in results[self.keep:]:
+            for path in (entry.path, entry.path[:-len(self.suffix)] + '.status.json'):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -0,0 +1,314 @@
+"""
+Memory accounting for a worker: resident set size, the bytes held by every registered cache (per
+entry, so each open dataset and prepared day is visible), and optional periodic tracemalloc top-N
+diffs to find growth that no cache accounts for.
+
+With a budget (NESPRESO_MEMORY_BUDGET_MB, by default half of the memory available to the host or
+container, see default_budget_bytes) the worker checks its RSS after requests, at most every
+NESPRESO_MEMORY_CHECK_S seconds, and when over budget evicts least recently used entries from the
+caches, cheapest to rebuild first, then returns the freed memory to the OS. This replaces recycling
+workers with gunicorn's max_requests, which stays on when the budget is disabled.
+
+Sizes are estimates: numpy arrays (including the loaded variables of xarray datasets) and byte
+payloads are counted exactly, other objects by sys.getsizeof. Arrays shared between caches are
+counted once, in the first cache that holds them.
+"""
+import ctypes
+import gc
+import logging
+import os
+import resource
+import sys
+import threading
+import time
+import tracemalloc
+import types
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Objects below this depth of attributes/containers are not followed when sizing cache entries
+MAX_DEPTH = 8
+SKIP_TYPES = (type, types.ModuleType, types.FunctionType, types.BuiltinFunctionType, types.MethodType,
+              threading.Thread)
+
+try:
+    _libc = ctypes.CDLL('libc.so.6')
+except OSError:
+    _libc = None
+
+
+def rss_bytes():
+    """Current resident set size of this process (peak RSS where /proc is unavailable)."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1])*os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss*1024
+
+
+def release_memory():
+    """Collect garbage and hand free heap pages back to the OS (glibc), so RSS reflects evictions."""
+    gc.collect()
+    if _libc is not None:
+        try:
+            _libc.malloc_trim(0)
+        except AttributeError:
+            pass
+
+
+def _xarray_variables(obj):
+    """The variables of an xarray Dataset, DataArray or Variable, or None for other objects."""
+    if hasattr(obj, 'data_vars') and hasattr(obj, 'variables'):
+        return list(obj.variables.values())
+    if hasattr(obj, 'variable') and hasattr(obj, 'coords'):
+        return [obj.variable] + list(obj.coords.variables.values())
+    if hasattr(obj, '_in_memory') and hasattr(obj, 'dims'):
+        return [obj]
+    return None
+
+
+def deep_nbytes(obj, seen=None, depth=0):
+    """Estimated bytes reachable from `obj`, skipping objects whose id is in `seen` (updated in place)."""
+    seen = set() if seen is None else seen
+    if id(obj) in seen or depth > MAX_DEPTH or isinstance(obj, SKIP_TYPES):
+        return 0
+    seen.add(id(obj))
+    if isinstance(obj, np.ndarray):
+        if obj.base is not None and not obj.flags.owndata:
+            # A view: count the array it looks into
+            return deep_nbytes(obj.base, seen, depth + 1)
+        return obj.nbytes
+    if isinstance(obj, (bytes, bytearray, str, memoryview, int, float)):
+        return sys.getsizeof(obj)
+    variables = _xarray_variables(obj)
+    if variables is not None:
+        # Only variables already read into memory hold data; reading the others would load them
+        return sys.getsizeof(obj) + sum(deep_nbytes(v.data, seen, depth + 1)
+                                        for v in variables if getattr(v, '_in_memory', False))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(deep_nbytes(k, seen, depth + 1) + deep_nbytes(v, seen, depth + 1) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(deep_nbytes(v, seen, depth + 1) for v in obj)
+    elif hasattr(obj, '__dict__'):
+        size += deep_nbytes(vars(obj), seen, depth + 1)
+    return size
+
+
+class MemoryAccountant:
+    """
+    Per-worker memory accounting and budget enforcement over registered caches.
+
+    Parameters:
+    budget_bytes (int): RSS above which caches are evicted (0 disables enforcement).
+    check_interval (float): Minimum seconds between RSS checks.
+    trace_interval (float): Seconds between tracemalloc snapshots (0 disables tracing).
+    trace_top (int): Number of allocation sites kept per tracemalloc diff.
+    """
+
+    def __init__(self, budget_bytes=0, check_interval=5.0, trace_interval=0.0, trace_top=15):
+        self.budget_bytes = budget_bytes
+        self.check_interval = check_interval
+        self.trace_interval = trace_interval
+        self.trace_top = trace_top
+        self._caches = []
+        self._lock = threading.Lock()
+        self._last_check = 0.0
+        self.last_enforcement = None
+        self.trace_diffs = []
+        self._trace_thread = None
+        self._trace_pid = None
+
+    def register(self, name, cache, keep=0, pinned=None):
+        """
+        Account `cache` (a BuildCache, RasterCache, FigureCache or PyramidCache) as `name`.
+        Register in eviction order, cheapest to rebuild first; the `keep` most recently used entries
+        and the keys returned by `pinned` (a callable, BuildCache only) are never evicted.
+        """
+        self._caches.append((name, cache, keep, pinned))
+
+    # Accounting
+    def cache_report(self, entries=False):
+        """Bytes and entry counts of every registered cache; with `entries`, the size of each entry."""
+        seen = set()
+        report = {}
+        for name, cache, _, _ in self._caches:
+            items = cache.items()
+            sizes = [(key, deep_nbytes(value, seen)) for key, value in items]
+            report[name] = {'entries': len(items), 'bytes': sum(size for _, size in sizes)}
+            if entries:
+                report[name]['items'] = [{'key': str(key), 'bytes': size} for key, size in reversed(sizes)]
+        return report
+
+    def report(self):
+        rss = rss_bytes()
+        caches = self.cache_report(entries=True)
+        accounted = sum(c['bytes'] for c in caches.values())
+        return {
+            'pid': os.getpid(),
+            'rss_bytes': rss,
+            'budget_bytes': self.budget_bytes,
+            'accounted_bytes': accounted,
+            'unaccounted_bytes': max(rss - accounted, 0),
+            'caches': caches,
+            'gc_counts': gc.get_count(),
+            'gc_objects': len(gc.get_objects()),
+            'last_enforcement': self.last_enforcement,
+            'tracemalloc': {'interval_s': self.trace_interval, 'tracing': tracemalloc.is_tracing(),
+                            'diffs': self.trace_diffs},
+        }
+
+    # Budget
+    def maybe_enforce(self):
+        """Check RSS against the budget (throttled) and evict if over. Called after every request."""
+        if self.budget_bytes <= 0:
+            return None
+        now = time.monotonic()
+        if now - self._last_check < self.check_interval or not self._lock.acquire(blocking=False):
+            return None
+        try:
+            self._last_check = now
+            rss = rss_bytes()
+            if rss <= self.budget_bytes:
+                return None
+            return self.enforce(rss)
+        finally:
+            self._lock.release()
+
+    def enforce(self, rss=None):
+        """Evict least recently used cache entries until the estimated freed bytes cover the excess RSS."""
+        rss = rss_bytes() if rss is None else rss
+        excess = rss - self.budget_bytes
+        freed, evicted = 0, {}
+        seen = set()
+        for name, cache, keep, pinned in self._caches:
+            if freed >= excess:
+                break
+            pinned_keys = set(pinned()) if pinned is not None else set()
+            # Oldest first; estimated before evicting since entries can share arrays
+            for key, value in cache.items()[:max(len(cache) - keep, 0)]:
+                if freed >= excess:
+                    break
+                if key in pinned_keys:
+                    continue
+                size = deep_nbytes(value, seen)
+                if (cache.evict(key) if pinned_keys else cache.evict_oldest()) is None:
+                    break
+                freed += size
+                evicted[name] = evicted.get(name, 0) + 1
+        release_memory()
+        after = rss_bytes()
+        self.last_enforcement = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rss_before': rss, 'rss_after': after,
+                                 'estimated_freed': freed, 'evicted': evicted}
+        logger.warning("memory budget exceeded rss_mb=%.0f budget_mb=%.0f evicted=%s rss_after_mb=%.0f",
+                       rss/2**20, self.budget_bytes/2**20, evicted, after/2**20)
+        return self.last_enforcement
+
+    # tracemalloc diffs
+    def ensure_tracing(self):
+        """Start the tracemalloc sampling thread in this process (threads do not survive gunicorn's fork)."""
+        if self.trace_interval <= 0 or self._trace_pid == os.getpid():
+            return
+        self._trace_pid = os.getpid()
+        self.trace_diffs = []
+        self._trace_thread = threading.Thread(target=self._trace_loop, name='nespreso-tracemalloc', daemon=True)
+        self._trace_thread.start()
+
+    def _trace_loop(self):
+        previous = None
+        while True:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(10)
+                previous = None
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap*>'),
+            ))
+            if previous is not None:
+                self.record_diff(snapshot.compare_to(previous, 'lineno'))
+            previous = snapshot
+            time.sleep(self.trace_interval)
+
+    def record_diff(self, stats):
+        top = [{'site': str(stat.traceback), 'size_diff': stat.size_diff, 'size': stat.size,
+                'count_diff': stat.count_diff} for stat in stats[:self.trace_top]]
+        self.trace_diffs = (self.trace_diffs + [{'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'rss_bytes': rss_bytes(),
+                                                 'top': top}])[-10:]
+        for stat in stats[:5]:
+            logger.info("tracemalloc size_diff_kb=%.1f size_kb=%.1f site=%s",
+                        stat.size_diff/1024, stat.size/1024, stat.traceback)
+
+
+def install_memory(server, accountant, check_token, prefix='/nespreso_viz'):
+    """
+    Enforce the memory budget after requests of `server` (a Flask app) and serve the accounting at
+    /admin/memory and {prefix}/admin/memory for requests carrying the admin token.
+
+    Parameters:
+    check_token (callable): Validates the admin token (Profiler.check_token).
+    """
+    from flask import abort, jsonify, request
+
+    from viz_utils.profiling import request_admin_token
+
+    @server.before_request
+    def _memory_tracing():
+        accountant.ensure_tracing()
+
+    @server.after_request
+    def _memory_budget(response):
+        accountant.maybe_enforce()
+        return response
+
+    def memory_report():
+        if not check_token(request_admin_token()):
+            abort(404)
+        if request.args.get('release'):
+            release_memory()
+        return jsonify(accountant.report())
+
+    server.add_url_rule('/admin/memory', 'memory_report', memory_report)
+    server.add_url_rule(f'{prefix}/admin/memory', 'memory_report_prefixed', memory_report)
+
+
+def default_budget_bytes(share=0.5):
+    """
+    Share of the memory available to this process: physical memory, capped by the cgroup (v2 or v1)
+    limit of a container. Sized for the single gunicorn worker; set NESPRESO_MEMORY_BUDGET_MB per
+    worker when running several.
+
+    Returns:
+    int: Budget in bytes, 0 when the available memory cannot be determined.
+    """
+    try:
+        available = os.sysconf('SC_PAGE_SIZE')*os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 0
+    for path in ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory/memory.limit_in_bytes'):
+        try:
+            with open(path) as f:
+                limit = f.read().strip()
+        except OSError:
+            continue
+        if limit.isdigit():
+            available = min(available, int(limit))
+        break
+    return int(available*share)
+
+
+def memory_budget_bytes():
+    """NESPRESO_MEMORY_BUDGET_MB in bytes (0 disables the budget), or default_budget_bytes() when unset."""
+    value = os.environ.get('NESPRESO_MEMORY_BUDGET_MB', '')
+    if not value:
+        return default_budget_bytes()
+    return int(float(value)*2**20)
+
+
+memory = MemoryAccountant(
+    budget_bytes=memory_budget_bytes(),
+    check_interval=float(os.environ.get('NESPRESO_MEMORY_CHECK_S', '5')),
+    trace_interval=float(os.environ.get('NESPRESO_TRACEMALLOC_INTERVAL_S', '0')),
+    trace_top=int(os.environ.get('NESPRESO_TRACEMALLOC_TOP', '15')),
+)
@@ -0,0 +1,349 @@
+"""
+Process metrics for the dashboard, exposed in the Prometheus text format.
+
+Every worker keeps its counters and histograms in memory: request latency, response bytes and status
+per Dash callback and route, time spent inside the figure callbacks and dataset load time. Cache
+hits/misses/evictions and sizes are read from the registered caches when a snapshot is taken.
+
+Snapshots are written to a directory shared by the gunicorn workers (by default in /dev/shm) at most
+every NESPRESO_METRICS_FLUSH_S seconds, and the /metrics route merges them, so whichever worker
+answers reports all of them. Counters of workers that exited are folded into a retired snapshot, so
+totals never go backwards when gunicorn recycles a worker.
+"""
+import atexit
+import fcntl
+import glob
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import defaultdict
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+BYTES_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7, 3e7, 1e8)
+
+# name: (type, buckets, help)
+METRICS = {
+    'nespreso_requests_total': ('counter', None, 'Requests by endpoint (Dash callback outputs or route) and status.'),
+    'nespreso_request_seconds': ('histogram', LATENCY_BUCKETS, 'Request latency by endpoint, including serialisation and compression.'),
+    'nespreso_response_bytes': ('histogram', BYTES_BUCKETS, 'Response bytes on the wire by endpoint.'),
+    'nespreso_callback_compute_seconds': ('histogram', LATENCY_BUCKETS, 'Time spent inside figure callbacks.'),
+    'nespreso_dataset_load_seconds': ('histogram', LATENCY_BUCKETS, 'Time to open a daily grid or prepare its figure objects.'),
+    'nespreso_cache_hits_total': ('counter', None, 'Cache hits.'),
+    'nespreso_cache_disk_hits_total': ('counter', None, 'Hits served from the shared disk tier of a cache.'),
+    'nespreso_cache_misses_total': ('counter', None, 'Cache misses.'),
+    'nespreso_cache_evictions_total': ('counter', None, 'Entries evicted from a cache.'),
+    'nespreso_cache_entries': ('gauge', None, 'Entries held by a cache, summed over workers.'),
+    'nespreso_cache_bytes': ('gauge', None, 'Bytes held by a cache, summed over workers.'),
+    'nespreso_workers': ('gauge', None, 'Worker processes reporting metrics.'),
+}
+# Cache statistics read from the cache objects, and the metric each one feeds
+CACHE_COUNTERS = {
+    'hits': 'nespreso_cache_hits_total',
+    'disk_hits': 'nespreso_cache_disk_hits_total',
+    'misses': 'nespreso_cache_misses_total',
+    'evictions': 'nespreso_cache_evictions_total',
+}
+
+
+def label_key(labels):
+    """Prometheus label set ({'a': 'x'}) as its rendered, escaped form ('a="x"'), used as a dict key."""
+    if not labels:
+        return ''
+    parts = []
+    for name in sorted(labels):
+        value = str(labels[name]).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        parts.append(f'{name}="{value}"')
+    return ','.join(parts)
+
+
+def cache_stats(cache):
+    """hits/misses/evictions/entries/bytes of a BuildCache, RasterCache, FigureCache or functools.lru_cache."""
+    if hasattr(cache, 'cache_info'):
+        info = cache.cache_info()
+        return {'hits': info.hits, 'misses': info.misses, 'entries': info.currsize}
+    stats = {key: getattr(cache, key) for key in CACHE_COUNTERS if hasattr(cache, key)}
+    try:
+        stats['entries'] = len(cache)
+    except TypeError:
+        pass
+    if hasattr(cache, 'nbytes'):
+        stats['bytes'] = cache.nbytes()
+    return stats
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def merge_snapshots(snapshots):
+    """Sum counters, histograms and gauges of several snapshots."""
+    merged = {'counters': defaultdict(lambda: defaultdict(float)),
+              'histograms': defaultdict(dict),
+              'gauges': defaultdict(lambda: defaultdict(float))}
+    for snap in snapshots:
+        for kind in ('counters', 'gauges'):
+            for name, series in snap.get(kind, {}).items():
+                for key, value in series.items():
+                    merged[kind][name][key] += value
+        for name, series in snap.get('histograms', {}).items():
+            for key, values in series.items():
+                current = merged['histograms'][name].get(key)
+                merged['histograms'][name][key] = list(values) if current is None else [a + b for a, b in zip(current, values)]
+    return merged
+
+
+class Metrics:
+    """
+    Counters and histograms of one process, plus the registered caches.
+
+    Parameters:
+    directory (str): Shared snapshot directory (None keeps metrics per process).
+    flush_interval (float): Minimum seconds between snapshot writes.
+    """
+
+    def __init__(self, directory=None, flush_interval=10.0):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.caches = {}
+        self._lock = threading.Lock()
+        self._reset()
+        if directory:
+            try:
+                os.makedirs(directory, exist_ok=True)
+            except OSError:
+                self.directory = None
+        if hasattr(os, 'register_at_fork'):
+            # With preload_app the master imports the app (and warms the default day) before forking:
+            # it writes its own snapshot and every worker starts from zero. The master never serves, so its
+            # snapshot leaves out the gauges: the workers report the caches they inherited, and the workers gauge
+            # counts workers only
+            os.register_at_fork(before=lambda: self.flush(force=True, gauges=False), after_in_child=self._after_fork)
+        atexit.register(lambda: self.flush(force=True))
+
+    def _reset(self):
+        self.counters = defaultdict(lambda: defaultdict(float))
+        self.histograms = defaultdict(dict)
+        self._cache_baseline = {}
+        self._last_flush = 0.0
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._reset()
+        self._cache_baseline = {name: cache_stats(cache) for name, cache in self.caches.items()}
+
+    def register_cache(self, name, cache):
+        self.caches[name] = cache
+
+    def inc(self, name, labels=None, value=1):
+        with self._lock:
+            self.counters[name][label_key(labels)] += value
+
+    def observe(self, name, value, labels=None):
+        buckets = METRICS[name][1]
+        key = label_key(labels)
+        with self._lock:
+            series = self.histograms[name].get(key)
+            if series is None:
+                # One count per bucket, then +Inf, sum and count
+                series = self.histograms[name][key] = [0]*(len(buckets) + 1) + [0.0, 0]
+            for i, bound in enumerate(buckets):
+                if value <= bound:
+                    series[i] += 1
+                    break
+            else:
+                series[len(buckets)] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def snapshot(self, gauges=True):
+        """This process's metrics as plain data, cache statistics included (their gauges only if `gauges`)."""
+        counters = defaultdict(dict)
+        with_gauges, gauges = gauges, defaultdict(dict)
+        for name, cache in list(self.caches.items()):
+            try:
+                stats = cache_stats(cache)
+            except Exception:
+                continue
+            base = self._cache_baseline.get(name, {})
+            key = label_key({'cache': name})
+            for stat, metric in CACHE_COUNTERS.items():
+                if stat in stats:
+                    counters[metric][key] = max(stats[stat] - base.get(stat, 0), 0)
+            if not with_gauges:
+                continue
+            if 'entries' in stats:
+                gauges['nespreso_cache_entries'][key] = stats['entries']
+            if 'bytes' in stats:
+                gauges['nespreso_cache_bytes'][key] = stats['bytes']
+        with self._lock:
+            for name, series in self.counters.items():
+                counters[name].update(series)
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self.histograms.items()}
+        if with_gauges:
+            gauges['nespreso_workers'][''] = 1
+        return {'pid': os.getpid(), 'time': time.time(), 'counters': counters, 'gauges': gauges, 'histograms': histograms}
+
+    def _path(self, pid):
+        return os.path.join(self.directory, f'worker_{pid}.json')
+
+    def flush(self, force=False, gauges=True):
+        """Write this process's snapshot to the shared directory (rate limited unless forced)."""
+        now = time.time()
+        if not self.directory or (not force and now - self._last_flush < self.flush_interval):
+            return
+        if not (self.counters or self.histograms or self.caches):
+            # Nothing recorded (e.g. a tool process that only imports the figure code)
+            return
+        self._last_flush = now
+        path = self._path(os.getpid())
+        tmp = f'{path}.tmp{threading.get_ident()}'
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(self.snapshot(gauges), f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def _retire_dead_workers(self):
+        """Fold the counters and histograms of exited workers into retired.json (their gauges are dropped)."""
+        retired_path = os.path.join(self.directory, 'retired.json')
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            dead = []
+            for path in glob.glob(os.path.join(self.directory, 'worker_*.json')):
+                try:
+                    pid = int(os.path.basename(path)[len('worker_'):-len('.json')])
+                except ValueError:
+                    continue
+                if not _pid_alive(pid):
+                    dead.append(path)
+            if not dead:
+                return
+            snapshots = [s for s in (self._read(p) for p in [retired_path] + dead) if s]
+            merged = merge_snapshots(snapshots)
+            retired = {'counters': merged['counters'], 'histograms': merged['histograms'], 'gauges': {}}
+            with open(retired_path + '.tmp', 'w') as f:
+                json.dump(retired, f)
+            os.replace(retired_path + '.tmp', retired_path)
+            for path in dead:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def collect(self):
+        """Metrics of all workers (live and retired), with this process's current values."""
+        if not self.directory:
+            return merge_snapshots([self.snapshot()])
+        self.flush(force=True)
+        try:
+            self._retire_dead_workers()
+        except OSError:
+            pass
+        paths = glob.glob(os.path.join(self.directory, 'worker_*.json')) + [os.path.join(self.directory, 'retired.json')]
+        own = self._path(os.getpid())
+        snapshots = [self.snapshot()] + [s for s in (self._read(p) for p in paths if p != own) if s]
+        return merge_snapshots(snapshots)
+
+    def render(self):
+        """Prometheus text exposition of collect()."""
+        merged = self.collect()
+        lines = []
+        for name, (kind, buckets, help_text) in METRICS.items():
+            source = {'counter': 'counters', 'gauge': 'gauges', 'histogram': 'histograms'}[kind]
+            series = merged[source].get(name)
+            if not series:
+                continue
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for key, value in sorted(series.items()):
+                if kind != 'histogram':
+                    lines.append(f'{name}{{{key}}} {value:g}' if key else f'{name} {value:g}')
+                    continue
+                prefix = f'{key},' if key else ''
+                cumulative = 0
+                for bound, count in zip(list(buckets) + ['+Inf'], value[:-2]):
+                    cumulative += count
+                    le = bound if bound == '+Inf' else f'{bound:g}'
+                    lines.append(f'{name}_bucket{{{prefix}le="{le}"}} {cumulative:g}')
+                labels = f'{{{key}}}' if key else ''
+                lines.append(f'{name}_sum{labels} {value[-2]:.6g}')
+                lines.append(f'{name}_count{labels} {value[-1]:g}')
+        return '\n'.join(lines) + '\n'
+
+
+def callback_label(output):
+    """Endpoint label of a Dash callback from its output spec: component ids joined with '+'."""
+    parts = output[2:-2].split('...') if output.startswith('..') else [output]
+    ids = []
+    for part in parts:
+        component_id = part.split('@')[0].rsplit('.', 1)[0]
+        if component_id not in ids:
+            ids.append(component_id)
+    return '+'.join(ids)
+
+
+def install_metrics(server, metrics, prefix='/nespreso_viz'):
+    """
+    Record latency, bytes and status of every request of `server` (a Flask app) and serve
+    /metrics and {prefix}/metrics. Register before compression so the bytes are those on the wire.
+    """
+    from flask import Response, g, request
+
+    @server.before_request
+    def _metrics_start():
+        g.metrics_start = time.perf_counter()
+
+    @server.after_request
+    def _metrics_record(response):
+        start = g.get('metrics_start')
+        if start is None:
+            return response
+        if request.path.endswith('/_dash-update-component'):
+            body = request.get_json(silent=True) or {}
+            endpoint = callback_label(body.get('output', 'unknown'))
+        elif request.url_rule is not None:
+            endpoint = request.url_rule.rule
+            if endpoint.startswith(prefix + '/'):
+                endpoint = endpoint[len(prefix):]
+        else:
+            endpoint = 'unmatched'
+        labels = {'endpoint': endpoint}
+        metrics.observe('nespreso_request_seconds', time.perf_counter() - start, labels)
+        metrics.observe('nespreso_response_bytes', response.content_length or 0, labels)
+        metrics.inc('nespreso_requests_total', dict(labels, status=response.status_code))
+        metrics.flush()
+        return response
+
+    def serve_metrics():
+        return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+    server.add_url_rule('/metrics', 'metrics', serve_metrics)
+    server.add_url_rule(f'{prefix}/metrics', 'metrics_prefixed', serve_metrics)
+
+
+def default_metrics_dir():
+    base = '/dev/shm' if os.path.isdir('/dev/shm') else tempfile.gettempdir()
+    return os.path.join(base, 'nespreso_metrics')
+
+
+metrics = Metrics(
+    directory=os.environ.get('NESPRESO_METRICS_DIR', default_metrics_dir()) or None,
+    flush_interval=float(os.environ.get('NESPRESO_METRICS_FLUSH_S', '10')),
+)
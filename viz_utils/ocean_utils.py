@@ -4,221 +4,211 @@ import numpy as np
 def get_density(S, T, p):
     """
     Calculate the density of seawater using the Gibbs-SeaWater (GSW) toolbox.
-    
+
     Arguments:
     S -- Absolute Salinity, g/kg
     T -- Conservative Temperature (ITS-90), degrees C
     p -- Sea pressure (absolute pressure minus 10.1325 dbar), dbar
-    
+
     Returns:
     rho -- in-situ density kg/m
     """
-    
+
     return gsw.density.rho(S, T, p)
 
 def get_mld(salinity, temperature, pressure, temp_threshold=0.2, density_threshold=0.125):
     """
     Calculate the mixed layer depth (MLD) using two criteria: temperature and density.
-    
-    Arguments:
-    salinity -- Absolute Salinity, g/kg (4D array: time, lat, lon, depth)
-    temperature -- Conservative Temperature (ITS-90), degrees C (4D array: time, lat, lon, depth)
-    pressure -- Sea pressure (absolute pressure minus 10.1325 dbar), dbar (4D array: time, lat, lon, depth)
-    temp_threshold -- Temperature threshold for the temperature criterion, degrees C
-    density_threshold -- Density threshold for the density criterion, kg/m^3
-    
-    Returns:
-    mld_temp_criteria -- MLD calculated using the temperature criterion, dbar (3D array: time, lat, lon)
-    mld_density_criteria -- MLD calculated using the density criterion, dbar (3D array: time, lat, lon)
-    """
-    
-import numpy as np
-
-def get_density(temperature, salinity, pressure):
-    # Placeholder function for calculating density.
-    # Replace with the actual function for calculating density.
-    return 1027 + 0.2 * (temperature - 15) + 0.8 * (salinity - 35) + 0.05 * pressure
 
-def get_mld(salinity, temperature, pressure, temp_threshold=0.2, density_threshold=0.125):
-    """
-    Calculate the mixed layer depth (MLD) using two criteria: temperature and density.
-    
     Arguments:
     salinity -- Absolute Salinity, g/kg (4D array: time, lat, lon, depth)
     temperature -- Conservative Temperature (ITS-90), degrees C (4D array: time, lat, lon, depth)
     pressure -- Sea pressure (absolute pressure minus 10.1325 dbar), dbar (4D array: time, lat, lon, depth)
     temp_threshold -- Temperature threshold for the temperature criterion, degrees C
     density_threshold -- Density threshold for the density criterion, kg/m^3
-    
+
     Returns:
     mld_temp_criteria -- MLD calculated using the temperature criterion, dbar (3D array: time, lat, lon)
     mld_density_criteria -- MLD calculated using the density criterion, dbar (3D array: time, lat, lon)
     """
-    
-    density = get_density(temperature, salinity, pressure)
-    surface_temperature = temperature[:, :, :, 0]
-    surface_density = density[:, :, :, 0]
-
-    temp_diff = np.abs(temperature - surface_temperature)
-    mask_temp = temp_diff <= temp_threshold
-    last_index_temp = mask_temp[..., ::-1].argmax(axis=-1)  # Find last True index from bottom
-    mld_temp_criteria = pressure.shape[-1] - 1 - last_index_temp
-    
-    density_diff = np.abs(density - surface_density)
-    mask_density = density_diff <= density_threshold
-    last_index_density = mask_density[..., ::-1].argmax(axis=-1)  # Find last True index from bottom
-    mld_density_criteria = pressure.shape[-1] - 1 - last_index_density
-
-    # Initialize the result arrays with NaNs
-    mld_temp_result = np.full(surface_temperature.shape, np.nan)
-    mld_density_result = np.full(surface_density.shape, np.nan)
-
-    # Create boolean masks for valid indices
-    valid_temp_mask = last_index_temp != -1
-    valid_density_mask = last_index_density != -1
-
-    # Flatten the arrays
-    valid_temp_mask_flat = valid_temp_mask.values.flatten()
-    valid_density_mask_flat = valid_density_mask.values.flatten()
-
-# Initialize result arrays with NaNs
-    mld_temp_result = np.full(surface_temperature.shape, np.nan)
-    mld_density_result = np.full(surface_density.shape, np.nan)
-
-    # Create a meshgrid for indexing
-    time_indices, lat_indices, lon_indices = np.meshgrid(
-        np.arange(temperature.shape[0]),
-        np.arange(temperature.shape[1]),
-        np.arange(temperature.shape[2]),
-        indexing='ij'
-    )
-    # Flatten the indices for advanced indexing
-    time_indices_flat = time_indices.flatten()
-    lat_indices_flat = lat_indices.flatten()
-    lon_indices_flat = lon_indices.flatten()
-    mld_temp_criteria_flat = mld_temp_criteria.values.flatten()
-    mld_density_criteria_flat = mld_density_criteria.values.flatten()
-
-    # Initialize result arrays with NaNs
-    mld_temp_result = np.full(surface_temperature.shape, np.nan)
-    mld_density_result = np.full(surface_density.shape, np.nan)
-
-    # Use advanced indexing to assign values to result arrays
-    mld_temp_result_flat = mld_temp_result.flatten()
-    mld_density_result_flat = mld_density_result.flatten()
-
-    # Assign the values using flattened indices and boolean masks
-    mld_temp_result_flat[valid_temp_mask_flat] = pressure[
-        time_indices_flat[valid_temp_mask_flat], 
-        lat_indices_flat[valid_temp_mask_flat], 
-        lon_indices_flat[valid_temp_mask_flat], 
-        mld_temp_criteria_flat[valid_temp_mask_flat]
-    ]
-
-    mld_density_result_flat[valid_density_mask_flat] = pressure[
-        time_indices_flat[valid_density_mask_flat], 
-        lat_indices_flat[valid_density_mask_flat], 
-        lon_indices_flat[valid_density_mask_flat], 
-        mld_density_criteria_flat[valid_density_mask_flat]
-    ]
-
-    # Reshape the result arrays back to the original shape
-    mld_temp_result = mld_temp_result_flat.reshape(surface_temperature.shape)
-    mld_density_result = mld_density_result_flat.reshape(surface_density.shape)
+    salinity = np.asarray(salinity)
+    temperature = np.asarray(temperature)
+    pressure = np.asarray(pressure)
+    density = get_density(salinity, temperature, pressure)
+
+    def last_within(diff, threshold):
+        # Pressure at the deepest level still within the threshold of the surface value
+        within = np.abs(diff) <= threshold
+        n = within.shape[-1]
+        last = n - 1 - within[..., ::-1].argmax(axis=-1)
+        result = np.take_along_axis(pressure, last[..., np.newaxis], axis=-1)[..., 0]
+        return np.where(within.any(axis=-1), result, np.nan)
+
+    mld_temp_result = last_within(temperature - temperature[..., :1], temp_threshold)
+    mld_density_result = last_within(density - density[..., :1], density_threshold)
     return mld_temp_result, mld_density_result
 
 def get_ohc(salinity, temperature, pressure, temp_limit=26):
     """
     Calculate the ocean heat content (OHC) above a given temperature limit.
-    
+
     Arguments:
-    salinity -- Absolute Salinity, g/kg
-    temperature -- Conservative Temperature (ITS-90), degrees C
-    pressure -- Sea pressure (absolute pressure minus 10.1325 dbar), dbar
+    salinity -- Absolute Salinity, g/kg (2D array: depth, profile)
+    temperature -- Conservative Temperature (ITS-90), degrees C (2D array: depth, profile)
+    pressure -- Sea pressure (absolute pressure minus 10.1325 dbar), dbar (2D array: depth, profile)
     temp_limit -- Temperature limit, degrees C
-    
+
     Returns:
     ohc -- Ocean heat content above the temperature limit, J/m^2
     """
-    
-    specific_heat_capacity = 3992  # J/(kg*K) for seawater
-    density = get_density(temperature, salinity, pressure)
-    mask = temperature >= temp_limit
-
-    ohc = np.zeros(temperature.shape[1])  # Initialize OHC array for each profile
 
-    for i in range(temperature.shape[1]):
-        temp_above_limit = temperature[:, i][mask[:, i]]
-        pressure_above_limit = pressure[:, i][mask[:, i]]
-        density_above_limit = density[:, i][mask[:, i]]
-
-        if len(temp_above_limit) > 0:
-            ohc[i] = np.trapz((temp_above_limit - temp_limit) * specific_heat_capacity * density_above_limit, pressure_above_limit)
-
-    return ohc
+    specific_heat_capacity = 3992  # J/(kg*K) for seawater
+    salinity = np.asarray(salinity, dtype=float)
+    temperature = np.asarray(temperature, dtype=float)
+    pressure = np.asarray(pressure, dtype=float)
+    density = get_density(salinity, temperature, pressure)
+    # Only levels warmer than the limit contribute; trapezoids between two such levels
+    excess = np.where(temperature >= temp_limit, (temperature - temp_limit)*specific_heat_capacity*density, np.nan)
+    segment = 0.5*(excess[1:] + excess[:-1])*np.diff(pressure, axis=0)
+    return np.nansum(segment, axis=0)
 
 def get_isotherm_pressure(temperature, pressure, isotherm_temp=26):
     """
     Calculate the pressure at which the temperature exceeds a given isotherm temperature.
-    
+
     Arguments:
-    temperature -- Conservative Temperature (ITS-90), degrees C
-    pressure -- Sea pressure (absolute pressure minus 10.1325 dbar), dbar
+    temperature -- Conservative Temperature (ITS-90), degrees C (2D array: depth, profile)
+    pressure -- Sea pressure (absolute pressure minus 10.1325 dbar), dbar (2D array: depth, profile)
     isotherm_temp -- Isotherm temperature, degrees C
-    
+
     Returns:
     isotherm_pressure -- Pressure at which the temperature exceeds the isotherm temperature, dbar
     """
-    
-    # Find the indices where temperature exceeds the isotherm temperature
-    mask = temperature >= isotherm_temp
-    # Initialize an array to hold the isotherm pressure for each profile
-    isotherm_pressure = np.full(temperature.shape[1], np.nan)
 
-    # Iterate over each profile
-    for i in range(temperature.shape[1]):
-        # Get the indices in the current profile where the temperature is above the isotherm temperature
-        idx = np.where(mask[:, i])[0]
-        if len(idx) > 0:
-            # Get the last index where the condition is met
-            isotherm_pressure[i] = pressure[idx[-1], i]
-
-    return isotherm_pressure
+    temperature = np.asarray(temperature)
+    pressure = np.broadcast_to(np.asarray(pressure), temperature.shape)
+    mask = temperature >= isotherm_temp
+    # Deepest level per profile where the condition is met
+    last = mask.shape[0] - 1 - mask[::-1].argmax(axis=0)
+    isotherm_pressure = np.take_along_axis(pressure, last[np.newaxis, ...], axis=0)[0].astype(float)
+    return np.where(mask.any(axis=0), isotherm_pressure, np.nan)
 
 def calculate_ocean_pressure(temperatures, salinities, depths, atmospheric_pressure=101325):
     """
     Calculate the pressure at various depths in the ocean given temperature and salinity arrays.
-    
+
     Parameters:
     temperatures (array): Array of temperatures in degrees Celsius.
     salinities (array): Array of salinities in Practical Salinity Units (PSU).
     depths (array): Array of depths in meters.
     atmospheric_pressure (float): Atmospheric pressure at sea level in Pa (default is 101325 Pa).
-    
+
     Returns:
     array: Array of pressures at the given depths in Pascals.
     """
     # Convert depths from meters to decibars (1 dbar = 1 meter approximately)
     pressures_dbar = gsw.p_from_z(-np.array(depths), np.zeros_like(depths))
-    
+
     # Calculate in-situ density using the TEOS-10 equation of state
     densities = gsw.rho(salinities, temperatures, pressures_dbar)
-    
+
     # Calculate hydrostatic pressure at each depth
     hydrostatic_pressures = densities * 9.81 * np.array(depths)
-    
+
     # Total pressure is the sum of atmospheric pressure and hydrostatic pressure
     total_pressures = atmospheric_pressure + hydrostatic_pressures
-    
+
     return total_pressures
 
-# Example usage
-# temperatures = np.array([10, 12, 14, 16, 18])  # temperatures in degrees Celsius
-# salinities = np.array([35, 35, 35, 35, 35])  # salinities in PSU
-# depths = np.array([0, 10, 50, 100, 200])  # depths in meters
+# ------------------------------ Derived map products ------------------------------
+# Products computed by derived_fields, in the order they are returned
+DERIVED_PRODUCTS = ('MLD', 'D26', 'D20', 'TCHP')
+
+def _first_crossing_depth(values, depths, threshold, valid_from=0):
+    """
+    Depth where `values` first exceeds `threshold` going down each column, linearly
+    interpolated between levels. NaN where the column never crosses.
 
-# pressures = calculate_ocean_pressure(temperatures, salinities, depths)
-# pressures_in_atm = pressures / 101325  # converting pressures to atmospheres
+    values -- (depth, lat, lon) array; depths -- (depth,) array
+    """
+    above = values > threshold
+    if valid_from:
+        above[:valid_from] = False
+    crossed = above.any(axis=0)
+    k = np.maximum(above.argmax(axis=0), 1)
+    v0 = np.take_along_axis(values, (k - 1)[np.newaxis], axis=0)[0]
+    v1 = np.take_along_axis(values, k[np.newaxis], axis=0)[0]
+    d0 = depths[k - 1]
+    d1 = depths[k]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = np.clip((threshold - v0)/(v1 - v0), 0.0, 1.0)
+    frac = np.where(np.isfinite(frac), frac, 1.0)
+    return np.where(crossed, d0 + frac*(d1 - d0), np.nan)
+
+def derived_fields(temperature, salinity, depths, lats, lons, max_depth=500.0, chunk_rows=None,
+                   max_chunk_bytes=64_000_000, mld_threshold=0.03, mld_ref_depth=10.0):
+    """
+    Compute 2D derived products from a (depth, lat, lon) T/S cube with TEOS-10.
 
-# for depth, pressure, pressure_atm in zip(depths, pressures, pressures_in_atm):
-#     print(f"Pressure at {depth} meters: {pressure:.2f} Pascals ({pressure_atm:.2f} atm)")
+    The cube is processed in blocks of latitude rows so memory stays bounded; inputs may be numpy
+    arrays or lazily loaded xarray DataArrays (only one block is read at a time).
+
+    Arguments:
+    temperature -- in-situ temperature, degrees C (depth, lat, lon)
+    salinity -- Practical Salinity, PSU (depth, lat, lon)
+    depths -- depth levels, m (positive down)
+    max_depth -- deepest level used, m; the products only need the upper ocean
+    mld_threshold -- potential density increase (kg/m^3) over the reference depth defining the MLD
+    mld_ref_depth -- reference depth for the MLD criterion, m
+
+    Returns:
+    dict -- 'MLD' (m), 'D26' and 'D20' (m, isotherm depths) and 'TCHP' (kJ/cm^2), each (lat, lon)
+    """
+    depths = np.asarray(depths, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    lons = np.asarray(lons, dtype=float)
+    nd = int(np.searchsorted(depths, max_depth, side='right'))
+    nd = max(min(nd, depths.size), 2)
+    depths = depths[:nd]
+    ny, nx = lats.size, lons.size
+    if chunk_rows is None:
+        # ~10 float64 temporaries of the block are alive at once inside the TEOS-10 calls
+        chunk_rows = max(1, int(max_chunk_bytes // (nd*nx*8*10)))
+
+    out = {name: np.full((ny, nx), np.nan, dtype=np.float32) for name in DERIVED_PRODUCTS}
+    ref_idx = int(np.argmin(np.abs(depths - mld_ref_depth)))
+    dz = np.diff(depths)[:, np.newaxis, np.newaxis]
+
+    for r0 in range(0, ny, chunk_rows):
+        r1 = min(r0 + chunk_rows, ny)
+        t = np.asarray(temperature[:nd, r0:r1, :], dtype=float)
+        sp = np.asarray(salinity[:nd, r0:r1, :], dtype=float)
+        lat = lats[np.newaxis, r0:r1, np.newaxis]
+        lon = lons[np.newaxis, np.newaxis, :]
+        p = gsw.p_from_z(-depths[:, np.newaxis, np.newaxis], lat)
+        sa = gsw.SA_from_SP(sp, p, lon, lat)
+        ct = gsw.CT_from_t(sa, t, p)
+        ocean = np.isfinite(t[0])
+
+        # Mixed layer depth: density threshold relative to the reference depth
+        sigma0 = gsw.sigma0(sa, ct)
+        delta = sigma0 - sigma0[ref_idx]
+        mld = _first_crossing_depth(np.nan_to_num(delta, nan=-np.inf), depths, mld_threshold, valid_from=ref_idx + 1)
+        # Columns that stay mixed down to the last valid level: MLD is that level
+        deepest = depths[np.clip(np.isfinite(t).sum(axis=0) - 1, 0, nd - 1)]
+        out['MLD'][r0:r1] = np.where(ocean, np.where(np.isnan(mld), deepest, mld), np.nan)
+
+        # Isotherm depths: first level colder than the isotherm
+        cold = np.nan_to_num(-t, nan=np.inf)
+        for name, isotherm in (('D26', 26.0), ('D20', 20.0)):
+            depth_iso = _first_crossing_depth(cold, depths, -isotherm)
+            out[name][r0:r1] = np.where(ocean & (t[0] >= isotherm), depth_iso, np.nan)
+
+        # Tropical cyclone heat potential: integral of rho*cp*(T-26) over the layer warmer than 26 C
+        rho = gsw.rho(sa, ct, p)
+        cp = gsw.cp_t_exact(sa, t, p)
+        excess = np.nan_to_num(rho*cp*np.clip(t - 26.0, 0.0, None))
+        tchp = (0.5*(excess[1:] + excess[:-1])*dz).sum(axis=0)*1e-7  # J/m^2 -> kJ/cm^2
+        out['TCHP'][r0:r1] = np.where(ocean, tchp, np.nan)
+
+    return out
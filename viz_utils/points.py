@@ -0,0 +1,426 @@
+"""
+Bulk custom profile requests: lists of (lat, lon, date) points from CSV/Parquet files or the
+custom request text box.
+
+Files are read in chunks of NESPRESO_BULK_CHUNK rows and every chunk is parsed and validated as
+arrays (numeric conversion, coordinate ranges, date parsing), so 100k-point files take well under a
+second and invalid rows are reported by number instead of failing the whole file. Validated points
+are stored on the server (NESPRESO_BULK_DIR) under a key. The browser posts the file to the upload
+route itself and only receives a summary and the job key, so neither the points nor the profiles
+round-trip through Dash state.
+
+Fulfilment runs as a background job (viz_utils/jobs.py) that groups the points by date and sends
+each day to the profile API as one batched request (split above NESPRESO_BULK_MAX_POINTS points),
+NESPRESO_BULK_CONCURRENCY days at a time. The files are written to a zip on disk as the days
+complete, with points.csv mapping every input row to its file; the browser polls the job and
+downloads the finished zip.
+"""
+import csv
+import concurrent.futures
+import hashlib
+import io
+import json
+import logging
+import os
+import re
+import tempfile
+import time
+import zipfile
+
+import numpy as np
+import pandas as pd
+import requests
+
+from viz_utils.jobs import FileJobs
+
+try:
+    import pyarrow.parquet as pq
+except Exception:
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+LAT_NAMES = ('lat', 'latitude')
+LON_NAMES = ('lon', 'long', 'longitude')
+DATE_NAMES = ('date', 'day', 'time', 'datetime')
+DATE_PATTERN = r'\d{4}-\d{2}-\d{2}'
+
+
+def _column(names, candidates):
+    lowered = [str(n).strip().lower() for n in names]
+    return next((names[lowered.index(c)] for c in candidates if c in lowered), None)
+
+
+def validate_points(lat, lon, date, default_date=None, first_row=1):
+    """
+    Validate arrays of coordinates and dates.
+
+    Parameters:
+    lat, lon (array-like): Values or strings; unparseable values count as invalid.
+    date (array-like): 'YYYY-MM-DD' strings (longer strings are cut to 10 characters) or datetimes;
+        missing dates take `default_date`.
+    first_row (int): Number of the first row, for reporting.
+
+    Returns:
+    tuple: (DataFrame of valid points with columns row, lat, lon, date, report dict)
+    """
+    lat = pd.to_numeric(pd.Series(lat), errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(pd.Series(lon), errors='coerce').to_numpy(dtype=float)
+    date = pd.Series(date if date is not None else [None]*lat.size)
+    if pd.api.types.is_datetime64_any_dtype(date):
+        parsed = date
+    else:
+        text = date.astype('string').str.strip().str.slice(0, 10)
+        if default_date is not None:
+            text = text.mask(text.isna() | (text == ''), default_date)
+        parsed = pd.to_datetime(text, format='%Y-%m-%d', errors='coerce')
+    rows = np.arange(first_row, first_row + lat.size)
+    bad_lat = ~(np.abs(lat) <= 90.0)
+    bad_lon = ~(np.abs(lon) <= 180.0)
+    bad_date = parsed.isna().to_numpy()
+    valid = ~(bad_lat | bad_lon | bad_date)
+    points = pd.DataFrame({
+        'row': rows[valid],
+        'lat': lat[valid],
+        'lon': lon[valid],
+        'date': parsed.to_numpy()[valid].astype('datetime64[D]').astype(str),
+    })
+    report = {
+        'rows': int(lat.size),
+        'valid': int(valid.sum()),
+        'invalid_lat': int(bad_lat.sum()),
+        'invalid_lon': int(bad_lon.sum()),
+        'invalid_date': int(bad_date.sum()),
+        'invalid_rows': rows[~valid][:20].tolist(),
+    }
+    return points, report
+
+
+def merge_reports(reports):
+    merged = {'rows': 0, 'valid': 0, 'invalid_lat': 0, 'invalid_lon': 0, 'invalid_date': 0, 'invalid_rows': []}
+    for report in reports:
+        for key in ('rows', 'valid', 'invalid_lat', 'invalid_lon', 'invalid_date'):
+            merged[key] += report[key]
+        merged['invalid_rows'] = (merged['invalid_rows'] + report['invalid_rows'])[:20]
+    return merged
+
+
+def _csv_chunks(stream, chunksize):
+    head = stream.read(65536)
+    stream.seek(0)
+    if isinstance(head, bytes):
+        head = head.decode('utf-8-sig', 'replace')
+    lines = head.splitlines()
+    if len(head) == 65536 and len(lines) > 1:
+        lines = lines[:-1]  # cut by the sniffing read
+    lines = [line for line in lines if line.strip() and not line.lstrip().startswith('#')]
+    first = lines[0] if lines else ''
+    counts = {sep: first.count(sep) for sep in (',', ';', '\t')}
+    sep = max(counts, key=counts.get) if max(counts.values()) else r'\s+'
+    names = [n.strip() for n in re.split(sep, first.strip())]
+    width = max((len(re.split(sep, line.strip())) for line in lines[:1000]), default=0)
+    lat_col, lon_col, date_col = _column(names, LAT_NAMES), _column(names, LON_NAMES), _column(names, DATE_NAMES)
+    if lat_col is not None and lon_col is not None:
+        header, columns = 0, [lat_col, lon_col, date_col]
+    else:
+        # No header: lat, lon and an optional date, by position
+        header, columns = None, [0, 1, 2 if width > 2 else None]
+    usecols = [c for c in columns if c is not None]
+    reader = pd.read_csv(stream, sep=sep, header=header, names=None if header == 0 else range(width), usecols=usecols, chunksize=chunksize, comment='#',
+                         skipinitialspace=True, encoding='utf-8-sig',
+                         dtype={columns[2]: str} if columns[2] is not None else None)
+    for chunk in reader:
+        yield chunk[columns[0]], chunk[columns[1]], chunk[columns[2]] if columns[2] is not None else None
+
+
+def _parquet_chunks(stream, chunksize):
+    if pq is None:
+        raise ValueError("Parquet files need pyarrow on the server; upload CSV instead")
+    parquet = pq.ParquetFile(stream)
+    names = parquet.schema_arrow.names
+    lat_col, lon_col, date_col = _column(names, LAT_NAMES), _column(names, LON_NAMES), _column(names, DATE_NAMES)
+    if lat_col is None or lon_col is None:
+        raise ValueError(f"Parquet file needs lat and lon columns; found {', '.join(names)}")
+    columns = [c for c in (lat_col, lon_col, date_col) if c is not None]
+    for batch in parquet.iter_batches(batch_size=chunksize, columns=columns):
+        chunk = batch.to_pandas()
+        yield chunk[lat_col], chunk[lon_col], chunk[date_col] if date_col is not None else None
+
+
+def read_points_table(stream, filename, default_date=None, max_rows=200000, chunksize=50000):
+    """
+    Read and validate a CSV or Parquet point list (chosen by the file name) chunk by chunk.
+
+    CSV files may use comma, semicolon, tab or whitespace separators, with a header naming the
+    lat/latitude, lon/long/longitude and (optional) date columns, or no header and the columns in
+    that order.
+
+    Parameters:
+    stream: Seekable binary file object.
+    default_date (str): Date of points without one.
+
+    Returns:
+    tuple: (DataFrame of valid points, report dict)
+
+    Raises:
+    ValueError: Unreadable file, missing columns or more than max_rows rows.
+    """
+    parquet = (filename or '').lower().endswith(('.parquet', '.pq'))
+    chunks = _parquet_chunks(stream, chunksize) if parquet else _csv_chunks(stream, chunksize)
+    frames, reports, rows = [], [], 0
+    try:
+        for lat, lon, date in chunks:
+            if rows + len(lat) > max_rows:
+                raise ValueError(f"More than {max_rows} points; split the file")
+            points, report = validate_points(lat, lon, date, default_date, first_row=rows + 1)
+            frames.append(points)
+            reports.append(report)
+            rows += len(lat)
+    except (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError, KeyError) as exc:
+        raise ValueError(f"Could not read {filename or 'the file'}: {exc}")
+    if not frames:
+        raise ValueError("The file has no rows")
+    return pd.concat(frames, ignore_index=True), merge_reports(reports)
+
+
+def parse_points_text(text, default_date=None):
+    """
+    Points from the custom request text box: one point per line as 'lat, lon [date]' (comma or
+    whitespace separated) or 'lat=.. lon=.. [date=..]' in any order, with an optional
+    'date=YYYY-MM-DD' header line for lines without a date. Every line is matched at once with
+    vectorized string operations.
+
+    Returns:
+    tuple: (DataFrame of valid points, report dict)
+    """
+    lines = pd.Series(text.splitlines(), dtype='string').str.strip()
+    header = lines.str.fullmatch(rf'date\s*=\s*{DATE_PATTERN}', case=False).fillna(False)
+    if header.any():
+        default_date = re.search(DATE_PATTERN, lines[header].iloc[0]).group(0)
+    lines = lines[~header & (lines != '')].reset_index(drop=True)
+    named_lat = lines.str.extract(r'\blat\s*=\s*([+-]?\d+(?:\.\d+)?)', flags=re.IGNORECASE)[0]
+    named_lon = lines.str.extract(r'\b(?:lon|long)\s*=\s*([+-]?\d+(?:\.\d+)?)', flags=re.IGNORECASE)[0]
+    named_date = lines.str.extract(rf'\bdate\s*=\s*({DATE_PATTERN})', flags=re.IGNORECASE)[0]
+    parts = lines.str.split(r'[,\s]+', n=3, expand=True, regex=True).reindex(columns=range(3)).astype('string')
+    named = named_lat.notna() & named_lon.notna()
+    positional_date = parts[2].where(parts[2].str.fullmatch(DATE_PATTERN).fillna(False))
+    points, report = validate_points(named_lat.where(named, parts[0]), named_lon.where(named, parts[1]),
+                                     named_date.where(named, positional_date), default_date)
+    return points, report
+
+
+def group_by_date(points):
+    """[(date, points of that date)] in date order."""
+    return list(points.groupby('date', sort=True))
+
+
+class BulkProfiles:
+    """
+    Stores validated point lists and fulfils them from the profile API one day at a time, in a
+    background job per point list.
+
+    Parameters:
+    directory (str): Where validated point lists are kept until downloaded.
+    api_url (str): Profile API taking {"lat": [...], "lon": [...], "date": [...]} and returning a file.
+    concurrency (int): Days requested in parallel.
+    max_points (int): Largest number of points per API request; bigger days are split.
+    keep_s (float): Stored point lists older than this are removed.
+    timeout (float): Seconds per API request.
+    keep (int): Finished profile zips kept for download.
+    """
+
+    def __init__(self, directory, api_url, concurrency=4, max_points=5000, keep_s=24*3600, timeout=600, keep=20):
+        self.directory = directory
+        self.api_url = api_url
+        self.concurrency = concurrency
+        self.max_points = max_points
+        self.keep_s = keep_s
+        self.timeout = timeout
+        self.jobs = FileJobs(directory, suffix='.zip', keep=keep, name='bulk')
+
+    def _path(self, key, suffix):
+        if not re.fullmatch(r'[0-9a-f]{20}', key or ''):
+            raise ValueError("Unknown point list")
+        return os.path.join(self.directory, f'{key}{suffix}')
+
+    def store(self, points, report):
+        """Keep validated points for download; returns their key."""
+        os.makedirs(self.directory, exist_ok=True)
+        self._prune()
+        digest = hashlib.sha1()
+        for column in ('lat', 'lon', 'date'):
+            digest.update(points[column].to_numpy().astype(str if column == 'date' else float).tobytes())
+        key = digest.hexdigest()[:20]
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            np.savez(f, row=points['row'].to_numpy(), lat=points['lat'].to_numpy(), lon=points['lon'].to_numpy(),
+                     date=points['date'].to_numpy().astype('U10'))
+        os.replace(tmp, self._path(key, '.npz'))
+        with open(self._path(key, '.json'), 'w') as f:
+            json.dump(report, f)
+        return key
+
+    def load(self, key):
+        """(points DataFrame, report) stored under key."""
+        try:
+            with np.load(self._path(key, '.npz')) as data:
+                points = pd.DataFrame({name: data[name] for name in ('row', 'lat', 'lon', 'date')})
+            with open(self._path(key, '.json')) as f:
+                report = json.load(f)
+        except OSError:
+            raise ValueError("Unknown or expired point list; upload it again")
+        return points, report
+
+    def requests_for(self, points):
+        """[(file stem, points)] with one entry per day, days above max_points split in parts."""
+        batches = []
+        for date, group in group_by_date(points):
+            parts = max(1, -(-len(group)//self.max_points))
+            for i in range(parts):
+                part = group.iloc[i*self.max_points:(i + 1)*self.max_points]
+                batches.append((f'NeSPReSO_{date}' + (f'_part{i + 1}' if parts > 1 else ''), part))
+        return batches
+
+    def fetch(self, name, points):
+        payload = {'lat': points['lat'].tolist(), 'lon': points['lon'].tolist(), 'date': points['date'].tolist()}
+        start = time.perf_counter()
+        try:
+            resp = requests.post(self.api_url, json=payload, timeout=self.timeout)
+        except requests.RequestException as exc:
+            return None, f"request failed: {exc}"
+        finally:
+            logger.info("bulk profiles batch=%s points=%d seconds=%.1f", name, len(points), time.perf_counter() - start)
+        if resp.status_code != 200:
+            return None, f"HTTP {resp.status_code}: {resp.text[:200]}"
+        return resp.content, None
+
+    def write_zip(self, points, report, path, progress=None):
+        """
+        Write a zip to `path` with one file per day (or part) as it arrives, then points.csv and
+        report.json, calling progress(done, total) per request.
+
+        Returns:
+        dict: {'failed': number of failed requests}.
+        """
+        batches = self.requests_for(points)
+        index = io.StringIO()
+        writer = csv.writer(index)
+        writer.writerow(['row', 'lat', 'lon', 'date', 'file', 'status'])
+        errors = {}
+        stamp = time.localtime()[:6]
+        with zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_STORED) as archive:
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max(1, self.concurrency)) as pool:
+                futures = {pool.submit(self.fetch, name, part): (name, part) for name, part in batches}
+                for done, future in enumerate(concurrent.futures.as_completed(futures), start=1):
+                    name, part = futures[future]
+                    content, error = future.result()
+                    filename = f'profiles/{name}.nc'
+                    if content is not None:
+                        archive.writestr(zipfile.ZipInfo(filename, date_time=stamp), content)
+                    else:
+                        errors[name] = error
+                    status = 'ok' if content is not None else 'failed'
+                    writer.writerows((row, lat, lon, date, filename if content is not None else '', status)
+                                     for row, lat, lon, date in part[['row', 'lat', 'lon', 'date']].itertuples(index=False))
+                    if progress is not None:
+                        progress(done, len(batches))
+            if batches and len(errors) == len(batches):
+                raise RuntimeError(f"every profile request failed ({next(iter(errors.values()))})")
+            archive.writestr(zipfile.ZipInfo('points.csv', date_time=stamp), index.getvalue(), compress_type=zipfile.ZIP_DEFLATED)
+            archive.writestr(zipfile.ZipInfo('report.json', date_time=stamp),
+                             json.dumps(dict(report, requests=len(batches), failed=errors), indent=1))
+        return {'failed': len(errors)}
+
+    def submit(self, key):
+        """
+        Start (or join) the job fetching the profiles of the point list stored under `key`. A finished
+        zip with failed requests is fetched again.
+
+        Raises:
+        ValueError: For unknown or expired point lists.
+        """
+        points, report = self.load(key)
+        if self.jobs.status(key).get('failed'):
+            self.jobs.discard(key)
+        return self.jobs.submit(key, lambda path, progress: self.write_zip(points, report, path, progress),
+                                total=len(self.requests_for(points)))
+
+    def _prune(self):
+        now = time.time()
+        try:
+            entries = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for entry in entries:
+            try:
+                if now - entry.stat().st_mtime > self.keep_s:
+                    os.remove(entry.path)
+            except OSError:
+                pass
+
+
+def summary_text(report, dates):
+    """One-line description of a validated upload for the status line."""
+    text = f"{report['valid']:,} of {report['rows']:,} points valid over {dates} day(s)"
+    invalid = [f"{report[k]:,} bad {k[8:]}" for k in ('invalid_lat', 'invalid_lon', 'invalid_date') if report[k]]
+    if invalid:
+        text += f" ({', '.join(invalid)}; first rows {', '.join(map(str, report['invalid_rows'][:5]))})"
+    return text
+
+
+def install_bulk_profiles(server, bulk, default_date, max_rows=200000, chunksize=50000, prefix='/nespreso_viz'):
+    """
+    Add the bulk profile routes (also under `prefix`) to `server` (a Flask app):
+    POST /custom/profiles/bulk with a multipart 'file' (CSV or Parquet) and optional 'date' validates
+    and stores the points, starts the job fetching their profiles and answers with a summary, the
+    job key and its status and download URLs;
+    GET /custom/profiles/bulk/<key>/status reports the job's progress;
+    GET /custom/profiles/bulk/<key>.zip serves the finished zip.
+
+    Parameters:
+    default_date (callable): Date for points without one when the request gives none.
+    """
+    from flask import jsonify, request, send_file
+
+    def urls(key):
+        base = f"{request.script_root}{prefix}/custom/profiles/bulk/{key}"
+        return {'key': key, 'status_url': f"{base}/status", 'download': f"{base}.zip"}
+
+    def upload():
+        upload_file = request.files.get('file')
+        if upload_file is None:
+            return jsonify({'error': "Send the point list as a multipart 'file' field"}), 400
+        try:
+            points, report = read_points_table(upload_file.stream, upload_file.filename,
+                                               request.form.get('date') or default_date(), max_rows, chunksize)
+        except ValueError as exc:
+            return jsonify({'error': str(exc)}), 400
+        dates = int(points['date'].nunique())
+        if points.empty:
+            return jsonify(dict(report, error="No valid points", summary=summary_text(report, dates))), 400
+        key = bulk.submit(bulk.store(points, report))
+        return jsonify(dict(report, dates=dates, summary=summary_text(report, dates), job=bulk.jobs.status(key),
+                            **urls(key))), 202
+
+    def status(key):
+        job = bulk.jobs.status(key)
+        if job['state'] == 'unknown':
+            return jsonify(job), 404
+        return jsonify(dict(job, **urls(key)))
+
+    def download(key):
+        path = bulk.jobs.result_path(key)
+        if path is None:
+            return jsonify({'error': "Profiles not ready or expired", **bulk.jobs.status(key)}), 404
+        return send_file(path, mimetype='application/zip', as_attachment=True,
+                         download_name=f"NeSPReSO_profiles_{key}.zip")
+
+    for base, suffix in (('', ''), (prefix, '_prefixed')):
+        server.add_url_rule(f'{base}/custom/profiles/bulk', f'bulk_profiles_upload{suffix}', upload, methods=['POST'])
+        server.add_url_rule(f'{base}/custom/profiles/bulk/<key>/status', f'bulk_profiles_status{suffix}', status)
+        server.add_url_rule(f'{base}/custom/profiles/bulk/<key>.zip', f'bulk_profiles_download{suffix}', download)
+
+
+def default_bulk_dir():
+    return os.path.join(tempfile.gettempdir(), 'nespreso_bulk')
+
@@ -0,0 +1,350 @@
+"""
+On-demand profiling of individual requests: cProfile for where the time goes (callback, dataset
+preparation, figure building, plotly serialisation, compression) and tracemalloc for what it allocates.
+
+A request is profiled when
+  - its Dash callback (function name, e.g. update_trans, or an output id such as fig_temp_trans) or
+    route is listed in the targets (NESPRESO_PROFILE, comma-separated, or 'all'),
+  - it falls on the sampling interval (NESPRESO_PROFILE_SAMPLE=N profiles 1 in N requests), or
+  - it carries the admin token (NESPRESO_ADMIN_TOKEN) in the X-Nespreso-Profile header, the
+    'profile' query parameter or the cookie set by /admin/profiling/session.
+
+Targets and sampling can be changed at runtime through the /admin/profiling route; the settings are
+written to the profile directory, which every gunicorn worker watches, so no restart is needed.
+Each profile is saved as a pstats .prof file (snakeviz, pstats) with a readable .txt report next to
+it; only the newest NESPRESO_PROFILE_KEEP are kept. /admin/profiles lists them.
+"""
+import cProfile
+import hmac
+import io
+import json
+import logging
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+
+from viz_utils.metrics import callback_label
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_FILE = 'settings.json'
+TOKEN_HEADER = 'X-Nespreso-Profile'
+TOKEN_COOKIE = 'nespreso_profile'
+# Depth of the tracebacks tracemalloc records while profiling
+TRACEMALLOC_FRAMES = 10
+
+
+def _parse_targets(value):
+    if isinstance(value, str):
+        value = value.split(',')
+    return sorted({t.strip() for t in value or () if t and t.strip()})
+
+
+class Profiler:
+    """
+    Decides which requests to profile and writes their profiles to `directory`.
+
+    Parameters:
+    directory (str): Where profiles and the shared runtime settings are written.
+    targets (list): Callback names, output ids or routes to profile ('all' for every request).
+    sample (int): Profile 1 in `sample` requests (0 disables sampling).
+    keep (int): Number of profiles kept in the directory.
+    token (str): Admin token; requests carrying it are profiled and may use the admin routes.
+    """
+
+    def __init__(self, directory, targets=None, sample=0, keep=100, token=None):
+        self.directory = directory
+        self.keep = keep
+        self.token = token or None
+        self.targets = _parse_targets(targets)
+        self.sample = sample
+        self._counter = 0
+        self._active = threading.Lock()
+        self._settings_mtime = None
+        self._settings_checked = 0.0
+
+    # Runtime settings shared by the workers
+    def _settings_path(self):
+        return os.path.join(self.directory, SETTINGS_FILE)
+
+    def refresh_settings(self, interval=1.0):
+        """Pick up settings written by /admin/profiling in any worker (checked at most every `interval` s)."""
+        now = time.monotonic()
+        if now - self._settings_checked < interval:
+            return
+        self._settings_checked = now
+        try:
+            mtime = os.stat(self._settings_path()).st_mtime
+        except OSError:
+            return
+        if mtime == self._settings_mtime:
+            return
+        try:
+            with open(self._settings_path()) as f:
+                settings = json.load(f)
+        except (OSError, ValueError):
+            return
+        self._settings_mtime = mtime
+        self.targets = _parse_targets(settings.get('targets'))
+        self.sample = int(settings.get('sample') or 0)
+
+    def update_settings(self, targets=None, sample=None):
+        if targets is not None:
+            self.targets = _parse_targets(targets)
+        if sample is not None:
+            self.sample = max(0, int(sample))
+        os.makedirs(self.directory, exist_ok=True)
+        settings = {'targets': self.targets, 'sample': self.sample, 'updated': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(settings, f)
+        os.replace(tmp, self._settings_path())
+        self._settings_mtime = os.stat(self._settings_path()).st_mtime
+        return settings
+
+    def settings(self):
+        return {'targets': self.targets, 'sample': self.sample, 'keep': self.keep, 'directory': self.directory}
+
+    # Request selection
+    def check_token(self, candidate):
+        return bool(self.token and candidate) and hmac.compare_digest(str(candidate), self.token)
+
+    def wants(self, names, token=None):
+        """Whether to profile a request identified by `names` (endpoint, callback and output ids)."""
+        if self.check_token(token):
+            return 'token'
+        self.refresh_settings()
+        if self.targets and ('all' in self.targets or any(name in self.targets for name in names)):
+            return 'target'
+        if self.sample > 0:
+            self._counter += 1
+            if self._counter % self.sample == 0:
+                return 'sample'
+        return None
+
+    # Profiling one request
+    def start(self):
+        """Start profiling the current request; None if another request of this worker is being profiled."""
+        if not self._active.acquire(blocking=False):
+            return None
+        session = {'started_tracemalloc': not tracemalloc.is_tracing(), 'start': time.perf_counter()}
+        if session['started_tracemalloc']:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        else:
+            tracemalloc.reset_peak()
+        session['baseline'] = tracemalloc.take_snapshot()
+        session['profile'] = cProfile.Profile()
+        session['profile'].enable()
+        return session
+
+    def stop(self, session, info):
+        """Stop `session` and write its profile; `info` describes the request. Returns the profile name."""
+        try:
+            session['profile'].disable()
+            elapsed = time.perf_counter() - session['start']
+            snapshot = tracemalloc.take_snapshot()
+            current, peak = tracemalloc.get_traced_memory()
+            if session['started_tracemalloc']:
+                tracemalloc.stop()
+        finally:
+            self._active.release()
+        info = dict(info, ms=round(elapsed*1000, 1), peak_traced_mb=round(peak/2**20, 2), pid=os.getpid())
+        try:
+            return self._write(session['profile'], snapshot.compare_to(session['baseline'], 'lineno'), info)
+        except OSError as e:
+            logger.warning("Could not write profile: %s", e)
+            return None
+
+    def _write(self, profile, allocations, info):
+        os.makedirs(self.directory, exist_ok=True)
+        label = re.sub(r'[^A-Za-z0-9_.-]+', '-', info.get('callback') or info.get('endpoint') or 'request').strip('-')[:60]
+        now = time.time()
+        name = f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(now))}.{int(now*1000) % 1000:03d}_{os.getpid()}_{label}"
+        profile.dump_stats(os.path.join(self.directory, name + '.prof'))
+
+        out = io.StringIO()
+        for key, value in info.items():
+            out.write(f"{key}: {value}\n")
+        out.write("\nLargest allocations during the request (tracemalloc, net of earlier allocations):\n")
+        for stat in [s for s in allocations if s.size_diff > 0][:20]:
+            out.write(f"  {stat.size_diff/2**20:9.2f} MB  {stat.count_diff:8d} blocks  {stat.traceback}\n")
+        stats = pstats.Stats(profile, stream=out).strip_dirs()
+        out.write("\n")
+        stats.sort_stats('cumulative').print_stats(40)
+        stats.sort_stats('tottime').print_stats(20)
+        with open(os.path.join(self.directory, name + '.txt'), 'w') as f:
+            f.write(out.getvalue())
+        with open(os.path.join(self.directory, name + '.json'), 'w') as f:
+            json.dump(info, f)
+        self._rotate()
+        logger.info("profile=%s endpoint=%s ms=%.1f peak_traced_mb=%.1f",
+                    name, info.get('endpoint'), info['ms'], info['peak_traced_mb'])
+        return name
+
+    def _rotate(self):
+        profiles = sorted(self.list_names(), reverse=True)
+        for name in profiles[self.keep:]:
+            for suffix in ('.prof', '.txt', '.json'):
+                try:
+                    os.remove(os.path.join(self.directory, name + suffix))
+                except OSError:
+                    pass
+
+    def list_names(self):
+        try:
+            return [f[:-5] for f in os.listdir(self.directory) if f.endswith('.prof')]
+        except OSError:
+            return []
+
+    def list_profiles(self):
+        """Saved profiles, newest first, with the request details recorded for each."""
+        profiles = []
+        for name in sorted(self.list_names(), reverse=True):
+            try:
+                with open(os.path.join(self.directory, name + '.json')) as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                info = {}
+            profiles.append(dict(info, name=name))
+        return profiles
+
+    def path_for(self, filename):
+        """Absolute path of a profile file in the directory, or None if the name is not one."""
+        if not re.fullmatch(r'[A-Za-z0-9_.-]+\.(prof|txt)', filename or ''):
+            return None
+        path = os.path.join(self.directory, filename)
+        return path if os.path.isfile(path) else None
+
+
+def request_admin_token():
+    """Admin token sent with the current Flask request (X-Admin-Token header, 'token' query or cookie)."""
+    from flask import request
+    return request.headers.get('X-Admin-Token') or request.args.get('token') or request.cookies.get(TOKEN_COOKIE)
+
+
+def install_profiling(server, profiler, callback_map=None, prefix='/nespreso_viz'):
+    """
+    Profile selected requests of `server` (a Flask app) and add the admin routes
+    /admin/profiling, /admin/profiling/session, /admin/profiles and /admin/profiles/<file>
+    (also under `prefix`). Register after the metrics hooks and before compression so the
+    profile covers the callback, its serialisation and compression.
+
+    Parameters:
+    callback_map (dict): The Dash app's callback_map, to match requests by callback function name.
+    """
+    from flask import abort, g, jsonify, request, send_file
+
+    def request_names():
+        if request.path.endswith('/_dash-update-component'):
+            body = request.get_json(silent=True) or {}
+            output = body.get('output', '')
+            names = [callback_label(output)] + callback_label(output).split('+')
+            callback = (callback_map or {}).get(output, {}).get('callback')
+            if callback is not None:
+                names.insert(0, getattr(callback, '__name__', ''))
+            return names, body
+        rule = request.url_rule.rule if request.url_rule is not None else request.path
+        return [rule, rule[len(prefix):] if rule.startswith(prefix + '/') else rule], None
+
+    def request_token():
+        return (request.headers.get(TOKEN_HEADER) or request.args.get('profile')
+                or request.cookies.get(TOKEN_COOKIE))
+
+    @server.before_request
+    def _profile_start():
+        if request.path.startswith(('/admin/', f'{prefix}/admin/')) or request.path.endswith('/metrics'):
+            return
+        names, body = request_names()
+        reason = profiler.wants(names, request_token())
+        if reason is None:
+            return
+        session = profiler.start()
+        if session is None:
+            return
+        g.profile_session = session
+        g.profile_info = {
+            'path': request.path,
+            'endpoint': names[1] if body is not None else names[-1],
+            'callback': names[0] if body is not None else None,
+            'trigger': ','.join((body or {}).get('changedPropIds') or []) or None,
+            'reason': reason,
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        }
+
+    @server.after_request
+    def _profile_stop(response):
+        session = g.pop('profile_session', None)
+        if session is not None:
+            name = profiler.stop(session, dict(g.profile_info, status=response.status_code,
+                                               bytes=response.content_length))
+            if name:
+                response.headers['X-Nespreso-Profile-Name'] = name
+        return response
+
+    @server.teardown_request
+    def _profile_abort(exc):
+        # after_request does not run when the view raised
+        session = g.pop('profile_session', None)
+        if session is not None:
+            profiler.stop(session, dict(g.profile_info, status=500, error=repr(exc)))
+
+    def require_admin():
+        if not profiler.check_token(request_admin_token()):
+            # The admin surface does not exist without a valid token
+            abort(404)
+
+    def profiling_settings():
+        require_admin()
+        if request.method == 'POST':
+            data = request.get_json(silent=True) or request.form
+            try:
+                sample = data.get('sample')
+                return jsonify(profiler.update_settings(targets=data.get('targets'),
+                                                        sample=int(sample) if sample not in (None, '') else None))
+            except (TypeError, ValueError):
+                abort(400)
+        profiler.refresh_settings(interval=0)
+        return jsonify(profiler.settings())
+
+    def profiling_session():
+        # Sets (or clears, with ?off=1) the cookie that profiles every request of this browser
+        require_admin()
+        response = jsonify({'profiling': 'off' if request.args.get('off') else 'on'})
+        if request.args.get('off'):
+            response.delete_cookie(TOKEN_COOKIE, path='/')
+        else:
+            response.set_cookie(TOKEN_COOKIE, profiler.token, max_age=3600, httponly=True, samesite='Strict', path='/')
+        return response
+
+    def list_profiles():
+        require_admin()
+        return jsonify(profiler.list_profiles())
+
+    def get_profile(filename):
+        require_admin()
+        path = profiler.path_for(filename)
+        if path is None:
+            abort(404)
+        if filename.endswith('.txt'):
+            return send_file(path, mimetype='text/plain')
+        return send_file(path, mimetype='application/octet-stream', as_attachment=True)
+
+    for base, suffix in (('', ''), (prefix, '_prefixed')):
+        server.add_url_rule(f'{base}/admin/profiling', f'profiling_settings{suffix}', profiling_settings,
+                            methods=['GET', 'POST'])
+        server.add_url_rule(f'{base}/admin/profiling/session', f'profiling_session{suffix}', profiling_session)
+        server.add_url_rule(f'{base}/admin/profiles', f'list_profiles{suffix}', list_profiles)
+        server.add_url_rule(f'{base}/admin/profiles/<filename>', f'get_profile{suffix}', get_profile)
+
+
+profiler = Profiler(
+    directory=os.environ.get('NESPRESO_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'nespreso_profiles')),
+    targets=os.environ.get('NESPRESO_PROFILE', ''),
+    sample=int(os.environ.get('NESPRESO_PROFILE_SAMPLE', '0')),
+    keep=int(os.environ.get('NESPRESO_PROFILE_KEEP', '100')),
+    token=os.environ.get('NESPRESO_ADMIN_TOKEN'),
+)
@@ -0,0 +1,205 @@
+"""
+Server-side rasterisation of 2D map slices into PNG image layers.
+
+The colour mapping is a vectorized lookup into the cached cmocean palette and the PNG
+encoder only needs zlib, so no imaging library is required.
+"""
+import base64
+import struct
+import threading
+import zlib
+from collections import OrderedDict
+
+import numpy as np
+
+from viz_utils.styles import get_palette
+
+# Index 255 is reserved for NaN (land / missing) and is fully transparent
+PALETTE_SIZE = 255
+NAN_INDEX = 255
+
+
+def data_range(z, zmin=None, zmax=None):
+    """Fill in missing colour limits from the finite values of z (plotly's autoscale behaviour)."""
+    if zmin is None or zmax is None:
+        finite = np.asarray(z, dtype=float)
+        finite = finite[np.isfinite(finite)]
+        if finite.size == 0:
+            return zmin, zmax
+        if zmin is None:
+            zmin = float(finite.min())
+        if zmax is None:
+            zmax = float(finite.max())
+    return zmin, zmax
+
+
+def quantize(z, zmin, zmax, levels=PALETTE_SIZE):
+    """
+    Map z to palette indices 0..levels-1; NaNs map to NAN_INDEX.
+
+    Returns:
+        np.ndarray: uint8 array with the same shape as z.
+    """
+    z = np.asarray(z, dtype=np.float32)
+    idx = np.full(z.shape, NAN_INDEX, dtype=np.uint8)
+    valid = np.isfinite(z)
+    if zmin is None or zmax is None or not valid.any():
+        return idx
+    span = float(zmax) - float(zmin)
+    scale = (levels - 1)/span if span > 0 else 0.0
+    scaled = np.rint((z[valid] - float(zmin))*scale)
+    idx[valid] = np.clip(scaled, 0, levels - 1).astype(np.uint8)
+    return idx
+
+
+def colorize(z, cmap, zmin=None, zmax=None):
+    """
+    Colour-map a 2D array into an RGBA uint8 image (NaNs transparent).
+    Rows are returned in array order; flip before encoding if row 0 is the southern edge.
+    """
+    zmin, zmax = data_range(z, zmin, zmax)
+    idx = quantize(z, zmin, zmax)
+    palette = get_palette(cmap, PALETTE_SIZE)
+    lut = np.zeros((256, 4), dtype=np.uint8)
+    lut[:PALETTE_SIZE, :3] = palette
+    lut[:PALETTE_SIZE, 3] = 255
+    return lut[idx]
+
+
+def _png_chunk(tag, payload):
+    chunk = tag + payload
+    return struct.pack('>I', len(payload)) + chunk + struct.pack('>I', zlib.crc32(chunk) & 0xffffffff)
+
+
+def _png_rows(pixels):
+    # Prefix every scanline with filter type 0 (None)
+    h = pixels.shape[0]
+    rows = np.ascontiguousarray(pixels).reshape(h, -1)
+    return np.hstack([np.zeros((h, 1), dtype=np.uint8), rows]).tobytes()
+
+
+def encode_png(rgba, compress_level=6, text=None):
+    """
+    Encode an (h, w, 3|4) uint8 array as PNG bytes.
+
+    Args:
+        text (dict): Optional keyword -> value metadata stored as tEXt chunks (Latin-1).
+    """
+    rgba = np.asarray(rgba, dtype=np.uint8)
+    h, w, channels = rgba.shape
+    color_type = 6 if channels == 4 else 2
+    header = struct.pack('>IIBBBBB', w, h, 8, color_type, 0, 0, 0)
+    text_chunks = [_png_chunk(b'tEXt', f'{key}\0{value}'.encode('latin-1', 'replace'))
+                   for key, value in (text or {}).items()]
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', header),
+        *text_chunks,
+        _png_chunk(b'IDAT', zlib.compress(_png_rows(rgba), compress_level)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def encode_indexed_png(idx, cmap, compress_level=6):
+    """
+    Encode palette indices from `quantize` as an 8-bit indexed PNG.
+    One byte per pixel plus a 256-entry palette, with NAN_INDEX transparent.
+    """
+    idx = np.asarray(idx, dtype=np.uint8)
+    h, w = idx.shape
+    palette = np.zeros((256, 3), dtype=np.uint8)
+    palette[:PALETTE_SIZE] = get_palette(cmap, PALETTE_SIZE)
+    alpha = np.full(256, 255, dtype=np.uint8)
+    alpha[NAN_INDEX] = 0
+    header = struct.pack('>IIBBBBB', w, h, 8, 3, 0, 0, 0)
+    return b''.join([
+        b'\x89PNG\r\n\x1a\n',
+        _png_chunk(b'IHDR', header),
+        _png_chunk(b'PLTE', palette.tobytes()),
+        _png_chunk(b'tRNS', alpha.tobytes()),
+        _png_chunk(b'IDAT', zlib.compress(_png_rows(idx[..., np.newaxis]), compress_level)),
+        _png_chunk(b'IEND', b''),
+    ])
+
+
+def render_png(z, cmap, zmin, zmax, north_up=True):
+    """
+    Rasterise a (lat, lon) slice into indexed PNG bytes.
+
+    Args:
+        north_up (bool): True when row 0 of z is the southern edge, so rows are flipped for the image.
+    """
+    idx = quantize(z, zmin, zmax)
+    if north_up:
+        idx = idx[::-1, :]
+    return encode_indexed_png(idx, cmap)
+
+
+def png_data_uri(png_bytes):
+    return 'data:image/png;base64,' + base64.b64encode(png_bytes).decode('ascii')
+
+
+def image_extent(lons, lats):
+    """Bounds (lon_min, lon_max, lat_min, lat_max) of the cell edges around the given centres."""
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    dx = abs(float(lons[1] - lons[0]))/2 if lons.size > 1 else 0.5
+    dy = abs(float(lats[1] - lats[0]))/2 if lats.size > 1 else 0.5
+    return (float(lons.min()) - dx, float(lons.max()) + dx, float(lats.min()) - dy, float(lats.max()) + dy)
+
+
+class RasterCache:
+    """Thread-safe LRU of rendered images, keyed by (date, field, depth, ...)."""
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            value = self._items.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def items(self):
+        with self._lock:
+            return list(self._items.items())
+
+    def evict_oldest(self):
+        with self._lock:
+            if not self._items:
+                return None
+            key, _ = self._items.popitem(last=False)
+            self.evictions += 1
+            return key
+
+    def nbytes(self):
+        with self._lock:
+            return sum(len(v) for v in self._items.values())
+
+    def __len__(self):
+        return len(self._items)
+
+
+# Shared cache of map image layers (data URIs) used by MainFigures in raster mode
+image_cache = RasterCache(maxsize=64)
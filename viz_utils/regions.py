@@ -0,0 +1,126 @@
+"""
+Region statistics for box/lasso selections drawn on the maps.
+
+A selection is rasterised into a boolean (lat, lon) mask and the T/S cube is reduced over the
+selected ocean cells one block of depth levels at a time, weighting every cell by its area (cos(lat)).
+"""
+import numpy as np
+
+# Percentiles reported for a region, per depth level
+REGION_PERCENTILES = (10, 25, 50, 75, 90)
+
+
+def region_from_selection(selected_data):
+    """
+    Region store entry from a graph's selectedData: the box range or the lasso polygon.
+
+    Returns:
+    dict or None: {'type': 'box'|'polygon', 'lon': [...], 'lat': [...]}
+    """
+    if not selected_data:
+        return None
+    if selected_data.get('range') and 'x' in selected_data['range'] and 'y' in selected_data['range']:
+        lon0, lon1 = sorted(float(v) for v in selected_data['range']['x'])
+        lat0, lat1 = sorted(float(v) for v in selected_data['range']['y'])
+        return {'type': 'box', 'lon': [lon0, lon1], 'lat': [lat0, lat1]}
+    lasso = selected_data.get('lassoPoints')
+    if lasso and len(lasso.get('x', [])) >= 3:
+        return {'type': 'polygon', 'lon': [float(v) for v in lasso['x']], 'lat': [float(v) for v in lasso['y']]}
+    return None
+
+
+def region_label(region):
+    if region['type'] == 'box':
+        return f"Box {region['lat'][0]:.2f}-{region['lat'][1]:.2f}N, {region['lon'][0]:.2f}-{region['lon'][1]:.2f}E"
+    return f"Polygon ({len(region['lon'])} vertices)"
+
+
+def region_mask(region, lons, lats):
+    """
+    Boolean (lat, lon) mask of the grid cells whose centres fall inside the region.
+    Polygons use an even-odd test vectorized over the cells of the polygon's bounding box.
+    """
+    lons = np.asarray(lons, dtype=float)
+    lats = np.asarray(lats, dtype=float)
+    mask = np.zeros((lats.size, lons.size), dtype=bool)
+    px = np.asarray(region['lon'], dtype=float)
+    py = np.asarray(region['lat'], dtype=float)
+    cols = np.flatnonzero((lons >= px.min()) & (lons <= px.max()))
+    rows = np.flatnonzero((lats >= py.min()) & (lats <= py.max()))
+    if cols.size == 0 or rows.size == 0:
+        return mask
+    if region['type'] == 'box':
+        mask[np.ix_(rows, cols)] = True
+        return mask
+    x = lons[cols][np.newaxis, :]
+    y = lats[rows][:, np.newaxis]
+    inside = np.zeros((rows.size, cols.size), dtype=bool)
+    x0, y0 = px, py
+    x1, y1 = np.roll(px, -1), np.roll(py, -1)
+    for xa, ya, xb, yb in zip(x0, y0, x1, y1):
+        if ya == yb:
+            continue
+        crosses = (ya > y) != (yb > y)
+        x_cross = xa + (y - ya)*(xb - xa)/(yb - ya)
+        inside ^= crosses & (x < x_cross)
+    mask[np.ix_(rows, cols)] = inside
+    return mask
+
+
+def _weighted_percentiles(values, weights, percentiles):
+    """Weighted percentiles along axis 1 of a (levels, cells) block; NaNs carry no weight."""
+    valid = np.isfinite(values)
+    order = np.argsort(np.where(valid, values, np.inf), axis=1)
+    ordered = np.take_along_axis(values, order, axis=1)
+    w = np.where(valid, weights[np.newaxis, :], 0.0)
+    cum = np.cumsum(np.take_along_axis(w, order, axis=1), axis=1)
+    total = cum[:, -1:]
+    out = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        frac = cum/total
+    for q in percentiles:
+        # First cell whose cumulative weight reaches q
+        idx = np.minimum((frac < q/100.0).sum(axis=1), values.shape[1] - 1)
+        out[q] = np.where(total[:, 0] > 0, ordered[np.arange(values.shape[0]), idx], np.nan)
+    return out
+
+
+def region_statistics(cube, mask, lats, percentiles=REGION_PERCENTILES, max_chunk_bytes=64_000_000):
+    """
+    Area-weighted statistics per depth level over the masked cells of a (depth, lat, lon) cube.
+
+    Only the bounding box of the mask is read, in blocks of depth levels sized to `max_chunk_bytes`,
+    so memory stays bounded for large regions and deep cubes.
+
+    Returns:
+    dict: 'mean', 'std', 'count' and one entry per percentile (e.g. 'p10'), each a (depth,) array.
+    """
+    rows = np.flatnonzero(mask.any(axis=1))
+    cols = np.flatnonzero(mask.any(axis=0))
+    nd = cube.shape[0]
+    stats = {key: np.full(nd, np.nan) for key in ['mean', 'std', 'count'] + [f'p{q}' for q in percentiles]}
+    if rows.size == 0:
+        stats['count'][:] = 0
+        return stats
+    r0, r1, c0, c1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+    sub_mask = mask[r0:r1, c0:c1]
+    weights = np.broadcast_to(np.cos(np.deg2rad(np.asarray(lats, dtype=float)[r0:r1]))[:, np.newaxis], sub_mask.shape)[sub_mask]
+    ncells = int(sub_mask.sum())
+    # Sorting for the percentiles keeps ~6 float64 copies of a block alive
+    chunk_levels = max(1, int(max_chunk_bytes//(ncells*8*6)))
+    for d0 in range(0, nd, chunk_levels):
+        d1 = min(d0 + chunk_levels, nd)
+        block = np.asarray(cube[d0:d1, r0:r1, c0:c1], dtype=float)[:, sub_mask]
+        valid = np.isfinite(block)
+        w = np.where(valid, weights[np.newaxis, :], 0.0)
+        wsum = w.sum(axis=1)
+        filled = np.where(valid, block, 0.0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = (filled*w).sum(axis=1)/wsum
+            var = (np.where(valid, (block - mean[:, np.newaxis])**2, 0.0)*w).sum(axis=1)/wsum
+        stats['mean'][d0:d1] = mean
+        stats['std'][d0:d1] = np.sqrt(var)
+        stats['count'][d0:d1] = valid.sum(axis=1)
+        for q, values in _weighted_percentiles(block, weights, percentiles).items():
+            stats[f'p{q}'][d0:d1] = values
+    return stats
@@ -5,12 +5,79 @@ import cmocean.cm as cm
 import dash_bootstrap_components as dbc
 from dash import dcc, html, Input, Output, State
 import os
+import colorsys
 try:
     import dash_mantine_components as dmc
 except Exception:
     dmc = None
 from datetime import datetime
 
+# Colormaps used by the dashboard figures; their plotly colorscales are built once at import
+COLORMAPS = {
+    'curl': cm.curl,
+    'thermal': cm.thermal,
+    'haline': cm.haline,
+    'deep': cm.deep,
+    'amp': cm.amp,
+}
+COLORSCALE_ENTRIES = 256
+
+# Registry of converted colorscales keyed by (colormap name, entries)
+_COLORSCALE_REGISTRY = {}
+
+def _build_colorscale(cmap, pl_entries):
+    h = 1.0/(pl_entries-1)
+    pl_colorscale = []
+    for k in range(pl_entries):
+        r, g, b = cmap(k*h)[:3]
+        r = int(round(float(r)*255))
+        g = int(round(float(g)*255))
+        b = int(round(float(b)*255))
+        pl_colorscale.append([k*h, f'rgb({r}, {g}, {b})'])
+    return pl_colorscale
+
+def get_colorscale(cmap, pl_entries=COLORSCALE_ENTRIES):
+    """
+    Return the plotly colorscale for a cmocean colormap, converting it only on first use.
+    The returned list is shared; callers must not modify it.
+    """
+    key = (getattr(cmap, 'name', None) or id(cmap), int(pl_entries))
+    colorscale = _COLORSCALE_REGISTRY.get(key)
+    if colorscale is None:
+        colorscale = _build_colorscale(cmap, int(pl_entries))
+        _COLORSCALE_REGISTRY[key] = colorscale
+    return colorscale
+
+def get_palette(cmap, entries=COLORSCALE_ENTRIES):
+    """
+    Return the colormap sampled at `entries` evenly spaced stops as a uint8 (entries, 3) RGB array.
+    Used by the server-side rasteriser; the array is shared and read-only.
+    """
+    key = ('palette', getattr(cmap, 'name', None) or id(cmap), int(entries))
+    palette = _COLORSCALE_REGISTRY.get(key)
+    if palette is None:
+        rgba = np.asarray(cmap(np.linspace(0.0, 1.0, int(entries))), dtype=float)
+        palette = np.round(rgba[:, :3]*255).astype(np.uint8)
+        palette.setflags(write=False)
+        _COLORSCALE_REGISTRY[key] = palette
+    return palette
+
+for _cmap in COLORMAPS.values():
+    get_colorscale(_cmap, COLORSCALE_ENTRIES)
+
+def color_cycle(colors, n):
+    '''
+    Colors for n profile locations: the base palette first, then hues stepped by the golden
+    angle so any number of points gets distinct, stable colors (hex strings).
+    '''
+    cycle = list(colors[:n])
+    for i in range(len(cycle), n):
+        hue = ((i - len(colors))*0.618033988749895) % 1.0
+        lightness = 0.42 if (i//len(colors)) % 2 else 0.55
+        r, g, b = colorsys.hls_to_rgb(hue, lightness, 0.65)
+        cycle.append(f'#{int(r*255):02x}{int(g*255):02x}{int(b*255):02x}')
+    return cycle
+
 # /doc 
 class NespresoStyles:
     """
@@ -28,6 +95,8 @@ class NespresoStyles:
     Methods:
         __init__(self, dates: np.ndarray, start_date: str): Initializes the NespresoStyles object.
         cmocean_to_plotly(self, cmap, pl_entries): Converts a cmocean colormap to a plotly compatible colormap.
+        coloraxis(self, cmap, colorbar_title, zmin, zmax): Returns a layout-level coloraxis shared by the figure traces.
+        color_cycle(self, n): Returns n profile colors, extending `colors` without repeating.
         default_layout(self): Returns the default layout for the Nespreso visualization.
     """
 
@@ -57,7 +126,7 @@ class NespresoStyles:
     def_figure = {'data': [], 'layout': {'height': fig_height}}
 
     def_config = dict(
-        modeBarButtonsToRemove=['zoomOut2d','zoomIn2d','lasso','select2d'],
+        modeBarButtonsToRemove=['zoomOut2d','zoomIn2d'],
         modeBarButtonsToAdd=['drawline','eraseshape'],
         scrollZoom=True,
         displayModeBar=True,
@@ -98,19 +167,29 @@ class NespresoStyles:
 
     def cmocean_to_plotly(self, cmap, pl_entries):
         '''
-        This function converts a cmocean colormap to a plotly compatible colormap
+        This function converts a cmocean colormap to a plotly compatible colormap.
+        Conversions are cached in the module registry, so repeated calls are free.
         '''
-        h = 1.0/(pl_entries-1)
-        pl_colorscale = []
-        
-        for k in range(pl_entries):
-            r, g, b = cmap(k*h)[:3]
-            r = int(round(float(r)*255))
-            g = int(round(float(g)*255))
-            b = int(round(float(b)*255))
-            pl_colorscale.append([k*h, f'rgb({r}, {g}, {b})'])
-            
-        return pl_colorscale
+        return get_colorscale(cmap, pl_entries)
+
+    def coloraxis(self, cmap, colorbar_title, zmin=None, zmax=None):
+        '''
+        Layout-level coloraxis for a figure. Traces reference it with coloraxis='coloraxis'
+        so the colorscale is serialised once per figure instead of once per trace.
+        '''
+        return dict(
+            colorscale=get_colorscale(cmap, COLORSCALE_ENTRIES),
+            cmin=zmin,
+            cmax=zmax,
+            showscale=True,
+            colorbar=dict(title={'text': colorbar_title, 'side': 'right'}, thickness=12, lenmode='fraction', len=0.88, y=0.5, x=1.0, xpad=0),
+        )
+
+    def color_cycle(self, n):
+        '''
+        Colors for n profile locations (hex strings), see color_cycle.
+        '''
+        return color_cycle(self.colors, n)
 
     def default_layout(self):
         selected_date_str = self.selected_date.strftime("%b %d, %Y")
@@ -304,6 +383,11 @@ class NespresoStyles:
                     dcc.Store(id='cur_date', data=0),
                     dcc.Store(id='cur_date_str', data=max(self.days).astype('datetime64[D]').astype(str)),
                     dcc.Store(id='trans_lines', data=[]),
+                    # Viewports the map figures were built for, one store per figure callback
+                    dcc.Store(id='sat_viewports', data={}),
+                    dcc.Store(id='nespreso_viewports', data={}),
+                    dcc.Store(id='derived_viewports', data={}),
+                    dcc.Store(id='region', data=None),
                 ], justify='center'),
 
                 # ------------------- Secondary satellite figures -------------------
@@ -339,6 +423,24 @@ class NespresoStyles:
                                         className='small-slider'
                                     ), width=8)
                                 ], align='center'),
+                                # Depth scan: T and S over a depth range, scrubbed in the browser
+                                dbc.Row([
+                                    dbc.Col(html.Div("Depth scan:", className="font-weight-bold"), width="auto"),
+                                    dbc.Col(dcc.RangeSlider(
+                                        id='depth_scan_range',
+                                        min=0,
+                                        max=1800,
+                                        step=10,
+                                        value=[0, 500],
+                                        marks={0: '0', 500: '500', 1000: '1000', 1800: '1800'},
+                                        tooltip={"placement": "bottom", "always_visible": False},
+                                        className='small-slider'
+                                    ), width=6),
+                                    dbc.Col(html.Div("every (m):"), width="auto"),
+                                    dbc.Col(dcc.Input(id='depth_scan_step', type='number', min=1, max=500, step=1, value=25,
+                                                      style={'width': '80px'}), width="auto"),
+                                    dbc.Col(dbc.Button("Scan depths", id='depth_scan_start', className="btn-modern"), width="auto"),
+                                ], align='center', className='mt-3'),
                             ])
                         )
                     ], width=12)
@@ -350,6 +452,10 @@ class NespresoStyles:
                     dbc.Col(dbc.Card(dbc.CardBody([dcc.Graph(id='fig_temp', figure=self.def_figure, config=self.trans_config), html.Div("Generated with NeSPReSO (Miranda et al. 2025)", className='viz-footer')], style={'backgroundColor':'#f2f4f8'}), className='viz-card', style={'backgroundColor':'#f2f4f8', 'border':'none'}), xl=6, lg=6, md=6),
                     dbc.Col(dbc.Card(dbc.CardBody([dcc.Graph(id='fig_sal',  figure=self.def_figure, config=self.trans_config), html.Div("Generated with NeSPReSO (Miranda et al. 2025)", className='viz-footer')], style={'backgroundColor':'#f2f4f8'}), className='viz-card', style={'backgroundColor':'#f2f4f8', 'border':'none'}), xl=6, lg=6, md=6),
                 ], className='plot-row'),
+                # Shown once a depth scan has been requested
+                dbc.Row([
+                    dbc.Col(dbc.Card(dbc.CardBody([dcc.Graph(id='fig_depth_scan', figure=self.def_figure, config=self.def_config), html.Div("Generated with NeSPReSO (Miranda et al. 2025)", className='viz-footer')], style={'backgroundColor':'#f2f4f8'}), className='viz-card', style={'backgroundColor':'#f2f4f8', 'border':'none'}), width=12),
+                ], id='depth_scan_row', className='plot-row', style={'display': 'none'}),
 
                 # ------------------- Transect controls and plots -------------------
                 dbc.Row([
@@ -405,13 +511,14 @@ class NespresoStyles:
                     dbc.Col(
                         html.Div(id='profile_controls', children=[
                             html.Div(
-                                ["To view T and S profiles, click on any map at the desired locations."],
+                                ["To view T and S profiles, click on any map at the desired locations, or use box/lasso select for region-averaged profiles."],
                                 id='instructions_profile',
                                 style={'padding':'6px','fontStyle':'italic'}
                             ),
                             dbc.ButtonGroup([
                                 dbc.Button("Undo last point", id="undo_prof", className="btn-modern btn-undo", color='warning'),
                                 dbc.Button("Clear points", id="clear_prof", className="btn-modern btn-clear", color='danger'),
+                                dbc.Button("Clear region", id="clear_region", className="btn-modern btn-clear", color='secondary'),
                             ], id='profile_buttons', style={'display':'none'})
                         ]), width=12
                     )
@@ -421,7 +528,157 @@ class NespresoStyles:
                     dbc.Col(dbc.Card(dbc.CardBody([dcc.Graph(id='fig_sal_prof',  figure=self.def_figure,config=self.prof_config), html.Div("Generated with NeSPReSO (Miranda et al. 2025)", className='viz-footer')], style={'backgroundColor':'#f1f3f5'}),    className='viz-card viz-dense', style={'backgroundColor':'#f1f3f5', 'border':'none'}),  xl=6, lg=6, md=6),
                 ], className='plot-row', id='profiles_row', style={'display':'none'}),
 
-                # ------------------- Additional metrics (removed MLD) -------------------
+                # ------------------- Derived products (MLD, isotherm depths, TCHP) -------------------
+                dbc.Row([dbc.Col(html.Div(style={'height': '21px'}))]),
+                dbc.Row([
+                    dbc.Col(html.H1("Derived products", id='derived-heading', style={'textAlign': 'center', 'fontSize': '24px'}), width=12)
+                ]),
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Card(
+                            dbc.CardBody([
+                                dbc.Row([
+                                    dbc.Col(html.Div("Product:", className="font-weight-bold"), width="auto"),
+                                    dbc.Col(dcc.Dropdown(
+                                        id='derived_product',
+                                        options=[
+                                            {'label': 'Mixed Layer Depth (MLD)', 'value': 'MLD'},
+                                            {'label': 'Depth of 26 °C isotherm (D26)', 'value': 'D26'},
+                                            {'label': 'Depth of 20 °C isotherm (D20)', 'value': 'D20'},
+                                            {'label': 'Tropical Cyclone Heat Potential (TCHP)', 'value': 'TCHP'},
+                                        ],
+                                        value='MLD',
+                                        clearable=False
+                                    ), width=6),
+                                ], align='center'),
+                            ])
+                        )
+                    ], width=12)
+                ], className='mb-3'),
+                dbc.Row([
+                    dbc.Col(dbc.Card(dbc.CardBody([dcc.Loading(dcc.Graph(id='fig_derived', figure=self.def_figure, config=self.def_config)), html.Div("Generated with NeSPReSO (Miranda et al. 2025)", className='viz-footer')], style={'backgroundColor':'#f2f4f8'}), className='viz-card', style={'backgroundColor':'#f2f4f8', 'border':'none'}), xl=6, lg=6, md=6),
+                ], className='plot-row', justify='center'),
+                dbc.Row([dbc.Col(html.Div(style={'height': '21px'}))]),
+
+                # ------------------- Time-lapse animation -------------------
+                dbc.Row([
+                    dbc.Col(html.H1("Time-lapse", id='animation-heading', style={'textAlign': 'center', 'fontSize': '24px'}), width=12)
+                ]),
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Card(
+                            dbc.CardBody([
+                                dbc.Row([
+                                    dbc.Col(html.Div("Field:", className="font-weight-bold"), width="auto"),
+                                    dbc.Col(dcc.Dropdown(
+                                        id='animation_field',
+                                        options=[
+                                            {'label': 'Temperature (at map depth)', 'value': 'Temperature'},
+                                            {'label': 'Salinity (at map depth)', 'value': 'Salinity'},
+                                            {'label': 'ADT (AVISO)', 'value': 'AVISO'},
+                                            {'label': 'SST', 'value': 'SST'},
+                                            {'label': 'SSS', 'value': 'SSS'},
+                                        ],
+                                        value='Temperature',
+                                        clearable=False,
+                                        style={"minWidth": "220px"}
+                                    ), width="auto"),
+                                    dbc.Col(dcc.DatePickerRange(
+                                        id='animation_range',
+                                        min_date_allowed=min(self.days).astype('datetime64[D]').astype(str),
+                                        max_date_allowed=max(self.days).astype('datetime64[D]').astype(str),
+                                        start_date=(max(self.days) - np.timedelta64(29, 'D')).astype('datetime64[D]').astype(str),
+                                        end_date=max(self.days).astype('datetime64[D]').astype(str),
+                                        display_format='YYYY-MM-DD',
+                                    ), width="auto"),
+                                    dbc.Col(html.Div("Every", className="font-weight-bold"), width="auto"),
+                                    dbc.Col(dcc.Input(id='animation_step', type='number', min=1, max=30, step=1, value=1,
+                                                      style={'width': '70px'}), width="auto"),
+                                    dbc.Col(html.Div("day(s)"), width="auto"),
+                                    dbc.Col(dbc.Button("Prepare animation", id='animation_start', className="btn-modern"), width="auto"),
+                                    dbc.Col(html.Span(id='animation_status', children=''), width="auto"),
+                                ], align='center', className='g-2'),
+                            ])
+                        )
+                    ], width=12)
+                ], className='mb-3'),
+                dcc.Store(id='animation_job', data=None),
+                dcc.Interval(id='animation_poll', interval=1000, disabled=True),
+                dbc.Row([
+                    dbc.Col(dbc.Card(dbc.CardBody([dcc.Graph(id='fig_animation', figure=self.def_figure, config=self.def_config), html.Div("Generated with NeSPReSO (Miranda et al. 2025)", className='viz-footer')], style={'backgroundColor':'#f2f4f8'}), className='viz-card', style={'backgroundColor':'#f2f4f8', 'border':'none'}), xl=8, lg=10, md=12),
+                ], className='plot-row', justify='center'),
+                dbc.Row([dbc.Col(html.Div(style={'height': '21px'}))]),
+
+                # ------------------- Image export -------------------
+                dbc.Row([
+                    dbc.Col(html.H1("Image export", id='export-heading', style={'textAlign': 'center', 'fontSize': '24px'}), width=12)
+                ]),
+                dbc.Row([
+                    dbc.Col([
+                        dbc.Card(
+                            dbc.CardBody([
+                                dbc.Row([
+                                    dbc.Col(html.Div("Fields:", className="font-weight-bold"), width="auto"),
+                                    dbc.Col(dcc.Dropdown(
+                                        id='export_fields',
+                                        options=[
+                                            {'label': 'Temperature', 'value': 'Temperature'},
+                                            {'label': 'Salinity', 'value': 'Salinity'},
+                                            {'label': 'ADT (AVISO)', 'value': 'AVISO'},
+                                            {'label': 'SST', 'value': 'SST'},
+                                            {'label': 'SSS', 'value': 'SSS'},
+                                        ],
+                                        value=['Temperature', 'Salinity'],
+                                        multi=True,
+                                        style={"minWidth": "260px"}
+                                    ), width="auto"),
+                                    dbc.Col(html.Div("Depths (m):", className="font-weight-bold"), width="auto"),
+                                    dbc.Col(dcc.Input(id='export_depths', type='text', value='0, 100, 500',
+                                                      style={'width': '140px'}), width="auto"),
+                                    dbc.Col(dcc.DatePickerRange(
+                                        id='export_range',
+                                        min_date_allowed=min(self.days).astype('datetime64[D]').astype(str),
+                                        max_date_allowed=max(self.days).astype('datetime64[D]').astype(str),
+                                        start_date=(max(self.days) - np.timedelta64(6, 'D')).astype('datetime64[D]').astype(str),
+                                        end_date=max(self.days).astype('datetime64[D]').astype(str),
+                                        display_format='YYYY-MM-DD',
+                                    ), width="auto"),
+                                    dbc.Col(html.Div("Every", className="font-weight-bold"), width="auto"),
+                                    dbc.Col(dcc.Input(id='export_step', type='number', min=1, max=30, step=1, value=1,
+                                                      style={'width': '70px'}), width="auto"),
+                                    dbc.Col(html.Div("day(s)"), width="auto"),
+                                ], align='center', className='g-2'),
+                                dbc.Row([
+                                    dbc.Col(dbc.RadioItems(
+                                        id='export_format',
+                                        options=[
+                                            {'label': 'PNG per day', 'value': 'png'},
+                                            {'label': 'Animated GIF', 'value': 'gif'},
+                                        ],
+                                        value='png',
+                                        inline=True
+                                    ), width="auto"),
+                                    dbc.Col(dbc.Checklist(
+                                        id='export_extras',
+                                        options=[
+                                            {'label': 'Current transect', 'value': 'transect'},
+                                            {'label': 'Current profiles', 'value': 'profiles'},
+                                        ],
+                                        value=['transect', 'profiles'],
+                                        inline=True
+                                    ), width="auto"),
+                                    dbc.Col(dbc.Button("Prepare images (zip)", id='export_start', className="btn-modern"), width="auto"),
+                                    dbc.Col(html.Span(id='export_status', children=''), width="auto"),
+                                    dbc.Col(html.A(dbc.Button("Download zip", className="btn-modern"), id='export_link', href='',
+                                                   style={'display': 'none'}), width="auto"),
+                                ], align='center', className='g-2 mt-2'),
+                            ])
+                        )
+                    ], width=12)
+                ], className='mb-3'),
+                # The zip is written by a background job on the server; its key is polled until it is ready
+                dcc.Store(id='export_job', data=None),
+                dcc.Interval(id='export_poll', interval=1000, disabled=True),
                 dbc.Row([dbc.Col(html.Div(style={'height': '21px'}))]),
 
                 # ------------------- Custom Query (Profiles/Grid) -------------------
@@ -450,6 +707,20 @@ class NespresoStyles:
                                 rows=6,
                                 style={"minWidth":"250px", "width":"100%"}
                             ),
+                            # Bulk requests: the browser posts the file to /custom/profiles/bulk (assets/clientside.js);
+                            # the server validates and keeps it and fetches the profiles in a background job
+                            html.Div([
+                                html.Span("Or upload a CSV or Parquet file with lat, lon, date columns "),
+                                dbc.Button("Choose file", id='bulk_upload', className="btn-modern", size="sm"),
+                            ], style={'borderWidth': '1px', 'borderStyle': 'dashed', 'borderRadius': '5px',
+                                      'textAlign': 'center', 'padding': '6px', 'marginTop': '6px', 'fontSize': '13px'}),
+                            html.Div([
+                                html.Span(id='bulk_status', children='', style={'fontSize': '13px'}),
+                                html.A(dbc.Button("Download profiles (zip)", className="btn-modern", size="sm"),
+                                       id='bulk_link', href='', style={'display': 'none', 'marginLeft': '12px'}),
+                            ], style={'marginTop': '4px'}),
+                            dcc.Store(id='bulk_job', data=None),
+                            dcc.Interval(id='bulk_poll', interval=2000, disabled=True),
                         ]),
                         html.Div([
                             dbc.Button(
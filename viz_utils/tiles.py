@@ -0,0 +1,178 @@
+"""
+XYZ tiles for the NeSPReSO map fields, backed by a lazily built mean-coarsened pyramid.
+
+Tiles live in the grid's own lon/lat space (the maps are plain cartesian axes, not web-mercator).
+Zoom 0 is a single tile covering the whole grid at the coarsest pyramid level; every zoom step
+halves the tile span until tiles reach the native grid resolution at `max_zoom`.
+"""
+import hashlib
+import math
+
+import numpy as np
+
+from viz_utils.coalesce import BuildCache
+from viz_utils.raster import RasterCache, data_range, image_extent, quantize, encode_indexed_png
+
+TILE_SIZE = 256
+
+
+def block_mean(z, factor=2):
+    """NaN-aware block mean; edges that do not fill a whole block are padded with NaN."""
+    z = np.asarray(z, dtype=np.float32)
+    ny, nx = z.shape
+    py, px = (-ny) % factor, (-nx) % factor
+    if py or px:
+        z = np.pad(z, ((0, py), (0, px)), constant_values=np.nan)
+    blocks = z.reshape(z.shape[0]//factor, factor, z.shape[1]//factor, factor)
+    valid = np.isfinite(blocks)
+    counts = valid.sum(axis=(1, 3))
+    sums = np.where(valid, blocks, 0.0).sum(axis=(1, 3))
+    out = np.full(counts.shape, np.nan, dtype=np.float32)
+    np.divide(sums, counts, out=out, where=counts > 0)
+    return out
+
+
+class TileGrid:
+    """
+    Tile geometry for a regular lon/lat grid. Only needs the coordinates, so figures can list
+    the tiles for a viewport without touching the data.
+    """
+
+    def __init__(self, lons, lats, tile_size=TILE_SIZE):
+        self.lons = np.asarray(lons, dtype=float)
+        self.lats = np.asarray(lats, dtype=float)
+        self.tile_size = tile_size
+        self.ny = self.lats.size
+        self.nx = self.lons.size
+        self.lon_min, self.lon_max, self.lat_min, self.lat_max = image_extent(self.lons, self.lats)
+        self.dx = (self.lon_max - self.lon_min)/max(self.nx, 1)
+        self.dy = (self.lat_max - self.lat_min)/max(self.ny, 1)
+        self.max_zoom = max(0, int(math.ceil(math.log2(max(self.nx, self.ny, 1)/tile_size))))
+
+    def span_cells(self, z):
+        """Native grid cells covered by one tile edge at zoom z."""
+        return self.tile_size*2.0**(self.max_zoom - z)
+
+    def level_for_zoom(self, z):
+        """Pyramid level (0 = native) rendered at zoom z."""
+        return max(self.max_zoom - z, 0)
+
+    def tiles_per_axis(self, z):
+        span = self.span_cells(z)
+        return int(math.ceil(self.nx/span)), int(math.ceil(self.ny/span))
+
+    def tile_bounds(self, z, x, y):
+        """(lon_min, lon_max, lat_min, lat_max) of tile (z, x, y); y counts from the northern edge."""
+        span = self.span_cells(z)
+        lon0 = self.lon_min + x*span*self.dx
+        lat1 = self.lat_max - y*span*self.dy
+        return lon0, lon0 + span*self.dx, lat1 - span*self.dy, lat1
+
+    def zoom_for_view(self, x_range, px_width):
+        """Coarsest zoom whose tiles give at least ~1 data cell per screen pixel (capped at native)."""
+        view_cells = abs(float(x_range[1]) - float(x_range[0]))/self.dx if self.dx > 0 else self.nx
+        if view_cells <= 0 or px_width <= 0:
+            return 0
+        z = self.max_zoom + math.ceil(math.log2(px_width/view_cells))
+        return int(min(max(z, 0), self.max_zoom))
+
+    def tiles_in_view(self, z, x_range, y_range):
+        """List (x, y) of the tiles at zoom z that intersect the given lon/lat ranges."""
+        span = self.span_cells(z)
+        ntx, nty = self.tiles_per_axis(z)
+        lon0, lon1 = sorted(float(v) for v in x_range)
+        lat0, lat1 = sorted(float(v) for v in y_range)
+        x0 = int(math.floor((lon0 - self.lon_min)/(span*self.dx)))
+        x1 = int(math.floor((lon1 - self.lon_min)/(span*self.dx)))
+        y0 = int(math.floor((self.lat_max - lat1)/(span*self.dy)))
+        y1 = int(math.floor((self.lat_max - lat0)/(span*self.dy)))
+        xs = range(max(x0, 0), min(x1, ntx - 1) + 1)
+        ys = range(max(y0, 0), min(y1, nty - 1) + 1)
+        return [(x, y) for y in ys for x in xs]
+
+
+class FieldPyramid:
+    """Mean-coarsened levels of one 2D field slice, north-up, sharing one colour range."""
+
+    def __init__(self, z, lons, lats, zmin=None, zmax=None):
+        self.grid = TileGrid(lons, lats)
+        z = np.asarray(z, dtype=np.float32)
+        if self.grid.lats.size > 1 and self.grid.lats[0] < self.grid.lats[-1]:
+            z = z[::-1, :]
+        self.zmin, self.zmax = data_range(z, zmin, zmax)
+        self.levels = [z]
+        for _ in range(self.grid.max_zoom):
+            self.levels.append(block_mean(self.levels[-1], 2))
+
+    def nbytes(self):
+        return sum(level.nbytes for level in self.levels)
+
+    def tile_array(self, z, x, y):
+        """Cells of tile (z, x, y), NaN-padded to the full tile span. Returns None outside the grid."""
+        grid = self.grid
+        ntx, nty = grid.tiles_per_axis(z)
+        if z < 0 or not (0 <= x < ntx and 0 <= y < nty):
+            return None
+        level = self.levels[min(grid.level_for_zoom(z), len(self.levels) - 1)]
+        # Tile edge in cells of the chosen level (tile_size up to max_zoom, smaller beyond it)
+        span = max(int(round(grid.span_cells(z)/2**grid.level_for_zoom(z))), 1)
+        r0, c0 = y*span, x*span
+        cells = level[r0:r0 + span, c0:c0 + span]
+        if cells.shape != (span, span):
+            padded = np.full((span, span), np.nan, dtype=np.float32)
+            padded[:cells.shape[0], :cells.shape[1]] = cells
+            cells = padded
+        return cells
+
+    def render_tile(self, z, x, y, cmap):
+        cells = self.tile_array(z, x, y)
+        if cells is None:
+            return None
+        return encode_indexed_png(quantize(cells, self.zmin, self.zmax), cmap)
+
+
+class PyramidCache(BuildCache):
+    """LRU of FieldPyramid objects keyed by (field, date, depth, source version), built once per key."""
+
+    def __init__(self, maxsize=24):
+        super().__init__(maxsize)
+
+    def nbytes(self):
+        with self._lock:
+            return sum(p.nbytes() for p in self._items.values())
+
+
+pyramid_cache = PyramidCache()
+tile_cache = RasterCache(maxsize=2048)
+
+
+def tile_etag(field, date_str, depth, z, x, y, version):
+    raw = f"{field}/{date_str}/{depth}/{z}/{x}/{y}/{version}".encode()
+    return hashlib.sha1(raw).hexdigest()[:20]
+
+
+def tile_url(prefix, field, date_str, depth, z, x, y):
+    return f"{prefix.rstrip('/')}/{field}/{date_str}/{int(depth)}/{z}/{x}/{y}.png"
+
+
+def tile_images(grid, prefix, field, date_str, depth, x_range, y_range, px_width, margin=0.0):
+    """
+    Layout images referencing the tiles that cover the given view, at a zoom matched to px_width. With
+    `margin`, tiles also cover that share of the view's width/height beyond each edge, so small pans
+    show data the browser already requested.
+    """
+    z = grid.zoom_for_view(x_range, px_width)
+    (lon0, lon1), (lat0, lat1) = sorted(float(v) for v in x_range), sorted(float(v) for v in y_range)
+    pad_x, pad_y = (lon1 - lon0)*margin, (lat1 - lat0)*margin
+    images = []
+    for x, y in grid.tiles_in_view(z, [lon0 - pad_x, lon1 + pad_x], [lat0 - pad_y, lat1 + pad_y]):
+        lon0, lon1, lat0, lat1 = grid.tile_bounds(z, x, y)
+        images.append(dict(
+            source=tile_url(prefix, field, date_str, depth, z, x, y),
+            xref='x', yref='y',
+            x=lon0, y=lat1,
+            sizex=lon1 - lon0, sizey=lat1 - lat0,
+            sizing='stretch',
+            layer='below',
+        ))
+    return images
@@ -0,0 +1,190 @@
+"""
+How responses leave the server: the JSON engine used for callback outputs and HTTP compression.
+
+Dash serialises callback outputs with plotly.io.json, so selecting orjson there (it encodes numpy
+arrays natively) speeds up every figure response and the figure cache. Responses are compressed
+(brotli when installed and accepted, otherwise gzip) above a size threshold; files in assets/ are
+served from pre-compressed .br/.gz siblings written by tools/precompress_assets.py when present.
+"""
+import functools
+import gzip
+import logging
+import mimetypes
+import os
+import re
+import time
+
+import plotly.io as pio
+from flask import g, has_request_context, request, send_file
+
+from viz_utils.coalesce import BuildCache
+
+try:
+    import orjson
+except Exception:
+    orjson = None
+
+try:
+    import brotli
+except Exception:
+    brotli = None
+
+logger = logging.getLogger(__name__)
+
+COMPRESSIBLE_TYPES = ('text/', 'application/json', 'application/javascript', 'image/svg+xml')
+# File suffix of each pre-compressed asset variant
+ENCODING_SUFFIXES = {'br': '.br', 'gzip': '.gz'}
+
+# Compressed Dash component bundles (plotly.js is several MB); their paths are fingerprinted
+_bundle_cache = BuildCache(maxsize=64)
+
+
+def configure_json_engine(engine=None):
+    """
+    Select the plotly.io JSON engine used for callback outputs.
+
+    Parameters:
+    engine (str): 'orjson', 'json' or 'auto' (orjson when installed). Defaults to NESPRESO_JSON_ENGINE.
+
+    Returns:
+    str: The engine in use.
+    """
+    engine = (engine or os.environ.get('NESPRESO_JSON_ENGINE', 'auto')).lower()
+    if engine == 'auto':
+        engine = 'orjson' if orjson is not None else 'json'
+    if engine == 'orjson' and orjson is None:
+        logger.warning("orjson is not installed; using the json engine")
+        engine = 'json'
+    pio.json.config.default_engine = engine
+    return engine
+
+
+def time_json_encoding():
+    """
+    Wrap plotly.io.json.to_json_plotly, which Dash calls to serialise callback outputs, so the time
+    spent in it during a request accumulates in flask.g.json_ms.
+    """
+    encode = pio.json.to_json_plotly
+    if getattr(encode, 'nespreso_timed', False):
+        return
+
+    @functools.wraps(encode)
+    def timed_to_json_plotly(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return encode(*args, **kwargs)
+        finally:
+            if has_request_context():
+                g.json_ms = g.get('json_ms', 0.0) + (time.perf_counter() - start)*1000
+
+    timed_to_json_plotly.nespreso_timed = True
+    pio.json.to_json_plotly = timed_to_json_plotly
+
+
+def available_encodings():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+
+def negotiate_encoding(accept_encodings):
+    """Best supported encoding the client accepts (werkzeug Accept object), or None."""
+    best, best_q = None, 0
+    for encoding in available_encodings():
+        q = accept_encodings.quality(encoding)
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress(data, encoding, level=6):
+    if encoding == 'br':
+        # Brotli quality 4 compresses about as well as gzip -6 in a fraction of the time
+        return brotli.compress(data, quality=min(level, 4) if level < 10 else 11)
+    return gzip.compress(data, compresslevel=min(level, 9))
+
+
+def is_compressible(mimetype):
+    return bool(mimetype) and mimetype.startswith(COMPRESSIBLE_TYPES)
+
+
+def install_compression(server, assets_folder, assets_prefixes=('/assets/',), min_bytes=None, level=None, log=None):
+    """
+    Compress responses of `server` (a Flask app) and serve pre-compressed assets.
+
+    Parameters:
+    assets_folder (str): Directory served at the asset URL prefixes.
+    assets_prefixes (tuple): URL prefixes of the assets route (e.g. '/nespreso_viz/assets/').
+    min_bytes (int): Smaller responses go out uncompressed (NESPRESO_COMPRESS_MIN_BYTES, default 1024).
+    level (int): gzip level / brotli quality (NESPRESO_COMPRESS_LEVEL, default 6).
+    log (bool): Log bytes-on-wire and timings per compressed response (NESPRESO_HTTP_LOG, default on):
+        JSON encoding of callback outputs, compression and the whole request.
+    """
+    min_bytes = int(os.environ.get('NESPRESO_COMPRESS_MIN_BYTES', '1024')) if min_bytes is None else min_bytes
+    level = int(os.environ.get('NESPRESO_COMPRESS_LEVEL', '6')) if level is None else level
+    log = os.environ.get('NESPRESO_HTTP_LOG', '1') != '0' if log is None else log
+    assets_folder = os.path.realpath(assets_folder)
+    if log:
+        time_json_encoding()
+    asset_regex = re.compile('^(?:' + '|'.join(re.escape(p) for p in assets_prefixes) + ')(.+)$')
+
+    @server.before_request
+    def _start_timer():
+        g.request_start = time.perf_counter()
+        if request.method != 'GET':
+            return None
+        m = asset_regex.match(request.path)
+        if not m:
+            return None
+        return _precompressed_asset(m.group(1))
+
+    def _precompressed_asset(rel_path):
+        source = os.path.realpath(os.path.join(assets_folder, rel_path))
+        if not source.startswith(assets_folder + os.sep) or not os.path.isfile(source):
+            return None
+        encoding = negotiate_encoding(request.accept_encodings)
+        if encoding is None:
+            return None
+        variant = source + ENCODING_SUFFIXES[encoding]
+        try:
+            if os.stat(variant).st_mtime < os.stat(source).st_mtime:
+                return None
+        except OSError:
+            return None
+        response = send_file(variant, mimetype=mimetypes.guess_type(source)[0] or 'application/octet-stream',
+                             conditional=True, etag=True)
+        response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        return response
+
+    @server.after_request
+    def _compress_response(response):
+        if (response.status_code != 200 or 'Content-Encoding' in response.headers
+                or not is_compressible(response.mimetype)):
+            return response
+        response.vary.add('Accept-Encoding')
+        encoding = negotiate_encoding(request.accept_encodings)
+        if encoding is None:
+            return response
+        if response.direct_passthrough:
+            # Files (send_file) stream by default; read them into memory to compress
+            response.direct_passthrough = False
+        data = response.get_data()
+        if len(data) < min_bytes:
+            return response
+        start = time.perf_counter()
+        if '/_dash-component-suites/' in request.path:
+            body = _bundle_cache.get_or_build((request.path, encoding), lambda: compress(data, encoding, level))
+        else:
+            body = compress(data, encoding, level)
+        compress_ms = (time.perf_counter() - start)*1000
+        response.set_data(body)
+        response.headers['Content-Encoding'] = encoding
+        if response.get_etag()[0]:
+            # A compressed body needs its own validator
+            tag, weak = response.get_etag()
+            response.set_etag(f"{tag}-{encoding}", weak=weak)
+        if log:
+            total_ms = (time.perf_counter() - g.get('request_start', start))*1000
+            logger.info("method=%s path=%s bytes=%d wire_bytes=%d encoding=%s json_ms=%.1f compress_ms=%.1f total_ms=%.1f",
+                        request.method, request.path, len(data), len(body), encoding, g.get('json_ms', 0.0),
+                        compress_ms, total_ms)
+        return response
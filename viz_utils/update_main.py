@@ -3,6 +3,9 @@ import plotly.graph_objs as go
 import cmocean.cm as cm
 import xarray as xr
 from viz_utils.styles import NespresoStyles
+from viz_utils.raster import data_range, render_png, png_data_uri, image_extent, image_cache
+from viz_utils.tiles import TileGrid, tile_images, block_mean
+from viz_utils.fastfig import FigureBuilder, dict_figures_enabled
 import os
 import json
 from datetime import datetime
@@ -16,7 +19,124 @@ except Exception:  # Optional dependency; figures will still render without coas
     LineString = None
     MultiLineString = None
     box = None
-# from viz_utils.ocean_utils import *
+from viz_utils.ocean_utils import derived_fields
+
+# Map fields served as figures, image layers and tiles: dataset variable, colormap and display conversion
+MAP_FIELDS = {
+    'AVISO': dict(var='AVISO', cmap=cm.curl, offset=0.0, decimals=None, has_depth=False,
+                  hovertemplate='Lat: %{y}<br>Lon: %{x}<br>ADT: %{z:.2f} m<extra></extra>', colorbar_title='ADT [m]'),
+    'SST': dict(var='SST', cmap=cm.thermal, offset=-273.15, decimals=2, has_depth=False,
+                hovertemplate='Lat: %{y}<br>Lon: %{x}<br>Temp: %{z:.2f} °C<extra></extra>', colorbar_title='SST [°C]'),
+    'SSS': dict(var='SSS', cmap=cm.haline, offset=0.0, decimals=None, has_depth=False,
+                hovertemplate='Lat: %{y}<br>Lon: %{x}<br>Salt: %{z:.2f} PSU<extra></extra>', colorbar_title='SSS [PSU]'),
+    'Temperature': dict(var='Temperature', cmap=cm.thermal, offset=0.0, decimals=2, has_depth=True,
+                        hovertemplate='Lat: %{y}<br>Lon: %{x}<br>Temp: %{z:.2f} °C<extra></extra>', colorbar_title='Temperature [°C]'),
+    'Salinity': dict(var='Salinity', cmap=cm.haline, offset=0.0, decimals=None, has_depth=True,
+                     hovertemplate='Lat: %{y}<br>Lon: %{x}<br>Salt: %{z:.2f} PSU<extra></extra>', colorbar_title='Salinity [PSU]'),
+}
+
+# Satellite maps, in the order of the fig_aviso/fig_SST/fig_SSS slots
+SATELLITE_FIELDS = ('AVISO', 'SST', 'SSS')
+
+def to_display_units(values, field):
+    """Apply the display conversion of a MAP_FIELDS entry (e.g. SST Kelvin to °C) to raw values."""
+    spec = MAP_FIELDS[field]
+    if spec['offset']:
+        values = values + spec['offset']
+    if spec['decimals'] is not None:
+        values = np.round(values, spec['decimals'])
+    return values
+
+def read_map_slice(data: xr.Dataset, field, depth_idx=0, time_idx=0):
+    """
+    Read a single 2D (lat, lon) slice of a map field from a (lazily opened) dataset, in display units.
+    Only the requested time/depth level is read from disk.
+    """
+    spec = MAP_FIELDS[field]
+    var = data[spec['var']]
+    sel = {}
+    if 'time' in var.dims:
+        sel['time'] = min(int(time_idx), var.sizes['time'] - 1)
+    if spec['has_depth'] and 'depth' in var.dims:
+        sel['depth'] = min(max(int(depth_idx), 0), var.sizes['depth'] - 1)
+    values = np.asarray(var.isel(sel).values, dtype=np.float32)
+    return to_display_units(values, field)
+
+# Derived 2D products (see ocean_utils.derived_fields) shown in the derived-products panel
+DERIVED_MAPS = {
+    'MLD': dict(title="Mixed Layer Depth", cmap=cm.deep, colorbar_title='MLD [m]',
+                hovertemplate='Lat: %{y}<br>Lon: %{x}<br>MLD: %{z:.0f} m<extra></extra>'),
+    'D26': dict(title="Depth of the 26 °C isotherm", cmap=cm.deep, colorbar_title='D26 [m]',
+                hovertemplate='Lat: %{y}<br>Lon: %{x}<br>D26: %{z:.0f} m<extra></extra>'),
+    'D20': dict(title="Depth of the 20 °C isotherm", cmap=cm.deep, colorbar_title='D20 [m]',
+                hovertemplate='Lat: %{y}<br>Lon: %{x}<br>D20: %{z:.0f} m<extra></extra>'),
+    'TCHP': dict(title="Tropical Cyclone Heat Potential", cmap=cm.amp, colorbar_title='TCHP [kJ/cm²]',
+                 hovertemplate='Lat: %{y}<br>Lon: %{x}<br>TCHP: %{z:.1f} kJ/cm²<extra></extra>'),
+}
+
+# Deepest level [m] the derived products integrate to, live and in the precomputed sidecars
+DERIVED_MAX_DEPTH = 500.0
+
+def compute_derived_maps(data: xr.Dataset, time_idx=0, max_depth=DERIVED_MAX_DEPTH):
+    """
+    Compute the DERIVED_MAPS products for one time step of a dataset.
+    Temperature/Salinity are read lazily, one block of latitude rows at a time.
+    """
+    temp = data['Temperature']
+    sal = data['Salinity']
+    if 'time' in temp.dims:
+        temp = temp.isel(time=min(int(time_idx), temp.sizes['time'] - 1))
+        sal = sal.isel(time=min(int(time_idx), sal.sizes['time'] - 1))
+    temp = temp.transpose('depth', 'lat', 'lon')
+    sal = sal.transpose('depth', 'lat', 'lon')
+    return derived_fields(temp, sal, data['depth'].values, data['lat'].values, data['lon'].values, max_depth=max_depth)
+
+
+# Default map extent, and the share of the viewport width/height shipped beyond each edge so small pans
+# need no new figure
+DEFAULT_BBOX = dict(lon_min=-102, lon_max=-78, lat_min=17, lat_max=31)
+VIEW_MARGIN = 0.1
+
+def viewport_needs_render(viewport, shipped, margin=VIEW_MARGIN, zoom_factor=2.0):
+    """
+    Whether a map built for the viewport `shipped` (None: the full grid) must be rebuilt to show `viewport`
+    (None: reset to the default extent): the view left the shipped window plus margin, or zoomed in more
+    than `zoom_factor` times, so the decimated data (or tile level) is too coarse.
+    """
+    if viewport is None:
+        return shipped is not None
+    x0, x1 = sorted(float(v) for v in viewport['x'])
+    y0, y1 = sorted(float(v) for v in viewport['y'])
+    if shipped is None:
+        return (x1 - x0) < (DEFAULT_BBOX['lon_max'] - DEFAULT_BBOX['lon_min'])/zoom_factor
+    s0, s1 = sorted(float(v) for v in shipped['x'])
+    t0, t1 = sorted(float(v) for v in shipped['y'])
+    pad_x, pad_y = (s1 - s0)*margin, (t1 - t0)*margin
+    if x0 < s0 - pad_x or x1 > s1 + pad_x or y0 < t0 - pad_y or y1 > t1 + pad_y:
+        return True
+    return (x1 - x0) < (s1 - s0)/zoom_factor
+
+def viewport_from_relayout(relayout_data, previous=None):
+    """
+    Extract axis ranges from a map's relayoutData.
+
+    Returns:
+    dict or None: {'x': [lon0, lon1], 'y': [lat0, lat1]}; None after an autorange reset;
+    `previous` unchanged when the event carries no range information (e.g. a drawn shape).
+    """
+    if not relayout_data:
+        return previous
+    if relayout_data.get('xaxis.autorange'):
+        return None
+    viewport = dict(previous) if previous else {}
+    for axis, key in (('xaxis', 'x'), ('yaxis', 'y')):
+        if f'{axis}.range[0]' in relayout_data and f'{axis}.range[1]' in relayout_data:
+            viewport[key] = [float(relayout_data[f'{axis}.range[0]']), float(relayout_data[f'{axis}.range[1]'])]
+        elif isinstance(relayout_data.get(f'{axis}.range'), (list, tuple)):
+            viewport[key] = [float(v) for v in relayout_data[f'{axis}.range'][:2]]
+    if 'x' not in viewport or 'y' not in viewport:
+        return previous
+    return viewport
 
 class MainFigures:
     def __init__(self, data: xr.Dataset, styles: NespresoStyles):
@@ -57,40 +177,73 @@ class MainFigures:
         else:
             self.sal_err = np.zeros_like(self.sal)
             
-        # MLD/OHC/Isotherm removed per latest dataset capabilities
+        # MLD/OHC/Isotherm maps are computed on demand by compute_derived_maps (see update_derived_map)
             
         self.lats = data['lat'].values
         self.lons = data['lon'].values
         self.depths = data['depth'].values  # Add this line
         self.styles = styles
 
+        # 'heatmap' sends the full grid as a go.Heatmap; 'raster' sends a server-rendered PNG layer;
+        # 'tiles' references PNG tiles from the /nespreso_viz/tiles route for the visible area
+        self.render_mode = os.environ.get('NESPRESO_MAP_RENDER', 'heatmap').lower()
+        # Approximate number of hover cells per axis kept on top of raster layers
+        self.hover_cells = int(os.environ.get('NESPRESO_RASTER_HOVER_CELLS', '80'))
+        self.tile_url_prefix = os.environ.get('NESPRESO_TILE_URL_PREFIX', '/nespreso_viz/tiles')
+        # Approximate on-screen width of a map in pixels, used to pick the tile zoom level
+        self.map_px = int(os.environ.get('NESPRESO_MAP_PX', '800'))
+        self.tile_grid = TileGrid(self.lons, self.lats)
+        # Plain-dict figures skip graph_objs validation (NESPRESO_DICT_FIGURES, see viz_utils/fastfig.py)
+        self.fig = FigureBuilder(plain=dict_figures_enabled('maps'))
+
         # Pre-compute coastline traces for the default bbox
-        self.bbox = dict(lon_min=-102, lon_max=-78, lat_min=17, lat_max=31)
+        self.bbox = dict(DEFAULT_BBOX)
         # Prefer local prebaked coastlines if available for reliability (no runtime downloads)
         self.coastline_traces = self._load_prebaked_coastlines(self.bbox)
         if not self.coastline_traces:
             self.coastline_traces = self._generate_coastline_traces(self.bbox)
+        if self.fig.plain:
+            # Converted once per day instead of on every figure
+            self.coastline_traces = [t.to_plotly_json() for t in self.coastline_traces]
 
-        # Calculate pressure for first 200 mts
-        # th = 100
-        # pressure = calculate_ocean_pressure(self.temp[:,:,:,:th], self.sal[:,:,:,:th], self.depths[:th])
-        # self.mld = get_mld(self.sal[:,:,:,:th], self.temp[:,:,:,:th], pressure[:,:,:,:th])
-
-    def make_figure(self, data, prof_locations_scatter, colorscheme, title, hovertemplate, colorbar_title, zmin=None, zmax=None):
-        heatmap_trace = go.Heatmap(
-            z=data,
-            colorscale=self.styles.cmocean_to_plotly(colorscheme, 256),
-            showscale=True,
-            x=self.lons,
-            y=self.lats,
-            hovertemplate=hovertemplate,
-            colorbar=dict(title={'text': colorbar_title, 'side': 'right'}, thickness=12, lenmode='fraction', len=0.88, y=0.5, x=1.0, xpad=0),
-            zmin=zmin,
-            zmax=zmax,
-        )
+    def make_figure(self, data, prof_locations_scatter, colorscheme, title, hovertemplate, colorbar_title, zmin=None, zmax=None, cache_key=None, viewport=None):
+        """
+        Build a map figure for a 2D (lat, lon) slice.
+
+        Parameters:
+        cache_key (tuple): (date, field, time index, depth) identifying the slice, used by the raster/tiles modes.
+        viewport (dict): Current axis ranges {'x': [lon0, lon1], 'y': [lat0, lat1]}; None for the default extent.
+        """
+        # Colour limits always come from the full slice so zooming does not shift the colours
+        zmin, zmax = data_range(data, zmin, zmax)
+        x_range, y_range = self._view_ranges(viewport)
+        images = []
+        if self.render_mode == 'tiles' and cache_key is not None and cache_key[1] in MAP_FIELDS:
+            z, lons, lats = self._view_subset(data, viewport)
+            heatmap_trace = self._hover_trace(z, lons, lats, hovertemplate)
+            date_str, field, _, depth = cache_key
+            # Tiles for the shipped window; a pan or zoom beyond it rebuilds the figure with new ones
+            images = tile_images(self.tile_grid, self.tile_url_prefix, field, date_str, depth, x_range, y_range, self.map_px,
+                                 margin=VIEW_MARGIN)
+        elif self.render_mode in ('raster', 'tiles'):
+            z, lons, lats = self._view_subset(data, viewport)
+            if cache_key is not None and viewport:
+                cache_key = tuple(cache_key) + (tuple(x_range), tuple(y_range))
+            heatmap_trace, images = self._raster_layer(z, lons, lats, colorscheme, hovertemplate, zmin, zmax, cache_key)
+        else:
+            z, lons, lats = self._view_subset(data, viewport)
+            heatmap_trace = self.fig.trace(
+                'heatmap',
+                z=z,
+                coloraxis='coloraxis',
+                x=lons,
+                y=lats,
+                hovertemplate=hovertemplate,
+            )
 
         # Invisible corners to enforce reset axes ranges
-        corner_trace = go.Scatter(
+        corner_trace = self.fig.trace(
+            'scatter',
             x=[self.bbox['lon_min'], self.bbox['lon_max']],
             y=[self.bbox['lat_min'], self.bbox['lat_max']],
             mode='markers',
@@ -106,15 +259,17 @@ class MainFigures:
             traces.extend(self.coastline_traces)
         traces.append(prof_locations_scatter)
 
-        cur_fig = go.Figure(
+        cur_fig = self.fig.figure(
             data=traces,
-            layout=go.Layout(
+            layout=dict(
                 title=dict(text=title, font=dict(family=self.styles.font_family, size=self.styles.font_sizes['title']), y=0.98),
                 xaxis=dict(
                     # title=dict(text="Longitude", font=dict(family=self.styles.font_family, size=self.styles.font_sizes['axis_title'])),
                     title=dict(text=""),
                     tickfont=dict(size=self.styles.font_sizes['tick']),
-                    range=[self.bbox['lon_min'], self.bbox['lon_max']],
+                    range=x_range,
+                    # Keeps the user's pan/zoom when a figure is rebuilt for the same shipped window
+                    uirevision='view',
                     constrain='domain',
                     automargin=True,
                     gridcolor='rgba(0,0,0,0.05)',
@@ -125,17 +280,20 @@ class MainFigures:
                     # title=dict(text="Latitude", font=dict(family=self.styles.font_family, size=self.styles.font_sizes['axis_title'])),
                     title=dict(text=""),
                     tickfont=dict(size=self.styles.font_sizes['tick']),
-                    range=[self.bbox['lat_min'], self.bbox['lat_max']],
+                    range=y_range,
+                    uirevision='view',
                     scaleanchor='x', scaleratio=1, constrain='domain',
                     automargin=True,
                     gridcolor='rgba(0,0,0,0.05)',
                     zeroline=False,
                     linecolor='rgba(0,0,0,0.15)'
                 ),
+                coloraxis=self.styles.coloraxis(colorscheme, colorbar_title, zmin, zmax),
                 dragmode="pan",
                 height=self.styles.fig_height,
                 margin=self.styles.margins,
                 shapes=[],
+                images=images,
                 paper_bgcolor=self.styles.paper_bgcolor,
                 plot_bgcolor=self.styles.plot_bgcolor,
                 font=dict(family=self.styles.font_family, size=self.styles.font_sizes['base']),
@@ -145,6 +303,103 @@ class MainFigures:
 
         return cur_fig
 
+    def _view_ranges(self, viewport):
+        """Axis ranges for the figure: the user's viewport if known, else the default bbox."""
+        if viewport and viewport.get('x') and viewport.get('y'):
+            return [float(v) for v in viewport['x']], [float(v) for v in viewport['y']]
+        return [self.bbox['lon_min'], self.bbox['lon_max']], [self.bbox['lat_min'], self.bbox['lat_max']]
+
+    def _view_subset(self, data, viewport, margin=VIEW_MARGIN):
+        """
+        Slice a (lat, lon) field to the visible window plus a margin and block-mean decimate it to about
+        `self.map_px` columns. Zoomed-in windows narrower than that keep the native resolution.
+
+        Returns:
+        tuple: (z, lons, lats)
+        """
+        data = np.asarray(data)
+        lons, lats = self.lons, self.lats
+        if viewport and viewport.get('x') and viewport.get('y'):
+            x0, x1 = sorted(float(v) for v in viewport['x'])
+            y0, y1 = sorted(float(v) for v in viewport['y'])
+            pad_x, pad_y = (x1 - x0)*margin, (y1 - y0)*margin
+            cols = np.flatnonzero((lons >= x0 - pad_x) & (lons <= x1 + pad_x))
+            rows = np.flatnonzero((lats >= y0 - pad_y) & (lats <= y1 + pad_y))
+            if cols.size > 1 and rows.size > 1:
+                data = data[rows[0]:rows[-1] + 1, cols[0]:cols[-1] + 1]
+                lons = lons[cols[0]:cols[-1] + 1]
+                lats = lats[rows[0]:rows[-1] + 1]
+        factor = int(np.ceil(lons.size/max(self.map_px, 1)))
+        if factor > 1:
+            data = block_mean(data, factor)
+            lons = block_mean(lons[np.newaxis, :], factor)[0] if lons.size >= factor else lons
+            lats = block_mean(lats[:, np.newaxis], factor)[:, 0] if lats.size >= factor else lats
+        return data, lons, lats
+
+    def _raster_layer(self, data, lons, lats, colorscheme, hovertemplate, zmin, zmax, cache_key=None):
+        """
+        Build the image layer and sparse hover grid that replace the full heatmap in raster mode.
+
+        Parameters:
+        data (np.ndarray): 2D (lat, lon) slice on the lons/lats grid.
+        cache_key (tuple): (date, field, depth) identifying the slice; rendered images are reused per key.
+
+        Returns:
+        tuple: (hover heatmap trace, list with the layout image)
+        """
+        data = np.asarray(data)
+        key = None if cache_key is None else tuple(cache_key) + (zmin, zmax, data.shape)
+        source = image_cache.get(key) if key is not None else None
+        if source is None:
+            north_up = bool(lats[0] < lats[-1]) if lats.size > 1 else True
+            source = png_data_uri(render_png(data, colorscheme, zmin, zmax, north_up=north_up))
+            if key is not None:
+                image_cache.put(key, source)
+
+        lon_min, lon_max, lat_min, lat_max = image_extent(lons, lats)
+        image = dict(
+            source=source,
+            xref='x', yref='y',
+            x=lon_min, y=lat_max,
+            sizex=lon_max - lon_min, sizey=lat_max - lat_min,
+            sizing='stretch',
+            layer='below',
+        )
+
+        return self._hover_trace(data, lons, lats, hovertemplate), [image]
+
+    def _hover_trace(self, data, lons, lats, hovertemplate):
+        """Transparent, decimated heatmap that keeps hover readouts (and the colorbar) without shipping the full grid."""
+        data = np.asarray(data)
+        stride = max(1, int(np.ceil(max(data.shape)/max(self.hover_cells, 1))))
+        return self.fig.trace(
+            'heatmap',
+            z=data[::stride, ::stride],
+            x=lons[::stride],
+            y=lats[::stride],
+            coloraxis='coloraxis',
+            opacity=0,
+            hovertemplate=hovertemplate,
+        )
+
+    def _profile_markers(self, prof_loc):
+        """Scatter trace marking the selected profile locations (empty trace if none)."""
+        if not prof_loc:
+            return self.fig.trace('scatter')
+        return self.fig.trace(
+            'scatter',
+            x=[loc[1] for loc in prof_loc],
+            y=[loc[0] for loc in prof_loc],
+            mode='markers',
+            marker=dict(
+                color=self.styles.color_cycle(len(prof_loc)),
+                size=10,
+                symbol='circle'
+            ),
+            name='Profile Locations',
+            showlegend=False
+        )
+
     def _generate_coastline_traces(self, bbox):
         if cfeature is None or shpreader is None or box is None:
             return []
@@ -333,72 +588,79 @@ class MainFigures:
         except Exception:
             return []
 
-    def update_satellite_figures(self, prof_loc, date_idx, trans_lines, cur_date_str):
-        if not prof_loc:
-            prof_locations = go.Scatter()
-        else:
-            prof_locations = go.Scatter(
-                        x=[loc[1] for loc in prof_loc],
-                        y=[loc[0] for loc in prof_loc],
-                        mode='markers',
-                        marker=dict(
-                            color=self.styles.colors[:len(prof_loc)],
-                            size=10,
-                            symbol='circle'
-                        ),
-                        name='Profile Locations',
-                        showlegend=False
-                    )
+    def update_satellite_figures(self, prof_loc, date_idx, trans_lines, cur_date_str, viewports=None, fields=SATELLITE_FIELDS):
+        """
+        Build the satellite maps.
+
+        Parameters:
+        fields (iterable): Fields to build; the others come back as None (e.g. hidden slots in single-map mode).
+
+        Returns:
+        list: [fig_aviso, fig_SST, fig_SSS]
+        """
+        viewports = viewports or {}
+        prof_locations = self._profile_markers(prof_loc)
+        fig_aviso = fig_SST = fig_SSS = None
 
         # -------------------------- AVISO -------------------------------
-        adt_title = "CMEMS ADT"
-        try:
-            if isinstance(cur_date_str, str) and len(cur_date_str) == 10:
-                dt = datetime.strptime(cur_date_str, '%Y-%m-%d')
-                if dt >= datetime(2024, 11, 1):
-                    adt_title += " (derived from SSH)"
-        except Exception:
-            pass
-        fig_aviso = self.make_figure(
-            self.aviso[date_idx, :, :],
-            prof_locations,
-            cm.curl,
-            adt_title,
-            'Lat: %{y}<br>Lon: %{x}<br>ADT: %{z:.2f} m<extra></extra>',
-            'ADT [m]'
-        )
+        if 'AVISO' in fields:
+            adt_title = "CMEMS ADT"
+            try:
+                if isinstance(cur_date_str, str) and len(cur_date_str) == 10:
+                    dt = datetime.strptime(cur_date_str, '%Y-%m-%d')
+                    if dt >= datetime(2024, 11, 1):
+                        adt_title += " (derived from SSH)"
+            except Exception:
+                pass
+            fig_aviso = self.make_figure(
+                self.aviso[date_idx, :, :],
+                prof_locations,
+                cm.curl,
+                adt_title,
+                'Lat: %{y}<br>Lon: %{x}<br>ADT: %{z:.2f} m<extra></extra>',
+                'ADT [m]',
+                cache_key=(cur_date_str, 'AVISO', date_idx, 0),
+                viewport=viewports.get('AVISO')
+            )
 
         # -------------------------- SST -------------------------------
-        fig_SST = self.make_figure(
-            np.round(self.SST[date_idx,:,:] - 273.15, 2),
-            prof_locations,
-            cm.thermal,
-            f"OISST SST",
-            'Lat: %{y}<br>Lon: %{x}<br>Temp: %{z:.2f} °C<extra></extra>',
-            'SST [°C]'
-        )
+        if 'SST' in fields:
+            fig_SST = self.make_figure(
+                to_display_units(self.SST[date_idx,:,:], 'SST'),
+                prof_locations,
+                cm.thermal,
+                f"OISST SST",
+                'Lat: %{y}<br>Lon: %{x}<br>Temp: %{z:.2f} °C<extra></extra>',
+                'SST [°C]',
+                cache_key=(cur_date_str, 'SST', date_idx, 0),
+                viewport=viewports.get('SST')
+            )
         # -------------------------- SSS -------------------------------
-        fig_SSS = self.make_figure(
-            self.SSS[date_idx,:,:],
-            prof_locations,
-            cm.haline,
-            f"SMAP SSS",
-            'Lat: %{y}<br>Lon: %{x}<br>Salt: %{z:.2f} PSU<extra></extra>',
-            'SSS [PSU]'
-        )
+        if 'SSS' in fields:
+            fig_SSS = self.make_figure(
+                self.SSS[date_idx,:,:],
+                prof_locations,
+                cm.haline,
+                f"SMAP SSS",
+                'Lat: %{y}<br>Lon: %{x}<br>Salt: %{z:.2f} PSU<extra></extra>',
+                'SSS [PSU]',
+                cache_key=(cur_date_str, 'SSS', date_idx, 0),
+                viewport=viewports.get('SSS')
+            )
 
         # Customize the figures as needed based on control_value and the data
 
         # ----------- Updates the figures with the last transect line drawn -----------
         # if trans_lines is not an empty array
+        figs = [fig_aviso, fig_SST, fig_SSS]
         if trans_lines != []:
-            fig_aviso['layout']['shapes'] = [trans_lines]
-            fig_SST['layout']['shapes'] = [trans_lines]
-            fig_SSS['layout']['shapes'] = [trans_lines]
+            for fig in figs:
+                if fig is not None:
+                    fig['layout']['shapes'] = [trans_lines]
 
-        return [fig_aviso, fig_SST, fig_SSS]
+        return figs
 
-    def update_nespreso_maps(self, prof_loc, date_idx, depth_idx, trans_lines, cur_date_str):
+    def update_nespreso_maps(self, prof_loc, date_idx, depth_idx, trans_lines, cur_date_str, viewports=None):
         """
         Update the metric figures based on the given parameters.
 
@@ -407,25 +669,13 @@ class MainFigures:
         date_idx (int): Index of the current date.
         trans_lines (list): List of transect lines.
         cur_date_str (str): Current date string.
+        viewports (dict): Optional axis ranges per field ('Temperature', 'Salinity'), see make_figure.
 
         Returns:
         list: List of updated metric figures.
         """
-        if not prof_loc:
-            prof_locations = go.Scatter()
-        else:
-            prof_locations = go.Scatter(
-                x=[loc[1] for loc in prof_loc],
-                y=[loc[0] for loc in prof_loc],
-                mode='markers',
-                marker=dict(
-                    color=self.styles.colors[:len(prof_loc)],
-                    size=10,
-                    symbol='circle'
-                ),
-                name='Profile Locations',
-                showlegend=False
-            )
+        viewports = viewports or {}
+        prof_locations = self._profile_markers(prof_loc)
 
         # -------------------------- Temp -------------------------------
         # depth_idx may exceed range; coerce safely
@@ -435,12 +685,14 @@ class MainFigures:
         if depth_idx >= self.depths.shape[0]:
             depth_idx = self.depths.shape[0] - 1
         fig_temp = self.make_figure(
-            np.round(self.temp[date_idx,depth_idx,:,:], 2),
+            to_display_units(self.temp[date_idx,depth_idx,:,:], 'Temperature'),
             prof_locations,
             cm.thermal,
             f"Synthetic T @ {depth_idx} m",
             'Lat: %{y}<br>Lon: %{x}<br>Temp: %{z:.2f} °C<extra></extra>',
-            'Temperature [°C]'
+            'Temperature [°C]',
+            cache_key=(cur_date_str, 'Temperature', date_idx, depth_idx),
+            viewport=viewports.get('Temperature')
         )
         # -------------------------- Sal -------------------------------
         fig_sal = self.make_figure(
@@ -449,7 +701,9 @@ class MainFigures:
             cm.haline,
             f"Synthetic S @ {depth_idx} m",
             'Lat: %{y}<br>Lon: %{x}<br>Salt: %{z:.2f} PSU<extra></extra>',
-            'Salinity [PSU]'
+            'Salinity [PSU]',
+            cache_key=(cur_date_str, 'Salinity', date_idx, depth_idx),
+            viewport=viewports.get('Salinity')
         )
         # -------------------------- Temp Error -------------------------------
         # fig_temp_err = self.make_figure(np.round(self.temp_err[date_idx,depth_idx,:,:], 2), prof_locations, cm.thermal, 
@@ -469,3 +723,30 @@ class MainFigures:
             # fig_sal_err['layout']['shapes'] = [trans_lines]
 
         return [fig_temp, fig_sal]
+
+    def update_derived_map(self, product, derived_maps, prof_loc, trans_lines, cur_date_str, viewport=None):
+        """
+        Build the figure for one derived product.
+
+        Parameters:
+        product (str): Key of DERIVED_MAPS ('MLD', 'D26', 'D20', 'TCHP').
+        derived_maps (dict): Output of compute_derived_maps for the current date.
+        viewport (dict): Optional axis ranges, see make_figure.
+        """
+        if product not in DERIVED_MAPS:
+            product = 'MLD'
+        spec = DERIVED_MAPS[product]
+        prof_locations = self._profile_markers(prof_loc)
+        fig = self.make_figure(
+            derived_maps[product],
+            prof_locations,
+            spec['cmap'],
+            spec['title'],
+            spec['hovertemplate'],
+            spec['colorbar_title'],
+            cache_key=(cur_date_str, product, 0, 0),
+            viewport=viewport
+        )
+        if trans_lines:
+            fig['layout']['shapes'] = [trans_lines]
+        return fig
@@ -1,5 +1,73 @@
+import os
+import json
 import numpy as np
-import plotly.graph_objs as go
+from viz_utils.fastfig import FigureBuilder, dict_figures_enabled
+from viz_utils.coalesce import BuildCache
+from viz_utils.regions import region_mask, region_statistics
+
+# Colour of the region-averaged profiles (box/lasso selection on the maps)
+REGION_COLOR = '#222222'
+
+# Percentile envelopes drawn in aggregate mode (outer band first), around the median
+ENVELOPE_PERCENTILES = ((10, 90), (25, 75))
+
+def minmax_decimate(values, n_buckets):
+    """
+    Shape-preserving decimation of profiles along depth: every bucket of consecutive levels keeps
+    the levels holding its minimum and maximum value, so spikes and inversions survive.
+
+    Parameters:
+    values (np.ndarray): (depth, profile) array.
+    n_buckets (int): Number of depth buckets, about the plot height in pixels.
+
+    Returns:
+    np.ndarray: (kept, profile) array of depth indices, increasing down each column.
+    """
+    values = np.asarray(values, dtype=float)
+    nd, n = values.shape
+    if n_buckets <= 0 or nd <= 2*n_buckets:
+        return np.repeat(np.arange(nd)[:, np.newaxis], n, axis=1)
+    size = int(np.ceil(nd/n_buckets))
+    nb = int(np.ceil(nd/size))
+    padded = np.full((nb*size, n), np.nan)
+    padded[:nd] = values
+    blocks = padded.reshape(nb, size, n)
+    # All-NaN buckets (below the sea floor) keep their first level
+    empty = np.isnan(blocks).all(axis=1, keepdims=True)
+    low = np.where(empty, 0.0, np.where(np.isnan(blocks), np.inf, blocks)).argmin(axis=1)
+    high = np.where(empty, 0.0, np.where(np.isnan(blocks), -np.inf, blocks)).argmax(axis=1)
+    offsets = (np.arange(nb)*size)[:, np.newaxis]
+    keep = np.sort(np.stack([low + offsets, high + offsets], axis=1), axis=1).reshape(2*nb, n)
+    return np.minimum(keep, nd - 1)
+
+def nan_percentiles(values, percentiles):
+    """
+    Linear-interpolated percentiles along axis 1 ignoring NaNs, for all rows at once
+    (np.nanpercentile falls back to a per-row loop when NaNs are present).
+
+    Returns:
+    dict: percentile -> (rows,) array, NaN for rows without valid values.
+    """
+    ordered = np.sort(np.asarray(values, dtype=float), axis=1)  # NaNs sort last
+    counts = np.isfinite(ordered).sum(axis=1)
+    rows = np.arange(ordered.shape[0])
+    result = {}
+    for q in percentiles:
+        pos = (q/100.0)*np.maximum(counts - 1, 0)
+        lo = np.floor(pos).astype(int)
+        hi = np.minimum(lo + 1, np.maximum(counts - 1, 0))
+        frac = pos - lo
+        value = ordered[rows, lo]*(1 - frac) + ordered[rows, hi]*frac
+        result[q] = np.where(counts > 0, value, np.nan)
+    return result
+
+def hex_to_rgba(hex_color: str, alpha: float) -> str:
+    # Helper to convert hex color to RGBA with custom alpha for line styling
+    hex_color = hex_color.lstrip('#')
+    r = int(hex_color[0:2], 16)
+    g = int(hex_color[2:4], 16)
+    b = int(hex_color[4:6], 16)
+    return f'rgba({r}, {g}, {b}, {alpha})'
 
 class Profiles:
     def __init__(self, data, styles):
@@ -18,11 +86,102 @@ class Profiles:
         self.depths = data['depth'].values  # Add this line
         self.styles = styles# Add this line
 
-    def update_profiles(self, prof_loc, date_idx, depth_type, cur_date_str, main_depth_idx):
+        # Above this many locations the panels show the median and percentile envelopes instead of every profile
+        self.aggregate_threshold = int(os.environ.get('NESPRESO_PROFILE_AGGREGATE', '50'))
+        # Profiles are decimated to about one min/max pair per pixel row of the plot area
+        self.fig_height = int(self.styles.fig_height*1.1)
+        self.plot_px = self.fig_height - self.styles.margins['t'] - self.styles.margins['b']
+        self._region_cache = BuildCache(maxsize=8)
+        self.fig = FigureBuilder(plain=dict_figures_enabled('profiles'))
+
+    def extract_profiles(self, prof_loc, date_idx, depth_idx):
+        """
+        Nearest-grid-point T and S profiles for all locations at once.
+
+        Returns:
+        tuple: (temp, sal) as (depth, location) arrays.
+        """
+        locs = np.asarray(prof_loc, dtype=float).reshape(-1, 2)
+        lat_idx = np.abs(self.lats[np.newaxis, :] - locs[:, :1]).argmin(axis=1)
+        lon_idx = np.abs(self.lons[np.newaxis, :] - locs[:, 1:]).argmin(axis=1)
+        temp = self.temp[date_idx, depth_idx][:, lat_idx, lon_idx]
+        sal = self.sal[date_idx, depth_idx][:, lat_idx, lon_idx]
+        return temp, sal
+
+    def profile_traces(self, profiles, depths, loc_names, colors, hovertemplate):
+        """One WebGL trace per location, decimated to the plot height."""
+        keep = minmax_decimate(profiles, self.plot_px)
+        cols = np.arange(profiles.shape[1])[np.newaxis, :]
+        values = profiles[keep, cols]
+        levels = depths[keep]
+        # Markers only help while individual levels can be told apart
+        mode = 'lines+markers' if keep.shape[0] <= self.plot_px//4 else 'lines'
+        traces = []
+        for i in range(profiles.shape[1]):
+            traces.append(self.fig.trace('scattergl',
+                x=values[:, i],
+                y=levels[:, i],
+                mode=mode,
+                hovertemplate=hovertemplate,
+                name=f'{loc_names[i]}',
+                marker=dict(color=colors[i], size=5),
+                line=dict(color=hex_to_rgba(colors[i], 0.75), width=1)
+            ))
+        return traces
+
+    def aggregate_traces(self, profiles, depths, color, units):
+        """Median profile with percentile envelopes across all locations."""
+        stats = nan_percentiles(profiles, [50] + [q for pair in ENVELOPE_PERCENTILES for q in pair])
+        # The envelopes share the depth levels kept for the median so the bands stay aligned
+        keep = minmax_decimate(stats[50][:, np.newaxis], self.plot_px)[:, 0]
+        levels = depths[keep]
+        traces = []
+        for alpha, (lo, hi) in zip((0.15, 0.3), ENVELOPE_PERCENTILES):
+            traces.append(self.fig.trace('scattergl', x=stats[lo][keep], y=levels, mode='lines', line=dict(width=0, color=color),
+                                       name=f'P{lo}', hoverinfo='skip', showlegend=False))
+            traces.append(self.fig.trace('scattergl', x=stats[hi][keep], y=levels, mode='lines', line=dict(width=0, color=color),
+                                       fill='tonextx', fillcolor=hex_to_rgba(color, alpha), name=f'P{lo}-P{hi}',
+                                       hovertemplate=f'P{hi}: %{{x:.2f}} {units}, Depth %{{y}} m<extra></extra>'))
+        traces.append(self.fig.trace('scattergl', x=stats[50][keep], y=levels, mode='lines', line=dict(color=color, width=2),
+                                   name=f'Median ({profiles.shape[1]} pts)',
+                                   hovertemplate=f'Median: %{{x:.2f}} {units}, Depth %{{y}} m<extra></extra>'))
+        return traces
+
+    def region_statistics(self, region, date_idx, depth_idx):
+        """Area-weighted T and S statistics over a selected region, cached per (region, time, depths)."""
+        key = (json.dumps(region, sort_keys=True), int(date_idx), depth_idx.start, depth_idx.stop, depth_idx.step)
+        def build():
+            mask = region_mask(region, self.lons, self.lats)
+            return (region_statistics(self.temp[date_idx, depth_idx], mask, self.lats),
+                    region_statistics(self.sal[date_idx, depth_idx], mask, self.lats))
+        return self._region_cache.get_or_build(key, build)
+
+    def region_traces(self, stats, depths, color, units):
+        """Area-weighted mean with a ±1 std band and the P10/P50/P90 profiles of a region."""
+        keep = minmax_decimate(stats['mean'][:, np.newaxis], self.plot_px)[:, 0]
+        levels = depths[keep]
+        mean, std = stats['mean'][keep], stats['std'][keep]
+        hover = f'%{{x:.2f}} {units}, Depth %{{y}} m<extra>%{{fullData.name}}</extra>'
+        return [
+            self.fig.trace('scattergl', x=mean - std, y=levels, mode='lines', line=dict(width=0, color=color),
+                         name='Region mean - std', hoverinfo='skip', showlegend=False),
+            self.fig.trace('scattergl', x=mean + std, y=levels, mode='lines', line=dict(width=0, color=color),
+                         fill='tonextx', fillcolor=hex_to_rgba(color, 0.2), name='Region ±1 std', hoverinfo='skip'),
+            self.fig.trace('scattergl', x=stats['p10'][keep], y=levels, mode='lines', line=dict(color=color, width=1, dash='dot'),
+                         name='Region P10', hovertemplate=hover),
+            self.fig.trace('scattergl', x=stats['p90'][keep], y=levels, mode='lines', line=dict(color=color, width=1, dash='dot'),
+                         name='Region P90', hovertemplate=hover),
+            self.fig.trace('scattergl', x=stats['p50'][keep], y=levels, mode='lines', line=dict(color=color, width=1, dash='dash'),
+                         name='Region median', hovertemplate=hover),
+            self.fig.trace('scattergl', x=mean, y=levels, mode='lines', line=dict(color=color, width=2.5),
+                         name='Region mean', hovertemplate=hover),
+        ]
+
+    def update_profiles(self, prof_loc, date_idx, depth_type, cur_date_str, main_depth_idx, region=None):
         # ================================ Profiles ====================================
 
-        if not prof_loc:
-            def_fig = go.Figure(layout=go.Layout(
+        if not prof_loc and not region:
+            def_fig = self.fig.figure(layout=dict(
                 height=self.styles.fig_height,
                 margin=self.styles.margins,
                 paper_bgcolor=self.styles.paper_bgcolor,
@@ -38,77 +197,73 @@ class Profiles:
                 depth_idx = slice(0, max_depth)
             else:
                 interval = int(depth_type[-2:])
-                depth_idx = slice(None, None, interval) 
+                depth_idx = slice(None, None, interval)
 
+            prof_loc = prof_loc or []
+            depths = np.asarray(self.depths[depth_idx])
             # Locate the closest index from lat and lon
-            lat_idx = []
-            lon_idx = []
-            loc_names = []
-            temp_profiles = []
-            salinity_profiles = []
-            for loc in prof_loc:
-                lat = loc[0]
-                lon = loc[1]
-                loc_names.append(f'{round(lat,2)},{round(lon,2)}')
-                lat_idx = np.argmin(np.abs(self.lats - lat))  # Use self.lats (numpy array)
-                lon_idx = np.argmin(np.abs(self.lons - lon))  # Use self.lons (numpy array)
-                temp_profiles.append(self.temp[date_idx, depth_idx, lat_idx, lon_idx])  # Use self.temp
-                salinity_profiles.append(self.sal[date_idx, depth_idx, lat_idx, lon_idx])  # Use self.sal
-            # Helper to convert hex color to RGBA with custom alpha for line styling
-            def hex_to_rgba(hex_color: str, alpha: float) -> str:
-                hex_color = hex_color.lstrip('#')
-                r = int(hex_color[0:2], 16)
-                g = int(hex_color[2:4], 16)
-                b = int(hex_color[4:6], 16)
-                return f'rgba({r}, {g}, {b}, {alpha})'
+            loc_names = [f'{round(loc[0],2)},{round(loc[1],2)}' for loc in prof_loc]
+            if prof_loc:
+                temp_profiles, salinity_profiles = self.extract_profiles(prof_loc, date_idx, depth_idx)
+            else:
+                temp_profiles = salinity_profiles = np.empty((depths.size, 0))
+            colors = self.styles.color_cycle(len(prof_loc))
+            aggregate = len(prof_loc) > self.aggregate_threshold
+            region_temp, region_sal = self.region_statistics(region, date_idx, depth_idx) if region else (None, None)
 
             # --------------- Temp profile -------------------
-            fig_temp_prof = go.Figure()
-            for i, temp_profile in enumerate(temp_profiles):
-                base_color = self.styles.colors[i]
-                fig_temp_prof.add_trace(go.Scatter(
-                    x=temp_profile,
-                    y=self.depths[depth_idx],
-                    mode='lines+markers',
-                    hovertemplate='Temp: %{x:.1f} °C, Depth %{y} m<extra></extra>',
-                    name=f'{loc_names[i]}',
-                    marker=dict(color=base_color),
-                    line=dict(color=hex_to_rgba(base_color, 0.75), width=1)
-                ))
-            
-            fig_temp_prof.update_layout(
+            if aggregate:
+                temp_traces = self.aggregate_traces(temp_profiles, depths, self.styles.colors[3], '°C')
+            else:
+                temp_traces = self.profile_traces(temp_profiles, depths, loc_names, colors,
+                                                  'Temp: %{x:.1f} °C, Depth %{y} m<extra></extra>')
+            if region_temp is not None:
+                temp_traces += self.region_traces(region_temp, depths, REGION_COLOR, '°C')
+
+            fig_temp_prof = self.fig.figure(temp_traces, dict(
                 title=dict(text=f"Synthetic T Profiles", font=dict(family=self.styles.font_family, size=self.styles.font_sizes['title']), y=0.98),
                 xaxis=dict(title=dict(text="Temperature (°C)", font=dict(size=self.styles.font_sizes['axis_title'])), tickfont=dict(size=self.styles.font_sizes['tick'])),
                 yaxis=dict(title=dict(text="Depth (m)", font=dict(size=self.styles.font_sizes['axis_title'])), autorange="reversed", tickfont=dict(size=self.styles.font_sizes['tick'])),
                 dragmode="pan",
-                height=int(self.styles.fig_height*1.1),  
+                height=self.fig_height,
                 margin=dict(l=self.styles.margins['l'], r=20, t=self.styles.margins['t'], b=self.styles.margins['b'], pad=0),
                 paper_bgcolor=self.styles.paper_bgcolor,
                 plot_bgcolor=self.styles.plot_bgcolor,
                 font=dict(family=self.styles.font_family, size=self.styles.font_sizes['base'])
-            )
+            ))
             # --------------- Salinity profile -------------------
-            fig_sal_prof = go.Figure()
-            for i, sal_profile in enumerate(salinity_profiles):
-                base_color = self.styles.colors[i]
-                fig_sal_prof.add_trace(go.Scatter(
-                    x=sal_profile,
-                    y=self.depths[depth_idx],
-                    mode='lines+markers',
-                    hovertemplate='Sal: %{x:.1f} PSU, Depth %{y} m<extra></extra>',
-                    name=f'{loc_names[i]}',
-                    marker=dict(color=base_color),
-                    line=dict(color=hex_to_rgba(base_color, 0.75), width=1)
-                ))
+            if aggregate:
+                sal_traces = self.aggregate_traces(salinity_profiles, depths, self.styles.colors[0], 'PSU')
+            else:
+                sal_traces = self.profile_traces(salinity_profiles, depths, loc_names, colors,
+                                                 'Sal: %{x:.1f} PSU, Depth %{y} m<extra></extra>')
+            if region_sal is not None:
+                sal_traces += self.region_traces(region_sal, depths, REGION_COLOR, 'PSU')
+
+            fig_sal_prof = self.fig.figure(sal_traces, dict(
+                title=dict(text=f"Synthetic S Profiles", font=dict(family=self.styles.font_family, size=self.styles.font_sizes['title']), y=0.98),
+                xaxis=dict(title=dict(text="Salinity (PSU)", font=dict(size=self.styles.font_sizes['axis_title'])), tickfont=dict(size=self.styles.font_sizes['tick'])),
+                yaxis=dict(title=dict(text="Depth (m)", font=dict(size=self.styles.font_sizes['axis_title'])), autorange="reversed", tickfont=dict(size=self.styles.font_sizes['tick'])),
+                dragmode="pan",
+                height=self.fig_height,
+                margin=dict(l=self.styles.margins['l'], r=20, t=self.styles.margins['t'], b=self.styles.margins['b'], pad=0),
+                paper_bgcolor=self.styles.paper_bgcolor,
+                plot_bgcolor=self.styles.plot_bgcolor,
+                font=dict(family=self.styles.font_family, size=self.styles.font_sizes['base'])
+            ))
 
             if main_depth_idx > 0:
-                min_sal = np.min([np.min(sal) for sal in salinity_profiles])
-                max_sal = np.max([np.max(sal) for sal in salinity_profiles])
-                min_temp = np.min([np.min(temp) for temp in temp_profiles])
-                max_temp = np.max([np.max(temp) for temp in temp_profiles])
+                if region_temp is not None:
+                    temp_profiles = np.column_stack([temp_profiles, region_temp['p10'], region_temp['p90']])
+                    salinity_profiles = np.column_stack([salinity_profiles, region_sal['p10'], region_sal['p90']])
+                min_sal = np.nanmin(salinity_profiles)
+                max_sal = np.nanmax(salinity_profiles)
+                min_temp = np.nanmin(temp_profiles)
+                max_temp = np.nanmax(temp_profiles)
 
                 # Add a line using shapes
-                fig_sal_prof.add_shape(
+                self.fig.shape(
+                    fig_sal_prof,
                     type="line",
                     x0=min_sal, y0=main_depth_idx, x1=max_sal, y1=main_depth_idx,
                     line=dict(
@@ -117,7 +272,8 @@ class Profiles:
                     )
                 )
 
-                fig_temp_prof.add_shape(
+                self.fig.shape(
+                    fig_temp_prof,
                     type="line",
                     x0=min_temp, y0=main_depth_idx, x1=max_temp, y1=main_depth_idx,
                     line=dict(
@@ -126,18 +282,6 @@ class Profiles:
                     )
                 )
 
-            fig_sal_prof.update_layout(
-                title=dict(text=f"Synthetic S Profiles", font=dict(family=self.styles.font_family, size=self.styles.font_sizes['title']), y=0.98),
-                xaxis=dict(title=dict(text="Salinity (PSU)", font=dict(size=self.styles.font_sizes['axis_title'])), tickfont=dict(size=self.styles.font_sizes['tick'])),
-                yaxis=dict(title=dict(text="Depth (m)", font=dict(size=self.styles.font_sizes['axis_title'])), autorange="reversed", tickfont=dict(size=self.styles.font_sizes['tick'])),
-                dragmode="pan",
-                height=int(self.styles.fig_height*1.1),  
-                margin=dict(l=self.styles.margins['l'], r=20, t=self.styles.margins['t'], b=self.styles.margins['b'], pad=0),
-                paper_bgcolor=self.styles.paper_bgcolor,
-                plot_bgcolor=self.styles.plot_bgcolor,
-                font=dict(family=self.styles.font_family, size=self.styles.font_sizes['base'])
-            )
-        
-        return [fig_temp_prof, fig_sal_prof]
 
+        return [fig_temp_prof, fig_sal_prof]
 
@@ -1,9 +1,60 @@
 
 import numpy as np
-import plotly.graph_objs as go
+from viz_utils.fastfig import FigureBuilder, dict_figures_enabled
 import cmocean.cm as cm
 import math
 
+def haversine(lat1, lon1, lat2, lon2):
+    """
+    Calculate the great-circle distance between two points
+    on the Earth specified in decimal degrees of latitude and longitude.
+    """
+    # Convert decimal degrees to radians
+    lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
+    
+    # Haversine formula
+    dlon = lon2 - lon1
+    dlat = lat2 - lat1
+    a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
+    c = 2 * math.asin(math.sqrt(a))
+    
+    # Radius of Earth in kilometers. Use 3956 for miles. Determines return value units.
+    r = 6371  # Use 6371 for kilometers
+    return c * r
+
+def depth_selection(depth_type):
+    """Depth index slice for a depth_selection value: 'upto500' is the first 500 levels, 'every10' every 10th level."""
+    if depth_type.find('upto') != -1:
+        return slice(0, int(depth_type[-3:]))
+    return slice(None, None, int(depth_type[-2:]))
+
+def transect_points(transect_loc, res):
+    """
+    Points every `res` degrees along a transect [[lat0, lon0], [lat1, lon1]].
+
+    Returns:
+    tuple: (lons, lats, dist, line_length) with dist the distance along the line in km (rounded) and
+    line_length its length in degrees.
+    """
+    x0 = transect_loc[0][1]
+    y0 = transect_loc[0][0]
+    x1 = transect_loc[1][1]
+    y1 = transect_loc[1][0]
+
+    # Calculate the Euclidean distance between start and end points
+    line_length = np.sqrt((x1 - x0)**2 + (y1 - y0)**2)
+    line_length_km = haversine(y0, x0, y1, x1)
+
+    # Determine the number of points based on the resolution
+    num_points = max(int(line_length / res), 2)
+
+    # Interpolating points along the line
+    lons = np.linspace(x0, x1, num_points)
+    lats = np.linspace(y0, y1, num_points)
+    dist = np.array(range(num_points))*line_length_km/num_points
+    dist = np.round(dist).astype(int)
+    return lons, lats, dist, line_length
+
 class Transects:
     def __init__(self, data, styles, res = 0.04): 
         # Ensure DataArrays with a leading time dimension for interpolation
@@ -17,29 +68,15 @@ class Transects:
         self.depths = data.variables['depth'][:]  # Add this line
         self.styles = styles
         self.res = res # Resolution for transect
+        self.fig = FigureBuilder(plain=dict_figures_enabled('transects'))
 
     def haversine(self, lat1, lon1, lat2, lon2):
-        """
-        Calculate the great-circle distance between two points
-        on the Earth specified in decimal degrees of latitude and longitude.
-        """
-        # Convert decimal degrees to radians
-        lat1, lon1, lat2, lon2 = map(math.radians, [lat1, lon1, lat2, lon2])
-        
-        # Haversine formula
-        dlon = lon2 - lon1
-        dlat = lat2 - lat1
-        a = math.sin(dlat/2)**2 + math.cos(lat1) * math.cos(lat2) * math.sin(dlon/2)**2
-        c = 2 * math.asin(math.sqrt(a))
-        
-        # Radius of Earth in kilometers. Use 3956 for miles. Determines return value units.
-        r = 6371  # Use 6371 for kilometers
-        return c * r
+        return haversine(lat1, lon1, lat2, lon2)
 
     def update_transects(self, transect_loc, date_idx, depth_type, cur_date_str):
         # Guard for empty or malformed transect
         if not transect_loc or len(transect_loc) < 2:
-            def_fig = go.Figure(layout=go.Layout(
+            def_fig = self.fig.figure(layout=dict(
                 height=self.styles.fig_height,
                 margin=self.styles.margins,
                 paper_bgcolor=self.styles.paper_bgcolor,
@@ -48,31 +85,9 @@ class Transects:
             ))
             return [def_fig, def_fig]
 
-        x0 = transect_loc[0][1]
-        y0 = transect_loc[0][0]
-        x1 = transect_loc[1][1]
-        y1 = transect_loc[1][0]
-
-        # Calculate the Euclidean distance between start and end points
-        line_length = np.sqrt((x1 - x0)**2 + (y1 - y0)**2)
-        line_length_km = self.haversine(y0, x0, y1, x1)
-        
-        # Determine the number of points based on the resolution
-        resolution = self.res
-        num_points = max(int(line_length / resolution), 2)
-        
-        # Interpolating points along the line
-        lons = np.linspace(x0, x1, num_points)
-        lats = np.linspace(y0, y1, num_points)
-        dist = np.array(range(num_points))*line_length_km/num_points
-        dist = np.round(dist).astype(int)
-        
-        if depth_type.find('upto') != -1:
-            max_depth = int(depth_type[-3:])
-            depth_idx = slice(0, max_depth)
-        else:
-            interval = int(depth_type[-2:])
-            depth_idx = slice(None, None, interval) 
+        lons, lats, dist, line_length = transect_points(transect_loc, self.res)
+        num_points = lons.size
+        depth_idx = depth_selection(depth_type)
 
         # Temperature
         temp_time_selected = self.temp.isel(time=date_idx, depth=depth_idx)
@@ -84,7 +99,7 @@ class Transects:
         sal_interp = sal_time_selected.interp(lat=('points', lats), lon=('points', lons))
 
         if line_length <= 0 or num_points < 2:
-            def_fig = go.Figure(layout=go.Layout(
+            def_fig = self.fig.figure(layout=dict(
                 height=self.styles.fig_height,
                 margin=self.styles.margins,
                 paper_bgcolor=self.styles.paper_bgcolor,
@@ -97,18 +112,17 @@ class Transects:
         # zoom, pan, select, lasso, orbit, turntable, zoomInGeo, zoomOutGeo, autoScale2d, resetScale2d, hoverClosestCartesian, hoverClosestGeo, hoverClosestGl2d, hoverClosestPie, toggleHover, resetViews, toggleSpikelines, resetViewMapbox
 
             # Temperature
-            fig_temp_trans = go.Figure(
-                data=[go.Heatmap(
-                    z=np.rot90(temp_interp, 2), 
+            fig_temp_trans = self.fig.figure(
+                data=[self.fig.trace('heatmap',
+                    z=np.rot90(np.asarray(temp_interp), 2), 
                     x=dist[::-1],
                     y=temp_interp.depth.values[::-1],
-                    colorscale=self.styles.cmocean_to_plotly(cm.thermal,256), 
+                    coloraxis='coloraxis',
                     hovertemplate='Temp: %{z:.1f} °C<extra></extra>',
-                    showscale=True,
-                    colorbar=dict(title={'text':'Temperature [°C]','side':'right'}, thickness=12, lenmode='fraction', len=0.88, y=0.5, x=1.0, xpad=0)
                 )], 
-                layout=go.Layout(
+                layout=dict(
                     title=dict(text=f"Synthetic T Transect", font=dict(family=self.styles.font_family, size=self.styles.font_sizes['title']), y=0.98),
+                    coloraxis=self.styles.coloraxis(cm.thermal, 'Temperature [°C]'),
                     xaxis=dict(title=dict(text="Distance (km)", font=dict(size=self.styles.font_sizes['axis_title'])), tickfont=dict(size=self.styles.font_sizes['tick']), showgrid=True, gridcolor='rgba(0,0,0,0.18)', gridwidth=1, layer='above traces'),
                     yaxis=dict(title=dict(text="Depth (m)", font=dict(size=self.styles.font_sizes['axis_title'])), autorange="reversed", tickfont=dict(size=self.styles.font_sizes['tick']), showgrid=True, gridcolor='rgba(0,0,0,0.18)', gridwidth=1, layer='above traces'),
                     dragmode="pan", 
@@ -121,18 +135,17 @@ class Transects:
             )
 
             # Salinity
-            fig_sal_trans = go.Figure(
-                data=[go.Heatmap(
-                    z=np.rot90(sal_interp, 2),
+            fig_sal_trans = self.fig.figure(
+                data=[self.fig.trace('heatmap',
+                    z=np.rot90(np.asarray(sal_interp), 2),
                     x=dist[::-1],
                     y=temp_interp.depth.values[::-1],
-                    colorscale=self.styles.cmocean_to_plotly(cm.haline,256), 
+                    coloraxis='coloraxis',
                     hovertemplate='Sal: %{z:.1f} PSU<extra></extra>',
-                    showscale=True,
-                    colorbar=dict(title={'text':'Salinity [PSU]','side':'right'}, thickness=12, lenmode='fraction', len=0.88, y=0.5, x=1.0, xpad=0)
                 )], 
-                layout=go.Layout(
+                layout=dict(
                     title=dict(text=f"Synthetic S Transect", font=dict(family=self.styles.font_family, size=self.styles.font_sizes['title']), y=0.98),
+                    coloraxis=self.styles.coloraxis(cm.haline, 'Salinity [PSU]'),
                     xaxis=dict(title=dict(text="Distance (km)", font=dict(size=self.styles.font_sizes['axis_title'])), tickfont=dict(size=self.styles.font_sizes['tick']), showgrid=True, gridcolor='rgba(0,0,0,0.18)', gridwidth=1, layer='above traces'),
                     yaxis=dict(title=dict(text="Depth (m)", font=dict(size=self.styles.font_sizes['axis_title'])), autorange="reversed", tickfont=dict(size=self.styles.font_sizes['tick']), showgrid=True, gridcolor='rgba(0,0,0,0.18)', gridwidth=1, layer='above traces'),
                     dragmode="pan", 
@@ -0,0 +1,264 @@
+"""
+Cache warm-up after a worker starts, so the first users after a restart or deploy do not pay for
+opening the latest file, building the view objects and the default figures.
+
+Figure callbacks wrapped with Warmup.recorded count the arguments they are called with. The counts
+of all workers are merged into a shared file (NESPRESO_WARMUP_FILE) covering the last
+NESPRESO_WARMUP_WINDOW_H hours, and survive restarts. Warm-up, run in a background thread of each
+worker (gunicorn post_fork, or the first request), then
+  1. prepares the default date (dataset, derived products, view objects),
+  2. builds the default figure set: each figure callback with the initial values of the page layout,
+  3. replays the NESPRESO_WARMUP_TOP most requested argument sets of recent traffic. Calls recorded
+     for what was then the default date are replayed for the current default date.
+Replayed calls go through the figure cache, which the workers share, so only the first worker to
+warm up builds them. /readyz reports the worker ready once warm-up has finished.
+"""
+import atexit
+import fcntl
+import functools
+import hashlib
+import inspect
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from collections import Counter
+
+logger = logging.getLogger(__name__)
+
+
+def layout_values(layout):
+    """{(component id, prop): value} of every property set on a component of a Dash layout tree."""
+    values = {}
+    stack = [layout]
+    while stack:
+        component = stack.pop()
+        if isinstance(component, (list, tuple)):
+            stack.extend(component)
+            continue
+        if not hasattr(component, 'to_plotly_json'):
+            continue
+        props = component.to_plotly_json().get('props', {})
+        component_id = props.get('id')
+        if isinstance(component_id, str):
+            for prop, value in props.items():
+                values[(component_id, prop)] = value
+        children = props.get('children')
+        if children is not None:
+            stack.append(children)
+    return values
+
+
+def initial_callback_args(app, name):
+    """
+    Arguments a page load passes to the callback function `name` (inputs, then states): the initial
+    values in app.layout. None if no callback of that name is registered.
+    """
+    values = layout_values(app.layout() if callable(app.layout) else app.layout)
+    for spec in app.callback_map.values():
+        callback = spec.get('callback')
+        if callback is not None and getattr(callback, '__name__', None) == name:
+            return [values.get((dep['id'], dep['property'])) for dep in spec['inputs'] + spec.get('state', [])]
+    return None
+
+
+class Warmup:
+    """
+    Records figure callback arguments and replays the default and most requested ones on start-up.
+
+    Parameters:
+    path (str): Shared JSON file with the recorded calls of all workers.
+    top_n (int): Recorded calls replayed by warm-up.
+    window_s (float): Calls not seen for this long are forgotten.
+    max_seconds (float): Warm-up stops replaying after this long.
+    flush_interval (float): Seconds between merges of this worker's counts into the shared file.
+    enabled (bool): Run warm-up at all (recording continues either way).
+    """
+
+    def __init__(self, path, top_n=20, window_s=24*3600, max_seconds=300, flush_interval=60, enabled=True,
+                 max_records=500):
+        self.path = path
+        self.top_n = top_n
+        self.window_s = window_s
+        self.max_seconds = max_seconds
+        self.flush_interval = flush_interval
+        self.enabled = enabled
+        self.max_records = max_records
+        self.callbacks = {}
+        self._counts = Counter()
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._last_flush = time.monotonic()
+        self._local = threading.local()
+        self._pid = None
+        self._state = {'state': 'pending' if enabled else 'disabled'}
+        self.prepare = None
+        self.default_calls = None
+        self.default_date = None
+        self.valid_date = None
+        atexit.register(self.flush)
+
+    def setup(self, prepare, default_calls, default_date, valid_date):
+        """
+        Parameters:
+        prepare (callable): Warms the non-figure caches of a date (dataset, derived products, views).
+        default_calls (callable): [(callback name, args)] of the default figure set.
+        default_date (callable): Current default date (YYYY-MM-DD).
+        valid_date (callable): Whether a recorded date can still be served.
+        """
+        self.prepare = prepare
+        self.default_calls = default_calls
+        self.default_date = default_date
+        self.valid_date = valid_date
+
+    # Recording
+    def recorded(self, func, date_arg='cur_date_str'):
+        """Wrap figure callback `func` so its calls are counted and warm-up can replay them."""
+        signature = inspect.signature(func)
+        self.callbacks[func.__name__] = func
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not getattr(self._local, 'replaying', False):
+                try:
+                    bound = signature.bind(*args, **kwargs)
+                    self.record(func.__name__, list(bound.args), bound.arguments.get(date_arg))
+                except Exception as exc:
+                    logger.debug("Not recording %s: %s", func.__name__, exc)
+            return func(*args, **kwargs)
+        return wrapper
+
+    def record(self, name, args, date=None):
+        is_default = self.default_date is not None and date == self.default_date()
+        raw = json.dumps([name, args], sort_keys=True, default=str)
+        key = hashlib.sha1(raw.encode()).hexdigest()
+        with self._lock:
+            self._counts[key] += 1
+            self._calls[key] = {'name': name, 'args': json.loads(raw)[1], 'default_date': is_default}
+        if time.monotonic() - self._last_flush > self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        """Merge this worker's counts into the shared file."""
+        with self._lock:
+            counts, calls = self._counts, self._calls
+            self._counts, self._calls = Counter(), {}
+            self._last_flush = time.monotonic()
+        if not counts or not self.path:
+            return
+        now = time.time()
+        try:
+            os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+            with open(self.path + '.lock', 'w') as lock:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+                records = self._read()
+                for key, count in counts.items():
+                    record = records.setdefault(key, dict(calls[key], count=0))
+                    record['count'] += count
+                    record['default_date'] = calls[key]['default_date']
+                    record['last'] = now
+                records = {k: r for k, r in records.items() if now - r.get('last', 0) < self.window_s}
+                keep = sorted(records, key=lambda k: records[k]['count'], reverse=True)[:self.max_records]
+                fd, tmp = tempfile.mkstemp(dir=os.path.dirname(self.path) or '.', suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump({k: records[k] for k in keep}, f)
+                os.replace(tmp, self.path)
+        except OSError as exc:
+            logger.warning("Could not write warm-up keys to %s: %s", self.path, exc)
+
+    def _read(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def top_calls(self, n=None):
+        """Most requested recent calls as [(name, args)], the default date substituted where recorded for it."""
+        now = time.time()
+        records = [r for r in self._read().values() if now - r.get('last', 0) < self.window_s]
+        records.sort(key=lambda r: r.get('count', 0), reverse=True)
+        calls = []
+        for record in records[:self.top_n if n is None else n]:
+            args = record.get('args')
+            if isinstance(args, list) and record.get('default_date') and self.default_date is not None:
+                args = [self.default_date() if isinstance(a, str) and len(a) == 10 and a[4] == '-' else a for a in args]
+            calls.append((record.get('name'), args))
+        return calls
+
+    # Warm-up
+    def start(self):
+        """Run warm-up in a background thread of this process, once per process."""
+        if not self.enabled or self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._state = {'state': 'running', 'started': time.strftime('%Y-%m-%dT%H:%M:%S')}
+        threading.Thread(target=self.run, name='nespreso-warmup', daemon=True).start()
+
+    def run(self):
+        start = time.perf_counter()
+        self._local.replaying = True
+        done, errors, skipped = 0, 0, 0
+        try:
+            default = self.default_date()
+            self.prepare(default)
+            calls = list(self.default_calls()) + self.top_calls()
+            seen = set()
+            # Grouped by date so each day's views are built once; the default date goes first
+            dates = {}
+            for name, args in calls:
+                if not isinstance(args, list):
+                    # No initial arguments for it (not a registered callback) or an unreadable record
+                    skipped += 1
+                    continue
+                dates.setdefault(next((a for a in args if isinstance(a, str) and len(a) == 10 and a[4] == '-'), default),
+                                 []).append((name, args))
+            for date in sorted(dates, key=lambda d: d != default):
+                if not self.valid_date(date):
+                    skipped += len(dates[date])
+                    continue
+                for name, args in dates[date]:
+                    key = json.dumps([name, args], sort_keys=True, default=str)
+                    if key in seen or name not in self.callbacks:
+                        continue
+                    seen.add(key)
+                    if time.perf_counter() - start > self.max_seconds:
+                        skipped += 1
+                        continue
+                    try:
+                        self.callbacks[name](*args)
+                        done += 1
+                    except Exception as exc:
+                        errors += 1
+                        logger.warning("warm-up call %s failed: %s", name, exc)
+            # Keep the default day most recently used after replaying other days
+            self.prepare(default)
+            state = 'done'
+        except Exception as exc:
+            logger.exception("Warm-up failed: %s", exc)
+            state = 'failed'
+        finally:
+            self._local.replaying = False
+        seconds = round(time.perf_counter() - start, 2)
+        self._state = dict(self._state, state=state, finished=time.strftime('%Y-%m-%dT%H:%M:%S'), seconds=seconds,
+                           calls=done, errors=errors, skipped=skipped)
+        logger.info("warm-up %s calls=%d errors=%d skipped=%d seconds=%.1f", state, done, errors, skipped, seconds)
+
+    @property
+    def complete(self):
+        """Ready to serve: warm-up finished (even with failed calls) or is disabled."""
+        return self._state['state'] in ('done', 'failed', 'disabled')
+
+    def status(self):
+        return dict(self._state)
+
+
+warmup = Warmup(
+    path=os.environ.get('NESPRESO_WARMUP_FILE', os.path.join(tempfile.gettempdir(), 'nespreso_warmup_keys.json')),
+    top_n=int(os.environ.get('NESPRESO_WARMUP_TOP', '20')),
+    window_s=float(os.environ.get('NESPRESO_WARMUP_WINDOW_H', '24'))*3600,
+    max_seconds=float(os.environ.get('NESPRESO_WARMUP_MAX_S', '300')),
+    enabled=os.environ.get('NESPRESO_WARMUP', '1') != '0',
+)
@@ -12,7 +12,7 @@ LOG_PATH = os.environ.get('NESPRESO_VIZ_LOG') or os.path.join(BASE_DIR, 'wsgi.lo
 try:
     os.makedirs(os.path.dirname(LOG_PATH), exist_ok=True)
     handler = RotatingFileHandler(LOG_PATH, maxBytes=2_000_000, backupCount=3)
-    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(message)s')
+    formatter = logging.Formatter('%(asctime)s [%(levelname)s] %(name)s: %(message)s')
     handler.setFormatter(formatter)
     root_logger = logging.getLogger()
     root_logger.setLevel(logging.INFO)